@@ -1,9 +1,213 @@
+import base64
 import json
 import os
-import psycopg2
-from typing import Dict, Any, List
-from datetime import datetime
+from pg_pool import ConnectionPool
+from typing import Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
 
+DSN = os.environ.get('DATABASE_URL')
+
+HISTORY_RAW_MAX_WINDOW = timedelta(hours=int(os.environ.get('HISTORY_RAW_MAX_HOURS', '8')))
+HISTORY_HOURLY_MAX_WINDOW = timedelta(days=int(os.environ.get('HISTORY_HOURLY_MAX_DAYS', '31')))
+
+FAVICON_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+db_pool = ConnectionPool(DSN)
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    """
+    ISO 8601 -> naive UTC, как хранятся TIMESTAMP в БД
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def get_server_history(cur: Any, query_params: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """
+    История онлайна сервера за период. Разрешение подбирается по длине окна:
+    сырые поминутные замеры, часовые или дневные агрегаты, чтобы график
+    за любой период укладывался в несколько сотен точек
+    """
+    server_id = query_params.get('id')
+    if not server_id:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'ID сервера обязателен'})
+        }
+    
+    try:
+        date_to = _parse_time(query_params.get('to')) or datetime.now(timezone.utc).replace(tzinfo=None)
+        date_from = _parse_time(query_params.get('from')) or date_to - timedelta(hours=24)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Неверный формат даты'})
+        }
+    
+    window = date_to - date_from
+    if window <= HISTORY_RAW_MAX_WINDOW:
+        finest = 'raw'
+    elif window <= HISTORY_HOURLY_MAX_WINDOW:
+        finest = 'hour'
+    else:
+        finest = 'day'
+    
+    # Явное разрешение мельче допустимого для окна огрубляется,
+    # иначе resolution=raw за год вернул бы сотни тысяч строк
+    order = ('raw', 'hour', 'day')
+    resolution = query_params.get('resolution')
+    if resolution not in order or order.index(resolution) < order.index(finest):
+        resolution = finest
+    
+    if resolution == 'raw':
+        cur.execute(
+            "SELECT sampled_at, online_players, online_players, online_players, "
+            "CASE WHEN is_online THEN 1.0 ELSE 0.0 END, CASE WHEN is_online THEN ping END "
+            "FROM server_stats_samples "
+            "WHERE server_id = %s AND sampled_at >= %s AND sampled_at <= %s "
+            "ORDER BY sampled_at",
+            (server_id, date_from, date_to)
+        )
+    else:
+        table = 'server_stats_hourly' if resolution == 'hour' else 'server_stats_daily'
+        cur.execute(
+            f"SELECT bucket, min_players, sum_players::float / samples, max_players, "
+            f"online_samples::float / samples, "
+            f"CASE WHEN online_samples > 0 THEN sum_ping::float / online_samples END "
+            f"FROM {table} "
+            f"WHERE server_id = %s AND bucket >= date_trunc('{resolution}', %s::timestamp) AND bucket <= %s "
+            f"ORDER BY bucket",
+            (server_id, date_from, date_to)
+        )
+    
+    points = []
+    for row in cur.fetchall():
+        points.append({
+            'time': row[0].isoformat(),
+            'minPlayers': row[1],
+            'avgPlayers': round(float(row[2]), 2),
+            'maxPlayers': row[3],
+            'uptime': round(float(row[4]), 4),
+            'avgPing': round(float(row[5]), 1) if row[5] is not None else None
+        })
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({
+            'success': True,
+            'serverId': server_id,
+            'resolution': resolution,
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'points': points
+        })
+    }
+
+def get_player_presence(cur: Any, query_params: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """
+    На каком сервере сейчас игрок: поиск по первичному ключу player_presence.
+    Для онлайн-игрока lastSeen - время последней проверки сервера (с точностью
+    до MONITOR_STATS_HEARTBEAT server-monitor, по умолчанию минута)
+    """
+    name = (query_params.get('name') or '').strip()
+    if not name:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Ник игрока обязателен'})
+        }
+    
+    cur.execute(
+        "SELECT p.server_id, m.name, p.player_name, p.online, p.joined_at, "
+        "CASE WHEN p.online THEN COALESCE(s.last_update, p.last_seen_at) ELSE p.last_seen_at END "
+        "FROM player_presence p "
+        "JOIN monitoring_servers m ON m.id = p.server_id "
+        "LEFT JOIN server_stats s ON s.server_id = p.server_id "
+        "WHERE p.player_key = %s "
+        "ORDER BY p.online DESC, p.last_seen_at DESC",
+        (name.lower(),)
+    )
+    
+    servers = []
+    for row in cur.fetchall():
+        servers.append({
+            'serverId': row[0],
+            'serverName': row[1],
+            'playerName': row[2],
+            'online': row[3],
+            'joinedAt': row[4].isoformat() if row[4] else None,
+            'lastSeen': row[5].isoformat() if row[5] else None
+        })
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': json.dumps({
+            'success': True,
+            'player': servers[0]['playerName'] if servers else name,
+            'online': any(server['online'] for server in servers),
+            'servers': servers
+        })
+    }
+
+def get_favicon(cur: Any, query_params: Dict[str, Any], event: Dict[str, Any],
+                headers: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Иконка сервера по хэшу содержимого. Под одним хэшем картинка никогда
+    не меняется, поэтому ответ кэшируется браузером и CDN навсегда
+    """
+    favicon_hash = (query_params.get('hash') or '').lower()
+    if len(favicon_hash) != 64 or any(c not in '0123456789abcdef' for c in favicon_hash):
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Неверный хэш иконки'})
+        }
+    
+    etag = f'"{favicon_hash}"'
+    request_headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if request_headers.get('if-none-match') == etag:
+        return {
+            'statusCode': 304,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Cache-Control': FAVICON_CACHE_CONTROL,
+                'ETag': etag
+            },
+            'body': ''
+        }
+    
+    cur.execute("SELECT data FROM server_favicons WHERE hash = %s", (favicon_hash,))
+    row = cur.fetchone()
+    if not row or not bytes(row[0]).startswith(PNG_SIGNATURE):
+        return {
+            'statusCode': 404,
+            'headers': headers,
+            'body': json.dumps({'error': 'Иконка не найдена'})
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'image/png',
+            'X-Content-Type-Options': 'nosniff',
+            'Access-Control-Allow-Origin': '*',
+            'Cache-Control': FAVICON_CACHE_CONTROL,
+            'ETag': etag
+        },
+        'isBase64Encoded': True,
+        'body': base64.b64encode(bytes(row[0])).decode('ascii')
+    }
+
+@db_pool.report_stats
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для управления мониторингом серверов
@@ -39,16 +243,25 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'DATABASE_URL не настроен'})
             }
         
-        conn = psycopg2.connect(db_url)
+        conn = db_pool.getconn()
         cur = conn.cursor()
         
         if method == 'GET':
             query_params = event.get('queryStringParameters', {}) or {}
             server_id = query_params.get('id')
             
+            if query_params.get('action') == 'history':
+                return get_server_history(cur, query_params, headers)
+            
+            if query_params.get('action') == 'favicon':
+                return get_favicon(cur, query_params, event, headers)
+            
+            if query_params.get('action') == 'player':
+                return get_player_presence(cur, query_params, headers)
+            
             if server_id:
                 cur.execute(
-                    "SELECT id, name, address, port, version, description, max_players, is_active, created_at, updated_at "
+                    "SELECT id, name, address, port, version, description, max_players, is_active, created_at, updated_at, query_port "
                     "FROM monitoring_servers WHERE id = %s",
                     (server_id,)
                 )
@@ -71,11 +284,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'maxPlayers': row[6],
                     'isActive': row[7],
                     'createdAt': row[8].isoformat() if row[8] else None,
-                    'updatedAt': row[9].isoformat() if row[9] else None
+                    'updatedAt': row[9].isoformat() if row[9] else None,
+                    'queryPort': row[10]
                 }
                 
                 cur.execute(
-                    "SELECT online_players, max_players, ping, is_online, version, motd, last_update "
+                    "SELECT online_players, max_players, ping, is_online, version, motd, last_update, favicon_hash "
                     "FROM server_stats WHERE server_id = %s",
                     (server_id,)
                 )
@@ -89,7 +303,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isOnline': stats_row[3],
                         'version': stats_row[4],
                         'motd': stats_row[5],
-                        'lastUpdate': stats_row[6].isoformat() if stats_row[6] else None
+                        'lastUpdate': stats_row[6].isoformat() if stats_row[6] else None,
+                        'faviconHash': stats_row[7]
                     }
                 
                 return {
@@ -100,7 +315,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             else:
                 cur.execute(
                     "SELECT m.id, m.name, m.address, m.port, m.version, m.description, m.max_players, m.is_active, "
-                    "s.online_players, s.max_players, s.ping, s.is_online, s.motd, s.last_update "
+                    "s.online_players, s.max_players, s.ping, s.is_online, s.motd, s.last_update, s.favicon_hash, m.query_port "
                     "FROM monitoring_servers m "
                     "LEFT JOIN server_stats s ON m.id = s.server_id "
                     "WHERE m.is_active = true "
@@ -118,7 +333,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'version': row[4],
                         'description': row[5],
                         'maxPlayers': row[6],
-                        'isActive': row[7]
+                        'isActive': row[7],
+                        'queryPort': row[15]
                     }
                     
                     if row[8] is not None:
@@ -128,7 +344,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             'ping': row[10],
                             'isOnline': row[11],
                             'motd': row[12],
-                            'lastUpdate': row[13].isoformat() if row[13] else None
+                            'lastUpdate': row[13].isoformat() if row[13] else None,
+                            'faviconHash': row[14]
                         }
                     
                     servers.append(server)
@@ -152,8 +369,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
             
             cur.execute(
-                "INSERT INTO monitoring_servers (id, name, address, port, version, description, max_players, is_active) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+                "INSERT INTO monitoring_servers (id, name, address, port, version, description, max_players, is_active, query_port) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
                 "RETURNING id",
                 (
                     body_data['id'],
@@ -163,7 +380,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     body_data.get('version', ''),
                     body_data.get('description', ''),
                     body_data['maxPlayers'],
-                    body_data.get('isActive', True)
+                    body_data.get('isActive', True),
+                    body_data.get('queryPort') or None
                 )
             )
             
@@ -190,7 +408,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             cur.execute(
                 "UPDATE monitoring_servers SET "
                 "name = %s, address = %s, port = %s, version = %s, description = %s, "
-                "max_players = %s, is_active = %s, updated_at = CURRENT_TIMESTAMP "
+                "max_players = %s, is_active = %s, query_port = %s, updated_at = CURRENT_TIMESTAMP "
                 "WHERE id = %s",
                 (
                     body_data.get('name'),
@@ -200,6 +418,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     body_data.get('description', ''),
                     body_data.get('maxPlayers'),
                     body_data.get('isActive', True),
+                    body_data.get('queryPort') or None,
                     server_id
                 )
             )
@@ -248,4 +467,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            db_pool.putconn(conn)
\ No newline at end of file
@@ -1,10 +1,18 @@
 import json
 import os
-import psycopg2
+from pg_pool import ConnectionPool
+from idempotency import get_header, run_idempotent
 from typing import Dict, Any
 import uuid
 from datetime import datetime
 
+DSN = os.environ.get('DATABASE_URL')
+
+
+db_pool = ConnectionPool(DSN)
+
+
+@db_pool.report_stats
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Обработка покупки доната с выдачей через RCON
@@ -20,7 +28,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
@@ -38,6 +46,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Метод не поддерживается'})
         }
     
+    try:
+        body_data = json.loads(event.get('body') or '{}')
+    except json.JSONDecodeError:
+        return {
+            'statusCode': 400,
+            'headers': headers,
+            'body': json.dumps({'error': 'Некорректный JSON'})
+        }
+    
+    # Повтор с тем же paymentId не обрабатывает платёж второй раз
+    idempotency_key = get_header(event, 'Idempotency-Key') or body_data.get('paymentId')
+    try:
+        return run_idempotent(db_pool, event, 'donation', idempotency_key, process_donation)
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': headers,
+            'body': json.dumps({'error': str(e)})
+        }
+
+
+def process_donation(event: Dict[str, Any]) -> Dict[str, Any]:
+    headers = {
+        'Content-Type': 'application/json',
+        'Access-Control-Allow-Origin': '*'
+    }
+    
     try:
         body_data = json.loads(event.get('body', '{}'))
         
@@ -55,10 +90,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 500,
                 'headers': headers,
-                'body': json.dumps({'error': 'DATABASE_URL не настроен'})
+                'body': json.dumps({'error': 'DATABASE_URL не настроен'}),
+                '_releaseKey': True
             }
         
-        conn = psycopg2.connect(db_url)
+        conn = db_pool.getconn()
         cur = conn.cursor()
         
         cur.execute(
@@ -99,13 +135,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     except Exception as e:
+        # Здесь только чтение из базы, ничего не выдано - повтор безопасен
         return {
             'statusCode': 500,
             'headers': headers,
-            'body': json.dumps({'error': str(e)})
+            'body': json.dumps({'error': str(e)}),
+            '_releaseKey': True
         }
     finally:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            db_pool.putconn(conn)
\ No newline at end of file
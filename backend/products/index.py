@@ -5,57 +5,911 @@ Args: event - dict с httpMethod, body, queryStringParameters, params
 Returns: HTTP response dict с данными товаров и покупок
 '''
 
+import base64
+import csv
+import hashlib
+import io
 import json
 import os
-import psycopg2
+import secrets
+import select
+import socket
+import struct
+import threading
+from psycopg2.extras import execute_values
+from pg_pool import ConnectionPool
+from idempotency import get_header, run_idempotent
 import time
-from typing import Dict, Any
-import urllib.request
-import urllib.error
-
-try:
-    from mcrcon import MCRcon
-    HAS_RCON = True
-except ImportError:
-    HAS_RCON = False
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+import http.client
+import urllib.parse
 
 DSN = os.environ.get('DATABASE_URL')
 
-def send_webhook_notification(purchase_data: Dict[str, Any]) -> None:
+db_pool = ConnectionPool(DSN)
+
+
+RCON_TIMEOUT = float(os.environ.get('RCON_TIMEOUT', '5'))
+RCON_MAX_WORKERS = int(os.environ.get('RCON_MAX_WORKERS', '8'))
+RCON_POOL_MAX_PER_SERVER = int(os.environ.get('RCON_POOL_MAX_PER_SERVER', '2'))
+RCON_POOL_IDLE_TIMEOUT = float(os.environ.get('RCON_POOL_IDLE_TIMEOUT', '300'))
+RCON_DELIVERY_BUDGET = float(os.environ.get('RCON_DELIVERY_BUDGET', str(RCON_TIMEOUT * 3)))
+PURCHASE_DELIVERY_MODE = os.environ.get('PURCHASE_DELIVERY_MODE', 'sync')
+PURCHASE_QUEUE_BATCH = int(os.environ.get('PURCHASE_QUEUE_BATCH', '50'))
+PURCHASE_CLAIM_TIMEOUT = int(os.environ.get('PURCHASE_CLAIM_TIMEOUT', '300'))
+PURCHASE_WORKER_BUDGET = float(os.environ.get('PURCHASE_WORKER_BUDGET', '50'))
+RESPONSE_JSON_MODE = os.environ.get('RESPONSE_JSON_MODE', 'python')
+CART_MAX_ITEMS = int(os.environ.get('CART_MAX_ITEMS', '20'))
+CART_MAX_QUANTITY = int(os.environ.get('CART_MAX_QUANTITY', '64'))
+PURCHASES_PAGE_MAX = int(os.environ.get('PURCHASES_PAGE_MAX', '500'))
+PLAYER_SUGGEST_MAX = int(os.environ.get('PLAYER_SUGGEST_MAX', '20'))
+CATALOG_PAGE_MAX = int(os.environ.get('CATALOG_PAGE_MAX', '100'))
+CATALOG_FILTER_PARAMS = ('category', 'minPrice', 'maxPrice', 'popular', 'discounted', 'q', 'limit', 'cursor')
+IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', '10000'))
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', '1000'))
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', '5'))
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', '8'))
+WEBHOOK_BATCH = int(os.environ.get('WEBHOOK_BATCH', '100'))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+WEBHOOK_RETRY_BASE = float(os.environ.get('WEBHOOK_RETRY_BASE', '30'))
+WEBHOOK_RETRY_MAX = float(os.environ.get('WEBHOOK_RETRY_MAX', '21600'))
+WEBHOOK_SETTINGS_TTL = float(os.environ.get('WEBHOOK_SETTINGS_TTL', '60'))
+WEBHOOK_DISPATCH_BUDGET = float(os.environ.get('WEBHOOK_DISPATCH_BUDGET', '50'))
+
+
+ID_EPOCH_MS = 1704067200000
+ID_WORKER_BITS = 26
+ID_SEQUENCE_BITS = 12
+ID_LENGTH = 16
+ID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ID_INSERT_ATTEMPTS = 3
+UNIQUE_VIOLATION = '23505'
+
+
+class IdGenerator:
+    '''
+    Snowflake-подобные id: 42 бита миллисекунд от ID_EPOCH_MS, 26 бит номера
+    воркера и 12 бит счётчика внутри миллисекунды. Строка - 16 символов
+    base32 (Crockford) фиксированной длины, поэтому сортировка строк совпадает
+    с порядком создания и вставки идут в правый край B-дерева. Номер воркера
+    без ID_WORKER_ID случайный: 26 бит делают совпадение у двух контейнеров
+    маловероятным, а на редкий повтор id вставки отвечают новым id
+    '''
+
+    def __init__(self, worker_id: int):
+        self.worker_id = worker_id & ((1 << ID_WORKER_BITS) - 1)
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_int(self) -> int:
+        with self._lock:
+            now = int(time.time() * 1000) - ID_EPOCH_MS
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # Та же миллисекунда или часы ушли назад: продолжаем счётчик,
+                # а когда он исчерпан - занимаем следующую миллисекунду
+                self._sequence = (self._sequence + 1) & ((1 << ID_SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    self._last_ms += 1
+            return (self._last_ms << (ID_WORKER_BITS + ID_SEQUENCE_BITS)) \
+                | (self.worker_id << ID_SEQUENCE_BITS) | self._sequence
+
+    def next_id(self) -> str:
+        value = self.next_int()
+        chars = []
+        for _ in range(ID_LENGTH):
+            chars.append(ID_ALPHABET[value & 31])
+            value >>= 5
+        return ''.join(reversed(chars))
+
+
+# Номер воркера: из окружения или случайный на каждый контейнер
+id_generator = IdGenerator(int(os.environ.get('ID_WORKER_ID') or secrets.randbits(ID_WORKER_BITS)))
+
+
+def is_unique_violation(error: Exception) -> bool:
+    return getattr(error, 'pgcode', None) == UNIQUE_VIOLATION
+
+
+class RconError(Exception):
+    pass
+
+
+class RconResultUnknown(RconError):
+    '''
+    Команда ушла на сервер (или могла уйти), но ответа нет: считать её
+    невыданной и выдавать повторно нельзя
+    '''
+    pass
+
+
+class RconClient:
+    '''
+    Клиент Source RCON. Таймауты задаются на сокете, а не через SIGALRM,
+    как в mcrcon, поэтому клиент можно использовать из пула потоков
+    '''
+
+    AUTH = 3
+    EXEC_COMMAND = 2
+    AUTH_RESPONSE = 2
+
+    def __init__(self, host: str, port: int, password: str, timeout: float = RCON_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+        self.sock: Optional[socket.socket] = None
+        self.deadline: Optional[float] = None
+        self._request_id = 0
+
+    def __enter__(self) -> 'RconClient':
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def connect(self) -> None:
+        self.sock = socket.create_connection((self.host, self.port), timeout=self._op_timeout())
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+        request_id = self._send(self.AUTH, self.password)
+        
+        while True:
+            response_id, packet_type, _ = self._read_packet()
+            if packet_type == self.AUTH_RESPONSE:
+                break
+        
+        if response_id == -1 or response_id != request_id:
+            self.close()
+            raise RconError('Неверный пароль RCON')
+
+    def command(self, command: str) -> str:
+        if self.sock is None:
+            raise RconError('RCON соединение не установлено')
+        # Срок уже истёк - команда не отправляется вовсе
+        self._op_timeout()
+        
+        try:
+            request_id = self._send(self.EXEC_COMMAND, command)
+            response_id, _, payload = self._read_packet()
+        except Exception as e:
+            raise RconResultUnknown(f'Команда отправлена, ответ не получен: {str(e) or type(e).__name__}') from e
+        if response_id != request_id:
+            raise RconResultUnknown('Неожиданный ответ RCON')
+        return payload
+
+    def is_alive(self) -> bool:
+        """
+        Простаивающий сокет не должен быть читаемым: если он читаем,
+        сервер закрыл соединение или прислал что-то лишнее
+        """
+        if self.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            finally:
+                self.sock = None
+
+    def _op_timeout(self) -> float:
+        """
+        Таймаут очередной операции с сокетом: не больше timeout и не
+        дальше deadline, если он задан
+        """
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('Истёк срок выдачи RCON')
+        return min(self.timeout, remaining)
+
+    def _send(self, packet_type: int, payload: str) -> int:
+        self._request_id += 1
+        data = struct.pack('<ii', self._request_id, packet_type) + payload.encode('utf-8') + b'\x00\x00'
+        self.sock.settimeout(self._op_timeout())
+        self.sock.sendall(struct.pack('<i', len(data)) + data)
+        return self._request_id
+
+    def _read_packet(self) -> Tuple[int, int, str]:
+        length = struct.unpack('<i', self._read_exact(4))[0]
+        data = self._read_exact(length)
+        response_id, packet_type = struct.unpack('<ii', data[:8])
+        return response_id, packet_type, data[8:-2].decode('utf-8', errors='replace')
+
+    def _read_exact(self, size: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < size:
+            self.sock.settimeout(self._op_timeout())
+            chunk = self.sock.recv(size - len(buf))
+            if not chunk:
+                raise RconError('RCON соединение закрыто сервером')
+            buf += chunk
+        return bytes(buf)
+
+
+class RconPool:
+    '''
+    Авторизованные RCON-сессии по rcon_servers.id, живущие между тёплыми
+    вызовами. Число одновременных сессий на сервер ограничено; при смене
+    адреса или пароля сервера, ошибке подключения и когда сервер пропал
+    из rcon_servers старые сессии закрываются
+    '''
+
+    def __init__(self, max_per_server: int = RCON_POOL_MAX_PER_SERVER,
+                 idle_timeout: float = RCON_POOL_IDLE_TIMEOUT):
+        self.max_per_server = max(1, max_per_server)
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._servers: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def session(self, server_id: str, address: str, port: int, password: str,
+                deadline: Optional[float] = None) -> Iterator[RconClient]:
+        """
+        deadline (time.monotonic()) ограничивает всё сразу: ожидание слота,
+        подключение с авторизацией и команды внутри сессии
+        """
+        entry = self._entry(server_id, (address, port, password))
+        slot_timeout = RCON_TIMEOUT if deadline is None else min(RCON_TIMEOUT, deadline - time.monotonic())
+        if slot_timeout <= 0 or not entry['slots'].acquire(timeout=slot_timeout):
+            raise RconError('Все RCON-сессии сервера заняты')
+        
+        client = None
+        broken = False
+        try:
+            try:
+                client = self._checkout(entry, address, port, password, deadline)
+            except Exception:
+                # Сервер недоступен или сменил пароль: остальные простаивающие
+                # сессии к нему, скорее всего, тоже мертвы
+                self.invalidate(server_id)
+                raise
+            yield client
+        except Exception:
+            broken = True
+            raise
+        finally:
+            if client is not None:
+                client.deadline = None
+                self._checkin(server_id, entry, client, broken)
+            entry['slots'].release()
+
+    def invalidate(self, server_id: str) -> None:
+        with self._lock:
+            entry = self._servers.pop(server_id, None)
+        if entry:
+            self._close_idle(entry)
+
+    def _entry(self, server_id: str, key: Tuple[str, int, str]) -> Dict[str, Any]:
+        stale = None
+        with self._lock:
+            entry = self._servers.get(server_id)
+            if entry is None or entry['key'] != key:
+                stale = entry
+                entry = {
+                    'key': key,
+                    'idle': [],
+                    'slots': threading.BoundedSemaphore(self.max_per_server)
+                }
+                self._servers[server_id] = entry
+        if stale:
+            self._close_idle(stale)
+        return entry
+
+    def _checkout(self, entry: Dict[str, Any], address: str, port: int, password: str,
+                  deadline: Optional[float]) -> RconClient:
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not entry['idle']:
+                    break
+                client, returned_at = entry['idle'].pop()
+            if now - returned_at < self.idle_timeout and client.is_alive():
+                client.deadline = deadline
+                return client
+            client.close()
+        
+        client = RconClient(address, port, password)
+        client.deadline = deadline
+        client.connect()
+        return client
+
+    def _checkin(self, server_id: str, entry: Dict[str, Any], client: RconClient, broken: bool) -> None:
+        with self._lock:
+            current = self._servers.get(server_id) is entry
+            if not broken and current and client.sock is not None:
+                entry['idle'].append((client, time.monotonic()))
+                return
+        client.close()
+
+    def _close_idle(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            idle, entry['idle'] = entry['idle'], []
+        for client, _ in idle:
+            client.close()
+
+
+rcon_pool = RconPool()
+
+
+def run_rcon_command(server_id: str, address: str, port: int, password: str, command: str,
+                     deadline: Optional[float] = None) -> str:
+    with rcon_pool.session(server_id, address, port, password, deadline) as rcon:
+        return rcon.command(command)
+
+def deliver_to_servers(targets: List[Tuple[str, str, int, str]], command: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Выполняет команду выдачи на всех серверах одновременно.
+    targets - список (server_id, address, rcon_port, rcon_password).
+    failed - команда точно не отправлена; unknown - могла выполниться,
+    такую выдачу нельзя ни повторять, ни возвращать автоматически
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    targets = list({target[0]: target for target in targets}.values())
+    if not targets:
+        return results
+    
+    # Слот, подключение, авторизация и команда каждого потока укладываются
+    # в общий deadline, поэтому к концу ожидания потоки уже завершены;
+    # секунда запаса - на планировщик потоков
+    deadline = time.monotonic() + RCON_DELIVERY_BUDGET
+    executor = ThreadPoolExecutor(max_workers=min(len(targets), RCON_MAX_WORKERS))
+    futures = {
+        executor.submit(run_rcon_command, server_id, address, port, password, command, deadline): server_id
+        for server_id, address, port, password in targets
+    }
+    
+    done, not_done = wait(futures, timeout=RCON_DELIVERY_BUDGET + 1)
+    executor.shutdown(wait=False, cancel_futures=True)
+    
+    for future in done:
+        server_id = futures[future]
+        try:
+            results[server_id] = {'status': 'delivered', 'response': future.result(), 'error': None}
+        except RconResultUnknown as e:
+            results[server_id] = {'status': 'unknown', 'response': None, 'error': str(e)}
+        except Exception as e:
+            results[server_id] = {'status': 'failed', 'response': None, 'error': str(e) or type(e).__name__}
+    
+    for future in not_done:
+        results[futures[future]] = {'status': 'unknown', 'response': None, 'error': 'Нет ответа RCON за отведённое время'}
+    
+    return results
+
+def deliver_batch(server_id: str, server: Optional[Tuple[str, int, str]],
+                  items: List[Tuple[str, str]], deadline: float) -> List[Tuple[str, str, str, Optional[str], Optional[str]]]:
+    """
+    Выдаёт пачку покупок на одном сервере через одну RCON-сессию.
+    items - список (purchase_id, delivery_command). Всё укладывается в
+    deadline (time.monotonic()): не отправленные к нему команды - failed
+    """
+    if server is None:
+        # Сервер удалён или выключен - его сессии больше не понадобятся
+        rcon_pool.invalidate(server_id)
+        return [(purchase_id, server_id, 'failed', None, 'Сервер не найден') for purchase_id, _ in items]
+    
+    results = []
+    pending = list(items)
+    
+    while pending:
+        if time.monotonic() >= deadline:
+            results.extend(
+                (purchase_id, server_id, 'failed', None, 'Истёк срок выдачи RCON, команда не отправлена')
+                for purchase_id, _ in pending
+            )
+            break
+        
+        command_failed = False
+        try:
+            with rcon_pool.session(server_id, *server, deadline=deadline) as rcon:
+                while pending:
+                    purchase_id, command = pending.pop(0)
+                    try:
+                        results.append((purchase_id, server_id, 'delivered', rcon.command(command), None))
+                    except Exception as e:
+                        status = 'unknown' if isinstance(e, RconResultUnknown) else 'failed'
+                        results.append((purchase_id, server_id, status, None, str(e) or type(e).__name__))
+                        command_failed = True
+                        # После ошибки сокет в неизвестном состоянии: сессию выбрасываем,
+                        # остальные команды пойдут через новую
+                        raise
+        except Exception as e:
+            if not command_failed:
+                results.extend(
+                    (purchase_id, server_id, 'failed', None, str(e) or type(e).__name__)
+                    for purchase_id, _ in pending
+                )
+                pending = []
+    
+    return results
+
+def deliver_groups(groups: Dict[str, Dict[str, Any]], deadline: float) -> List[Tuple[str, str, str, Optional[str], Optional[str]]]:
+    """
+    Выдаёт пачки на все сервера параллельно, по потоку на сервер.
+    groups - server_id -> {'server': (address, port, password) или None,
+    'items': [(purchase_id, command)]}. Сессии и команды ограничены
+    deadline, поэтому ждём его с секундой запаса; пачки, не вернувшиеся
+    к этому времени, - unknown: часть команд могла выполниться
+    """
+    if not groups:
+        return []
+    
+    executor = ThreadPoolExecutor(max_workers=min(len(groups), RCON_MAX_WORKERS))
+    futures = {
+        executor.submit(deliver_batch, server_id, group['server'], group['items'], deadline): server_id
+        for server_id, group in groups.items()
+    }
+    done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0) + 1)
+    executor.shutdown(wait=False, cancel_futures=True)
+    
+    results: List[Tuple[str, str, str, Optional[str], Optional[str]]] = []
+    for future in done:
+        results.extend(future.result())
+    for future in not_done:
+        server_id = futures[future]
+        results.extend(
+            (purchase_id, server_id, 'unknown', None, 'Нет ответа RCON за отведённое время')
+            for purchase_id, _ in groups[server_id]['items']
+        )
+    return results
+
+def save_delivery_results(cur: Any, rows: List[Tuple[str, str, str, Optional[str], Optional[str]]]) -> None:
+    """
+    Сохраняет статусы выдачи по серверам одним запросом.
+    rows - список (purchase_id, server_id, status, response, error_message)
+    """
+    if not rows:
+        return
+    
+    execute_values(cur, """
+        UPDATE t_p79689265_minecraft_donation_s.purchase_deliveries AS d 
+        SET status = v.status, 
+            response = v.response, 
+            error_message = v.error_message, 
+            delivered_at = CASE WHEN v.status = 'delivered' THEN CURRENT_TIMESTAMP END 
+        FROM (VALUES %s) AS v(purchase_id, server_id, status, response, error_message) 
+        WHERE d.purchase_id = v.purchase_id AND d.server_id = v.server_id
+    """, rows, template='(%s, %s, %s, %s::text, %s::text)')
+
+def finalize_purchases(cur: Any, purchase_ids: List[str]) -> List[Tuple]:
+    """
+    Сводит статусы выдачи по серверам в итоговый статус покупок.
+    Возвращает (id, status, product_name, player_nickname, server_id, price_paid, delivered_servers)
+    """
+    cur.execute("""
+        UPDATE t_p79689265_minecraft_donation_s.purchases AS p 
+        SET status = agg.status, 
+            error_message = agg.errors, 
+            delivered_at = CASE WHEN agg.status IN ('delivered', 'partial') THEN CURRENT_TIMESTAMP END 
+        FROM (
+            SELECT purchase_id, 
+                   CASE WHEN bool_and(status = 'delivered') THEN 'delivered' 
+                        WHEN bool_or(status = 'delivered') THEN 'partial' 
+                        WHEN bool_or(status = 'unknown') THEN 'unknown' 
+                        ELSE 'failed' END AS status, 
+                   string_agg(server_id || ': ' || COALESCE(error_message, ''), '; ' ORDER BY server_id) 
+                       FILTER (WHERE status <> 'delivered') AS errors, 
+                   array_agg(server_id ORDER BY server_id) 
+                       FILTER (WHERE status = 'delivered') AS servers 
+            FROM t_p79689265_minecraft_donation_s.purchase_deliveries 
+            WHERE purchase_id = ANY(%s) 
+            GROUP BY purchase_id
+        ) AS agg, t_p79689265_minecraft_donation_s.products AS pr 
+        WHERE p.id = agg.purchase_id AND pr.id = p.product_id 
+        RETURNING p.id, p.status, pr.name, p.player_nickname, p.server_id, p.price_paid, agg.servers
+    """, (purchase_ids,))
+    return cur.fetchall()
+
+def enqueue_webhooks(cur: Any, purchases: List[Tuple]) -> None:
+    """
+    Кладёт уведомления о выданных покупках в webhook_outbox в той же
+    транзакции, что и смену статуса; отправкой занимается dispatch_webhooks
+    """
+    rows = []
+    for purchase_id, status, product_name, player_nickname, server_id, price_paid, servers in purchases:
+        if status not in ('delivered', 'partial'):
+            continue
+        rows.append(('purchase_delivered', json.dumps({
+            'event': 'purchase_delivered',
+            'purchaseId': purchase_id,
+            'productName': product_name,
+            'playerNickname': player_nickname,
+            'serverId': server_id,
+            'servers': servers or [],
+            'status': status,
+            'pricePaid': float(price_paid),
+            'timestamp': time.time()
+        })))
+    
+    if rows:
+        execute_values(cur, """
+            INSERT INTO t_p79689265_minecraft_donation_s.webhook_outbox (event, payload) 
+            VALUES %s
+        """, rows, template='(%s, %s::jsonb)')
+
+_webhook_settings_cache: Dict[str, Any] = {'value': None, 'expires': 0.0}
+_webhook_local = threading.local()
+_webhook_executor = ThreadPoolExecutor(max_workers=WEBHOOK_CONCURRENCY)
+
+def get_webhook_settings(cur: Any) -> Tuple[Optional[str], bool]:
+    now = time.monotonic()
+    if _webhook_settings_cache['expires'] > now:
+        return _webhook_settings_cache['value']
+    
+    cur.execute("""
+        SELECT webhook_url, is_enabled 
+        FROM t_p79689265_minecraft_donation_s.webhook_settings 
+        WHERE id = 'default'
+    """)
+    row = cur.fetchone()
+    value = (row[0], bool(row[1])) if row else (None, False)
+    
+    _webhook_settings_cache.update({'value': value, 'expires': now + WEBHOOK_SETTINGS_TTL})
+    return value
+
+def post_webhook(url: str, body: bytes) -> None:
+    """
+    POST на адрес вебхука через keep-alive соединение, закреплённое за потоком
+    """
+    parsed = urllib.parse.urlsplit(url)
+    key = (parsed.scheme, parsed.netloc)
+    path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+    
+    connections = getattr(_webhook_local, 'connections', None)
+    if connections is None:
+        connections = _webhook_local.connections = {}
+    
+    for attempt in range(2):
+        conn = connections.get(key)
+        reused = conn is not None
+        if conn is None:
+            conn_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+            conn = connections[key] = conn_class(parsed.netloc, timeout=WEBHOOK_TIMEOUT)
+        
+        try:
+            conn.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            conn.close()
+            connections.pop(key, None)
+            # получатель закрыл простаивавшее соединение — пробуем ещё раз через новое
+            if reused and attempt == 0:
+                continue
+            raise
+        except Exception:
+            conn.close()
+            connections.pop(key, None)
+            raise
+        
+        if response.status >= 300:
+            raise RuntimeError(f'HTTP {response.status}')
+        return
+
+def webhook_lease(rows: int) -> float:
+    """
+    Срок аренды пачки вебхуков: строки уходят волнами по WEBHOOK_CONCURRENCY,
+    у каждой до двух попыток (вторая - через новое соединение), в каждой
+    подключение и ожидание ответа ограничены WEBHOOK_TIMEOUT
+    """
+    waves = -(-rows // WEBHOOK_CONCURRENCY)
+    return waves * 2 * 2 * WEBHOOK_TIMEOUT + WEBHOOK_TIMEOUT
+
+_catalog_cache: Dict[str, Any] = {'version': None, 'body': None, 'etag': None}
+
+def normalize_nickname(nickname: Any) -> Optional[str]:
+    """
+    Ник в том виде, в каком его ввёл игрок, без пробелов по краям. Регистр
+    сохраняется для RCON-команд, сравнение идёт по purchases.player_key
+    """
+    if not isinstance(nickname, str):
+        return None
+    return nickname.strip() or None
+
+def bump_catalog_version(cur: Any) -> None:
+    """
+    Помечает кэш каталога устаревшим во всех контейнерах.
+    Вызывается в той же транзакции, что и изменение products
+    """
+    cur.execute("""
+        UPDATE t_p79689265_minecraft_donation_s.catalog_version 
+        SET version = version + 1, updated_at = CURRENT_TIMESTAMP 
+        WHERE id = 'default'
+    """)
+
+def get_catalog(cur: Any) -> Tuple[str, str]:
+    """
+    Возвращает сериализованный каталог и его ETag. Пока версия каталога
+    в БД не изменилась, отдаёт готовые байты из памяти контейнера
+    """
+    cur.execute("""
+        SELECT version FROM t_p79689265_minecraft_donation_s.catalog_version 
+        WHERE id = 'default'
+    """)
+    row = cur.fetchone()
+    version = row[0] if row else None
+    
+    if version is not None and _catalog_cache['version'] == version:
+        return _catalog_cache['body'], _catalog_cache['etag']
+    
+    if RESPONSE_JSON_MODE == 'sql':
+        body = get_catalog_json_sql(cur)
+    else:
+        body = get_catalog_json(cur)
+    etag = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+    
+    if version is not None:
+        _catalog_cache.update({'version': version, 'body': body, 'etag': etag})
+    
+    return body, etag
+
+def get_catalog_json(cur: Any) -> str:
+    cur.execute("""
+        SELECT id, name, price, description, image_url, popular, discount, 
+               category, command_template, delivery_servers, in_stock, 
+               created_at, updated_at
+        FROM t_p79689265_minecraft_donation_s.products
+        WHERE in_stock = true
+        ORDER BY popular DESC, created_at DESC
+    """)
+    
+    rows = cur.fetchall()
+    products = []
+    
+    for row in rows:
+        products.append({
+            'id': row[0],
+            'name': row[1],
+            'price': float(row[2]),
+            'description': row[3],
+            'imageUrl': row[4],
+            'popular': row[5],
+            'discount': row[6],
+            'category': row[7],
+            'commandTemplate': row[8],
+            'servers': row[9] if row[9] else [],
+            'inStock': row[10],
+            'createdAt': row[11].isoformat() if row[11] else None,
+            'updatedAt': row[12].isoformat() if row[12] else None
+        })
+    
+    return json.dumps({'success': True, 'products': products})
+
+def get_catalog_json_sql(cur: Any) -> str:
+    """
+    Тот же документ каталога, но собранный в Postgres (json_agg): строки
+    не превращаются в Python-объекты, готовый текст отдаётся как есть
+    """
+    cur.execute("""
+        SELECT json_build_object('success', true, 'products', COALESCE(json_agg(json_build_object(
+            'id', id, 
+            'name', name, 
+            'price', price, 
+            'description', description, 
+            'imageUrl', image_url, 
+            'popular', popular, 
+            'discount', discount, 
+            'category', category, 
+            'commandTemplate', command_template, 
+            'servers', COALESCE(delivery_servers, '{}'), 
+            'inStock', in_stock, 
+            'createdAt', created_at, 
+            'updatedAt', updated_at
+        ) ORDER BY popular DESC, created_at DESC), '[]'::json))::text 
+        FROM t_p79689265_minecraft_donation_s.products 
+        WHERE in_stock = true
+    """)
+    return cur.fetchone()[0]
+
+def encode_catalog_cursor(popular: bool, created_at: Any, product_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([popular, created_at.isoformat(), product_id]).encode()).decode().rstrip('=')
+
+def decode_catalog_cursor(cursor: str) -> Tuple[bool, str, str]:
+    """
+    Курсор каталога - (popular, created_at, id) последнего товара страницы
+    """
+    popular, created_at, product_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    return bool(popular), str(created_at), str(product_id)
+
+def build_catalog_filters(query_params: Dict[str, str]) -> Tuple[str, List[Any]]:
+    """
+    WHERE для витрины по параметрам запроса: category (через запятую),
+    minPrice/maxPrice, popular, discounted, q (полнотекстовый поиск по
+    названию и описанию плюс поиск по части названия), cursor
+    """
+    conditions = ["in_stock = true"]
+    params: List[Any] = []
+    
+    if query_params.get('category'):
+        conditions.append("category = ANY(%s)")
+        params.append(query_params['category'].split(','))
+    if query_params.get('minPrice'):
+        conditions.append("price >= %s")
+        params.append(float(query_params['minPrice']))
+    if query_params.get('maxPrice'):
+        conditions.append("price <= %s")
+        params.append(float(query_params['maxPrice']))
+    if query_params.get('popular') in ('1', 'true'):
+        conditions.append("popular = true")
+    if query_params.get('discounted') in ('1', 'true'):
+        conditions.append("discount > 0")
+    if query_params.get('q', '').strip():
+        search = query_params['q'].strip()[:100]
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        conditions.append("(search_vector @@ websearch_to_tsquery('russian', %s) OR name ILIKE %s)")
+        params.extend([search, pattern])
+    if query_params.get('cursor'):
+        conditions.append("(popular, created_at, id) < (%s, %s::timestamp, %s)")
+        params.extend(decode_catalog_cursor(query_params['cursor']))
+    
+    return f"WHERE {' AND '.join(conditions)}", params
+
+def get_catalog_page_json(cur: Any, where: str, params: List[Any], limit: int) -> str:
+    cur.execute(f"""
+        SELECT id, name, price, description, image_url, popular, discount, 
+               category, command_template, delivery_servers, in_stock, 
+               created_at, updated_at
+        FROM t_p79689265_minecraft_donation_s.products
+        {where}
+        ORDER BY popular DESC, created_at DESC, id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    
+    rows = cur.fetchall()
+    next_cursor = encode_catalog_cursor(rows[limit - 1][5], rows[limit - 1][11], rows[limit - 1][0]) if len(rows) > limit else None
+    products = []
+    
+    for row in rows[:limit]:
+        products.append({
+            'id': row[0],
+            'name': row[1],
+            'price': float(row[2]),
+            'description': row[3],
+            'imageUrl': row[4],
+            'popular': row[5],
+            'discount': row[6],
+            'category': row[7],
+            'commandTemplate': row[8],
+            'servers': row[9] if row[9] else [],
+            'inStock': row[10],
+            'createdAt': row[11].isoformat() if row[11] else None,
+            'updatedAt': row[12].isoformat() if row[12] else None
+        })
+    
+    return json.dumps({'success': True, 'products': products, 'nextCursor': next_cursor})
+
+def get_catalog_page_json_sql(cur: Any, where: str, params: List[Any], limit: int) -> str:
+    """
+    Страница витрины, собранная в Postgres, по той же схеме, что и страница
+    покупок: json_agg по первым limit строкам плюс ключ последней из них
+    """
+    cur.execute(f"""
+        WITH page AS (
+            SELECT id, name, price, description, image_url, popular, discount, 
+                   category, command_template, delivery_servers, in_stock, 
+                   created_at, updated_at, 
+                   row_number() OVER (ORDER BY popular DESC, created_at DESC, id DESC) AS rn
+            FROM t_p79689265_minecraft_donation_s.products
+            {where}
+            ORDER BY popular DESC, created_at DESC, id DESC
+            LIMIT %s
+        )
+        SELECT COALESCE(json_agg(json_build_object(
+                   'id', id, 
+                   'name', name, 
+                   'price', price, 
+                   'description', description, 
+                   'imageUrl', image_url, 
+                   'popular', popular, 
+                   'discount', discount, 
+                   'category', category, 
+                   'commandTemplate', command_template, 
+                   'servers', COALESCE(delivery_servers, '{{}}'), 
+                   'inStock', in_stock, 
+                   'createdAt', created_at, 
+                   'updatedAt', updated_at
+               ) ORDER BY rn) FILTER (WHERE rn <= %s), '[]'::json)::text, 
+               count(*), 
+               bool_or(popular) FILTER (WHERE rn = %s), 
+               max(created_at) FILTER (WHERE rn = %s), 
+               max(id) FILTER (WHERE rn = %s)
+        FROM page
+    """, params + [limit + 1, limit, limit, limit, limit])
+    
+    products, total, last_popular, last_created_at, last_id = cur.fetchone()
+    next_cursor = encode_catalog_cursor(last_popular, last_created_at, last_id) if total > limit else None
+    return f'{{"success": true, "products": {products}, "nextCursor": {json.dumps(next_cursor)}}}'
+
+def handle_get_catalog_page(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Витрина с фильтрами постранично по ключу (popular, created_at, id) -
+    в том же порядке, что и полный каталог. ETag строится из версии
+    каталога и параметров запроса, так что повторный запрос той же
+    страницы до изменения каталога отвечает 304 без выборки товаров
+    """
+    query_params = event.get('queryStringParameters') or {}
+    
+    try:
+        limit = int(query_params.get('limit') or 50)
+        limit = max(1, min(limit, CATALOG_PAGE_MAX))
+        where, params = build_catalog_filters(query_params)
+    except (ValueError, TypeError):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': 'Неверный limit, cursor или диапазон цен'})
+        }
+    
     try:
-        conn = psycopg2.connect(DSN)
+        conn = db_pool.getconn()
         cur = conn.cursor()
         
         cur.execute("""
-            SELECT webhook_url, is_enabled 
-            FROM t_p79689265_minecraft_donation_s.webhook_settings 
+            SELECT version FROM t_p79689265_minecraft_donation_s.catalog_version 
             WHERE id = 'default'
         """)
+        row = cur.fetchone()
+        filters = json.dumps([query_params.get(name) for name in CATALOG_FILTER_PARAMS] + [limit])
+        etag = '"' + hashlib.sha256(f'{row[0] if row else None}:{filters}'.encode('utf-8')).hexdigest()[:32] + '"'
+        response_headers = {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        }
         
-        webhook_settings = cur.fetchone()
-        cur.close()
-        conn.close()
-        
-        if not webhook_settings or not webhook_settings[1]:
-            return
+        if row and get_header(event, 'If-None-Match') == etag:
+            return {
+                'statusCode': 304,
+                'headers': response_headers,
+                'body': ''
+            }
         
-        webhook_url = webhook_settings[0]
-        if not webhook_url:
-            return
+        if RESPONSE_JSON_MODE == 'sql':
+            body = get_catalog_page_json_sql(cur, where, params, limit)
+        else:
+            body = get_catalog_page_json(cur, where, params, limit)
         
-        data = json.dumps(purchase_data).encode('utf-8')
-        req = urllib.request.Request(
-            webhook_url,
-            data=data,
-            headers={'Content-Type': 'application/json'}
-        )
+        return {
+            'statusCode': 200,
+            'headers': response_headers,
+            'body': body
+        }
         
-        with urllib.request.urlopen(req, timeout=5) as response:
-            response.read()
-            
     except Exception as e:
-        print(f"Webhook notification error: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': str(e)})
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
 
+@db_pool.report_stats
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
@@ -65,73 +919,86 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Allow-Headers': 'Content-Type, If-None-Match, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': ''
         }
     
+    query_params = event.get('queryStringParameters') or {}
+    
+    # Тело импорта - CSV/NDJSON, а не JSON, поэтому маршрут по query-параметру
+    if method == 'POST' and query_params.get('action') == 'import':
+        return handle_import_products(event)
+    
     if method == 'POST':
         body_data = json.loads(event.get('body', '{}'))
         action = body_data.get('action', '')
         
-        if action == 'purchase':
-            return handle_purchase(event)
+        if action in ('purchase', 'checkout'):
+            idempotency_key = get_header(event, 'Idempotency-Key') or body_data.get('paymentId')
+            try:
+                return run_idempotent(db_pool, event, action, idempotency_key,
+                                      handle_purchase if action == 'purchase' else handle_checkout)
+            except Exception as e:
+                return {
+                    'statusCode': 500,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': False, 'error': str(e)})
+                }
+        
+        if action == 'process_queue':
+            return handle_process_queue(event)
+        
+        if action == 'dispatch_webhooks':
+            return handle_dispatch_webhooks(event)
     
-    query_params = event.get('queryStringParameters', {})
     if query_params.get('action') == 'purchases':
         return handle_get_purchases(event)
     
+    if query_params.get('action') == 'players':
+        return handle_suggest_players(event)
+    
+    if query_params.get('action') == 'export':
+        return handle_export_products(event)
+    
+    if method == 'GET' and any(query_params.get(name) for name in CATALOG_FILTER_PARAMS):
+        return handle_get_catalog_page(event)
+    
     try:
-        conn = psycopg2.connect(DSN)
+        conn = db_pool.getconn()
         cur = conn.cursor()
         
         if method == 'GET':
-            cur.execute("""
-                SELECT id, name, price, description, image_url, popular, discount, 
-                       category, command_template, delivery_servers, in_stock, 
-                       created_at, updated_at
-                FROM t_p79689265_minecraft_donation_s.products
-                WHERE in_stock = true
-                ORDER BY popular DESC, created_at DESC
-            """)
-            
-            rows = cur.fetchall()
-            products = []
-            
-            for row in rows:
-                products.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'price': float(row[2]),
-                    'description': row[3],
-                    'imageUrl': row[4],
-                    'popular': row[5],
-                    'discount': row[6],
-                    'category': row[7],
-                    'commandTemplate': row[8],
-                    'servers': row[9] if row[9] else [],
-                    'inStock': row[10],
-                    'createdAt': row[11].isoformat() if row[11] else None,
-                    'updatedAt': row[12].isoformat() if row[12] else None
-                })
+            body, etag = get_catalog(cur)
+            response_headers = {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Expose-Headers': 'ETag',
+                'Cache-Control': 'no-cache',
+                'ETag': etag
+            }
             
-            cur.close()
-            conn.close()
+            if get_header(event, 'If-None-Match') == etag:
+                return {
+                    'statusCode': 304,
+                    'headers': response_headers,
+                    'body': ''
+                }
             
             return {
                 'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True, 'products': products})
+                'headers': response_headers,
+                'body': body
             }
         
         if method == 'POST':
             body_data = json.loads(event.get('body', '{}'))
             
-            product_id = body_data.get('id', f'product_{int(time.time() * 1000)}')
+            explicit_id = body_data.get('id')
             name = body_data.get('name')
             price = body_data.get('price')
             description = body_data.get('description', '')
@@ -143,31 +1010,39 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             servers = body_data.get('servers', [])
             in_stock = body_data.get('inStock', True)
             
-            cur.execute("""
-                INSERT INTO t_p79689265_minecraft_donation_s.products 
-                (id, name, price, description, image_url, popular, discount, 
-                 category, command_template, delivery_servers, in_stock)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (id) DO UPDATE SET
-                    name = EXCLUDED.name,
-                    price = EXCLUDED.price,
-                    description = EXCLUDED.description,
-                    image_url = EXCLUDED.image_url,
-                    popular = EXCLUDED.popular,
-                    discount = EXCLUDED.discount,
-                    category = EXCLUDED.category,
-                    command_template = EXCLUDED.command_template,
-                    delivery_servers = EXCLUDED.delivery_servers,
-                    in_stock = EXCLUDED.in_stock,
-                    updated_at = CURRENT_TIMESTAMP
-                RETURNING id
-            """, (product_id, name, price, description, image_url, popular, 
-                  discount, category, command_template, servers, in_stock))
+            # Явный id - обновление товара; сгенерированный id не должен
+            # затереть чужой товар, поэтому при совпадении берётся новый
+            for _ in range(ID_INSERT_ATTEMPTS):
+                cur.execute("""
+                    INSERT INTO t_p79689265_minecraft_donation_s.products 
+                    (id, name, price, description, image_url, popular, discount, 
+                     category, command_template, delivery_servers, in_stock)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        price = EXCLUDED.price,
+                        description = EXCLUDED.description,
+                        image_url = EXCLUDED.image_url,
+                        popular = EXCLUDED.popular,
+                        discount = EXCLUDED.discount,
+                        category = EXCLUDED.category,
+                        command_template = EXCLUDED.command_template,
+                        delivery_servers = EXCLUDED.delivery_servers,
+                        in_stock = EXCLUDED.in_stock,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE %s
+                    RETURNING id
+                """, (explicit_id or id_generator.next_id(), name, price, description, image_url, popular, 
+                      discount, category, command_template, servers, in_stock, bool(explicit_id)))
+                row = cur.fetchone()
+                if row:
+                    break
+            else:
+                raise RuntimeError('Не удалось подобрать свободный id товара')
             
-            result_id = cur.fetchone()[0]
+            result_id = row[0]
+            bump_catalog_version(cur)
             conn.commit()
-            cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -193,9 +1068,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 "DELETE FROM t_p79689265_minecraft_donation_s.products WHERE id = %s",
                 (product_id,)
             )
+            bump_catalog_version(cur)
             conn.commit()
-            cur.close()
-            conn.close()
             
             return {
                 'statusCode': 200,
@@ -224,16 +1098,61 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'error': str(e)
             })
         }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
+
+# Проверка товара, цена со скидкой, RCON-сервера и запись покупки с её
+# доставками - одним запросом. Покупка вставляется только если товар
+# в наличии и хотя бы один сервер доставки активен; иначе id вернётся NULL
+CREATE_PURCHASE_SQL = """
+    WITH product AS (
+        SELECT id, name, 
+               CASE WHEN discount > 0 THEN round(price * (100 - discount) / 100, 2) ELSE price END AS final_price, 
+               replace(command_template, '{player}', %(player)s) AS delivery_command, 
+               CASE WHEN cardinality(delivery_servers) > 0 THEN delivery_servers 
+                    WHEN %(server_id)s::text IS NOT NULL THEN ARRAY[%(server_id)s::text] 
+                    ELSE '{}'::text[] END AS target_ids 
+        FROM t_p79689265_minecraft_donation_s.products 
+        WHERE id = %(product_id)s AND in_stock = true
+    ), servers AS (
+        SELECT r.id, r.address, r.rcon_port, r.rcon_password 
+        FROM t_p79689265_minecraft_donation_s.rcon_servers r, product 
+        WHERE r.id = ANY(product.target_ids) AND r.is_active = true
+    ), purchase AS (
+        INSERT INTO t_p79689265_minecraft_donation_s.purchases 
+        (id, product_id, player_nickname, server_id, price_paid, status, delivery_command, claimed_at) 
+        SELECT %(purchase_id)s, product.id, %(player)s, 
+               CASE WHEN %(server_id)s::text = ANY(product.target_ids) THEN %(server_id)s::text 
+                    ELSE product.target_ids[1] END, 
+               product.final_price, %(status)s, product.delivery_command, 
+               CASE WHEN %(queued)s THEN NULL ELSE CURRENT_TIMESTAMP END 
+        FROM product 
+        WHERE EXISTS (SELECT 1 FROM servers) 
+        RETURNING id
+    ), deliveries AS (
+        INSERT INTO t_p79689265_minecraft_donation_s.purchase_deliveries (purchase_id, server_id, status) 
+        SELECT DISTINCT purchase.id, t.server_id, 'pending' 
+        FROM purchase, product, unnest(product.target_ids) AS t(server_id)
+    )
+    SELECT product.name, product.final_price, product.target_ids, product.delivery_command, 
+           (SELECT id FROM purchase), 
+           (SELECT COALESCE(json_agg(json_build_array(id, address, rcon_port, rcon_password)), '[]'::json) FROM servers), 
+           (SELECT bool_or(online) FROM player_presence WHERE player_key = lower(%(player)s)) 
+    FROM product
+"""
 
 def handle_purchase(event: Dict[str, Any]) -> Dict[str, Any]:
     try:
         body_data = json.loads(event.get('body', '{}'))
         
         product_id = body_data.get('productId')
-        player_nickname = body_data.get('playerNickname')
+        player_nickname = normalize_nickname(body_data.get('playerNickname'))
         server_id = body_data.get('serverId')
         
-        if not all([product_id, player_nickname, server_id]):
+        if not all([product_id, player_nickname]):
             return {
                 'statusCode': 400,
                 'headers': {
@@ -242,24 +1161,36 @@ def handle_purchase(event: Dict[str, Any]) -> Dict[str, Any]:
                 },
                 'body': json.dumps({
                     'success': False,
-                    'error': 'productId, playerNickname и serverId обязательны'
+                    'error': 'productId и playerNickname обязательны'
                 })
             }
         
-        conn = psycopg2.connect(DSN)
+        conn = db_pool.getconn()
         cur = conn.cursor()
         
-        cur.execute("""
-            SELECT name, price, discount, command_template 
-            FROM t_p79689265_minecraft_donation_s.products 
-            WHERE id = %s AND in_stock = true
-        """, (product_id,))
+        # В синхронном режиме покупка сразу помечается как взятая в работу,
+        # чтобы воркер очереди подобрал её только если этот вызов упадёт
+        queued = PURCHASE_DELIVERY_MODE == 'queue'
         
-        product = cur.fetchone()
+        for attempt in range(ID_INSERT_ATTEMPTS):
+            try:
+                cur.execute(CREATE_PURCHASE_SQL, {
+                    'product_id': product_id,
+                    'server_id': server_id,
+                    'player': player_nickname,
+                    'purchase_id': id_generator.next_id(),
+                    'status': 'pending' if queued else 'processing',
+                    'queued': queued
+                })
+                break
+            except Exception as e:
+                # id совпал с уже существующей покупкой - повторяем с новым
+                if not is_unique_violation(e) or attempt == ID_INSERT_ATTEMPTS - 1:
+                    raise
+                conn.rollback()
+        created = cur.fetchone()
         
-        if not product:
-            cur.close()
-            conn.close()
+        if not created:
             return {
                 'statusCode': 404,
                 'headers': {
@@ -269,20 +1200,23 @@ def handle_purchase(event: Dict[str, Any]) -> Dict[str, Any]:
                 'body': json.dumps({'success': False, 'error': 'Товар не найден'})
             }
         
-        product_name, price, discount, command_template = product
-        final_price = price * (1 - discount / 100) if discount > 0 else price
+        product_name, _, target_ids, delivery_command, purchase_id, servers, player_online = created
+        # Повтор сервера в delivery_servers не должен выдавать товар дважды
+        target_ids = list(dict.fromkeys(target_ids or []))
         
-        cur.execute("""
-            SELECT address, rcon_port, rcon_password 
-            FROM t_p79689265_minecraft_donation_s.rcon_servers 
-            WHERE id = %s AND is_active = true
-        """, (server_id,))
+        if not target_ids:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': False, 'error': 'serverId обязателен'})
+            }
         
-        rcon_server = cur.fetchone()
+        rcon_servers = {row[0]: tuple(row) for row in servers}
         
-        if not rcon_server:
-            cur.close()
-            conn.close()
+        if not purchase_id:
             return {
                 'statusCode': 404,
                 'headers': {
@@ -292,164 +1226,1230 @@ def handle_purchase(event: Dict[str, Any]) -> Dict[str, Any]:
                 'body': json.dumps({'success': False, 'error': 'Сервер не найден'})
             }
         
-        rcon_address, rcon_port, rcon_password = rcon_server
-        
-        delivery_command = command_template.replace('{player}', player_nickname)
-        purchase_id = f'purchase_{int(time.time() * 1000)}'
-        
-        cur.execute("""
-            INSERT INTO t_p79689265_minecraft_donation_s.purchases 
-            (id, product_id, player_nickname, server_id, price_paid, 
-             status, delivery_command)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id
-        """, (purchase_id, product_id, player_nickname, server_id, 
-              final_price, 'pending', delivery_command))
+        # Выдаём в любом случае (многие команды работают и для офлайн-игрока),
+        # но предупреждаем, если мониторинг видел игрока не в сети
+        warning = f'Игрок {player_nickname} сейчас не в сети' if player_online is False else None
         
+        # С этого момента покупку может выдать воркер очереди, поэтому при
+        # ошибке ключ идемпотентности уже не освобождается
+        purchase_saved = True
         conn.commit()
         
-        if HAS_RCON:
-            try:
-                with MCRcon(rcon_address, rcon_password, port=rcon_port) as mcr:
-                    response = mcr.command(delivery_command)
-                
-                cur.execute("""
-                    UPDATE t_p79689265_minecraft_donation_s.purchases 
-                    SET status = %s, delivered_at = CURRENT_TIMESTAMP 
-                    WHERE id = %s
-                """, ('delivered', purchase_id))
-                conn.commit()
-                
-                send_webhook_notification({
-                    'event': 'purchase_delivered',
+        if queued:
+            return {
+                'statusCode': 202,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': True,
                     'purchaseId': purchase_id,
-                    'productName': product_name,
-                    'playerNickname': player_nickname,
-                    'serverId': server_id,
-                    'pricePaid': float(final_price),
-                    'timestamp': time.time()
+                    'status': 'pending',
+                    'message': f'Покупка "{product_name}" принята, товар будет выдан игроку {player_nickname} в ближайшее время',
+                    'playerOnline': player_online,
+                    'warning': warning
                 })
-                
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'success': True,
-                        'purchaseId': purchase_id,
-                        'status': 'delivered',
-                        'message': f'Товар "{product_name}" успешно доставлен игроку {player_nickname}!'
-                    })
-                }
-                
-            except Exception as rcon_error:
-                cur.execute("""
-                    UPDATE t_p79689265_minecraft_donation_s.purchases 
-                    SET status = %s, error_message = %s 
-                    WHERE id = %s
-                """, ('failed', str(rcon_error), purchase_id))
-                conn.commit()
-                cur.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 500,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'success': False,
-                        'error': 'Ошибка доставки товара',
-                        'details': str(rcon_error)
-                    })
-                }
-        else:
-            cur.close()
-            conn.close()
+            }
+        
+        results = deliver_to_servers(
+            [rcon_servers[target_id] for target_id in target_ids if target_id in rcon_servers],
+            delivery_command
+        )
+        for target_id in target_ids:
+            if target_id not in rcon_servers:
+                rcon_pool.invalidate(target_id)
+                results[target_id] = {'status': 'failed', 'response': None, 'error': 'Сервер не найден'}
+        
+        save_delivery_results(cur, [
+            (purchase_id, target_id, results[target_id]['status'],
+             results[target_id]['response'], results[target_id]['error'])
+            for target_id in target_ids
+        ])
+        finalized = finalize_purchases(cur, [purchase_id])
+        enqueue_webhooks(cur, finalized)
+        conn.commit()
+        
+        delivered = [target_id for target_id in target_ids if results[target_id]['status'] == 'delivered']
+        failed = [target_id for target_id in target_ids if results[target_id]['status'] != 'delivered']
+        status = finalized[0][1] if finalized else 'failed'
+        errors = '; '.join(f"{target_id}: {results[target_id]['error']}" for target_id in failed)
+        
+        deliveries = [
+            {'serverId': target_id, 'status': results[target_id]['status'], 'error': results[target_id]['error']}
+            for target_id in target_ids
+        ]
+        
+        if not delivered:
             return {
-                'statusCode': 501,
+                'statusCode': 500,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
                 'body': json.dumps({
                     'success': False,
-                    'error': 'RCON модуль не установлен'
-                })
+                    'status': status,
+                    'error': 'Результат выдачи неизвестен, повторять покупку не нужно - проверьте в игре' 
+                             if status == 'unknown' else 'Ошибка доставки товара',
+                    'details': errors,
+                    'purchaseId': purchase_id,
+                    'deliveries': deliveries
+                }),
+                # failed - ни одна команда не дошла до сервера, повтор безопасен
+                '_releaseKey': all(results[target_id]['status'] == 'failed' for target_id in target_ids)
             }
-            
-    except Exception as e:
-        return {
-            'statusCode': 500,
+        
+        if status == 'partial':
+            message = f'Товар "{product_name}" доставлен игроку {player_nickname} не на все сервера: ошибка на {", ".join(failed)}'
+        else:
+            message = f'Товар "{product_name}" успешно доставлен игроку {player_nickname}!'
+        
+        return {
+            'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'success': False, 'error': str(e)})
+            'body': json.dumps({
+                'success': True,
+                'purchaseId': purchase_id,
+                'status': status,
+                'message': message,
+                'deliveries': deliveries,
+                'playerOnline': player_online,
+                'warning': warning
+            })
         }
+            
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': str(e)}),
+            '_releaseKey': 'purchase_saved' not in locals()
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
 
-def handle_get_purchases(event: Dict[str, Any]) -> Dict[str, Any]:
-    query_params = event.get('queryStringParameters', {})
-    player_nickname = query_params.get('player')
+def handle_checkout(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Корзина: несколько товаров (productId, quantity) для одного игрока.
+    Все товары и их сервера проверяются одним запросом, покупки и доставки
+    вставляются пачкой, а команды уходят по одной RCON-сессии на сервер.
+    mode=atomic - если хоть одна позиция не проходит проверку, не покупается
+    ничего; mode=partial (по умолчанию) - неверные позиции отклоняются,
+    остальные покупаются. Выданную по RCON команду откатить нельзя, поэтому
+    результат выдачи в обоих режимах возвращается по каждой позиции
+    """
+    try:
+        body_data = json.loads(event.get('body', '{}'))
+        
+        player_nickname = normalize_nickname(body_data.get('playerNickname'))
+        server_id = body_data.get('serverId')
+        atomic = body_data.get('mode', 'partial') == 'atomic'
+        
+        items: Dict[str, int] = {}
+        for item in body_data.get('items') or []:
+            product_id = item.get('productId') if isinstance(item, dict) else None
+            try:
+                quantity = int(item.get('quantity', 1)) if product_id else 0
+            except (TypeError, ValueError):
+                quantity = 0
+            if not product_id or quantity < 1 or quantity > CART_MAX_QUANTITY:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({
+                        'success': False,
+                        'error': f'Каждая позиция - productId и quantity от 1 до {CART_MAX_QUANTITY}'
+                    })
+                }
+            items[product_id] = items.get(product_id, 0) + quantity
+        
+        if not player_nickname or not items or len(items) > CART_MAX_ITEMS:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': False,
+                    'error': f'playerNickname и от 1 до {CART_MAX_ITEMS} товаров в items обязательны'
+                })
+            }
+        
+        conn = db_pool.getconn()
+        cur = conn.cursor()
+        
+        cur.execute("""
+            SELECT p.id, p.name, 
+                   CASE WHEN p.discount > 0 THEN round(p.price * (100 - p.discount) / 100, 2) ELSE p.price END, 
+                   replace(p.command_template, '{player}', %(player)s), 
+                   t.server_id, s.address, s.rcon_port, s.rcon_password, 
+                   (SELECT bool_or(online) FROM player_presence WHERE player_key = lower(%(player)s)) 
+            FROM t_p79689265_minecraft_donation_s.products p 
+            LEFT JOIN LATERAL unnest(
+                CASE WHEN cardinality(p.delivery_servers) > 0 THEN p.delivery_servers 
+                     WHEN %(server_id)s::text IS NOT NULL THEN ARRAY[%(server_id)s::text] 
+                     ELSE '{}'::text[] END
+            ) AS t(server_id) ON true 
+            LEFT JOIN t_p79689265_minecraft_donation_s.rcon_servers s 
+                   ON s.id = t.server_id AND s.is_active = true 
+            WHERE p.id = ANY(%(product_ids)s) AND p.in_stock = true
+        """, {'player': player_nickname, 'server_id': server_id, 'product_ids': list(items)})
+        
+        products: Dict[str, Dict[str, Any]] = {}
+        player_online = None
+        for product_id, name, price, command, target_id, address, rcon_port, rcon_password, online in cur.fetchall():
+            product = products.setdefault(product_id, {'name': name, 'price': price, 'command': command, 'targets': {}})
+            if target_id:
+                product['targets'][target_id] = (target_id, address, rcon_port, rcon_password) if address else None
+            player_online = online
+        
+        lines: Dict[str, Dict[str, Any]] = {}
+        for product_id, quantity in items.items():
+            product = products.get(product_id)
+            error = None
+            if not product:
+                error = 'Товар не найден'
+            elif not product['targets']:
+                error = 'serverId обязателен'
+            elif not any(product['targets'].values()):
+                error = 'Сервер не найден'
+            lines[product_id] = {
+                'productId': product_id,
+                'quantity': quantity,
+                'status': 'rejected' if error else 'pending',
+                'error': error,
+                'purchaseIds': []
+            }
+        
+        rejected = [line for line in lines.values() if line['status'] == 'rejected']
+        if rejected and (atomic or len(rejected) == len(lines)):
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': False,
+                    'error': 'Корзина не прошла проверку',
+                    'items': list(lines.values())
+                })
+            }
+        
+        queued = PURCHASE_DELIVERY_MODE == 'queue'
+        
+        for attempt in range(ID_INSERT_ATTEMPTS):
+            purchase_rows = []
+            delivery_rows = []
+            groups: Dict[str, Dict[str, Any]] = {}
+            
+            for product_id, line in lines.items():
+                if line['status'] == 'rejected':
+                    continue
+                product = products[product_id]
+                target_ids = list(product['targets'])
+                primary = server_id if server_id in product['targets'] else target_ids[0]
+                line['purchaseIds'] = []
+                
+                for _ in range(line['quantity']):
+                    purchase_id = id_generator.next_id()
+                    line['purchaseIds'].append(purchase_id)
+                    purchase_rows.append((purchase_id, product_id, player_nickname, primary, product['price'],
+                                          'pending' if queued else 'processing', product['command'], queued))
+                    for target_id in target_ids:
+                        delivery_rows.append((purchase_id, target_id, 'pending'))
+                        group = groups.setdefault(target_id, {
+                            'server': product['targets'][target_id][1:] if product['targets'][target_id] else None,
+                            'items': []
+                        })
+                        group['items'].append((purchase_id, product['command']))
+            
+            try:
+                execute_values(cur, """
+                    INSERT INTO t_p79689265_minecraft_donation_s.purchases 
+                    (id, product_id, player_nickname, server_id, price_paid, status, delivery_command, claimed_at) 
+                    SELECT v.id, v.product_id, v.player_nickname, v.server_id, v.price_paid, v.status, v.delivery_command, 
+                           CASE WHEN v.queued THEN NULL ELSE CURRENT_TIMESTAMP END 
+                    FROM (VALUES %s) AS v(id, product_id, player_nickname, server_id, price_paid, status, delivery_command, queued)
+                """, purchase_rows, template='(%s, %s, %s, %s, %s::numeric, %s, %s, %s::boolean)', page_size=len(purchase_rows))
+                execute_values(cur, """
+                    INSERT INTO t_p79689265_minecraft_donation_s.purchase_deliveries 
+                    (purchase_id, server_id, status) 
+                    VALUES %s
+                """, delivery_rows, page_size=len(delivery_rows))
+                break
+            except Exception as e:
+                # Какой-то id совпал с уже существующей покупкой - вся
+                # корзина вставляется заново с новыми id
+                if not is_unique_violation(e) or attempt == ID_INSERT_ATTEMPTS - 1:
+                    raise
+                conn.rollback()
+        purchase_saved = True
+        conn.commit()
+        
+        warning = f'Игрок {player_nickname} сейчас не в сети' if player_online is False else None
+        
+        if queued:
+            for line in lines.values():
+                if line['status'] == 'pending':
+                    line['status'] = 'queued'
+            return {
+                'statusCode': 202,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({
+                    'success': True,
+                    'status': 'pending',
+                    'items': list(lines.values()),
+                    'playerOnline': player_online,
+                    'warning': warning
+                })
+            }
+        
+        # Один срок на всю корзину, как у одиночной покупки: запрос не
+        # должен пережить IDEMPOTENCY_STALE_AFTER и PURCHASE_CLAIM_TIMEOUT
+        results = deliver_groups(groups, time.monotonic() + RCON_DELIVERY_BUDGET)
+        
+        save_delivery_results(cur, results)
+        finalized = finalize_purchases(cur, [row[0] for row in purchase_rows])
+        enqueue_webhooks(cur, finalized)
+        conn.commit()
+        
+        statuses = {row[0]: row[1] for row in finalized}
+        errors: Dict[str, List[str]] = {}
+        for purchase_id, target_id, status, _, error in results:
+            if status != 'delivered':
+                errors.setdefault(purchase_id, []).append(f'{target_id}: {error}')
+        
+        for line in lines.values():
+            if line['status'] == 'rejected':
+                continue
+            line_statuses = {statuses.get(purchase_id, 'failed') for purchase_id in line['purchaseIds']}
+            if line_statuses == {'delivered'}:
+                line['status'] = 'delivered'
+            elif line_statuses == {'failed'}:
+                line['status'] = 'failed'
+            elif line_statuses <= {'failed', 'unknown'}:
+                line['status'] = 'unknown'
+            else:
+                line['status'] = 'partial'
+            line_errors = sorted({e for purchase_id in line['purchaseIds'] for e in errors.get(purchase_id, [])})
+            line['error'] = '; '.join(line_errors) or None
+        
+        line_statuses = {line['status'] for line in lines.values()}
+        if line_statuses == {'delivered'}:
+            status = 'delivered'
+        elif line_statuses <= {'failed', 'rejected'}:
+            status = 'failed'
+        elif line_statuses <= {'failed', 'rejected', 'unknown'}:
+            status = 'unknown'
+        else:
+            status = 'partial'
+        
+        return {
+            'statusCode': 500 if status in ('failed', 'unknown') else 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': status not in ('failed', 'unknown'),
+                'status': status,
+                'items': list(lines.values()),
+                'playerOnline': player_online,
+                'warning': warning
+            }),
+            '_releaseKey': status == 'failed' and all(result[2] == 'failed' for result in results)
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': str(e)}),
+            '_releaseKey': 'purchase_saved' not in locals()
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
+
+def handle_process_queue(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Воркер очереди выдачи: забирает pending-покупки пачками через
+    FOR UPDATE SKIP LOCKED и выдаёт их по одной RCON-сессии на сервер
+    """
+    started = time.monotonic()
+    totals = {'claimed': 0, 'delivered': 0, 'partial': 0, 'failed': 0, 'unknown': 0}
     
     try:
-        conn = psycopg2.connect(DSN)
+        conn = db_pool.getconn()
         cur = conn.cursor()
         
-        if player_nickname:
+        while time.monotonic() - started < PURCHASE_WORKER_BUDGET:
             cur.execute("""
-                SELECT p.id, p.product_id, p.player_nickname, p.server_id, 
-                       p.price_paid, p.status, p.created_at, p.delivered_at,
-                       pr.name as product_name
-                FROM t_p79689265_minecraft_donation_s.purchases p
-                LEFT JOIN t_p79689265_minecraft_donation_s.products pr ON p.product_id = pr.id
-                WHERE p.player_nickname = %s
-                ORDER BY p.created_at DESC
-                LIMIT 50
-            """, (player_nickname,))
+                UPDATE t_p79689265_minecraft_donation_s.purchases 
+                SET status = 'processing', claimed_at = CURRENT_TIMESTAMP, attempts = attempts + 1 
+                WHERE id IN (
+                    SELECT id FROM t_p79689265_minecraft_donation_s.purchases 
+                    WHERE status = 'pending' 
+                       OR (status = 'processing' AND claimed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second') 
+                    ORDER BY created_at 
+                    LIMIT %s 
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id
+            """, (PURCHASE_CLAIM_TIMEOUT, PURCHASE_QUEUE_BATCH))
+            claimed = [row[0] for row in cur.fetchall()]
+            conn.commit()
+            
+            if not claimed:
+                break
+            totals['claimed'] += len(claimed)
+            
+            cur.execute("""
+                SELECT d.purchase_id, d.server_id, p.delivery_command, 
+                       s.address, s.rcon_port, s.rcon_password 
+                FROM t_p79689265_minecraft_donation_s.purchase_deliveries d 
+                JOIN t_p79689265_minecraft_donation_s.purchases p ON p.id = d.purchase_id 
+                LEFT JOIN t_p79689265_minecraft_donation_s.rcon_servers s 
+                       ON s.id = d.server_id AND s.is_active = true 
+                WHERE d.purchase_id = ANY(%s) AND d.status = 'pending' 
+                ORDER BY p.created_at
+            """, (claimed,))
+            
+            groups: Dict[str, Dict[str, Any]] = {}
+            for purchase_id, server_id, command, address, rcon_port, rcon_password in cur.fetchall():
+                group = groups.setdefault(server_id, {
+                    'server': (address, rcon_port, rcon_password) if address else None,
+                    'items': []
+                })
+                group['items'].append((purchase_id, command))
+            
+            # Пачка обязана закончиться заметно раньше PURCHASE_CLAIM_TIMEOUT:
+            # иначе другой воркер заберёт её покупки как брошенные и выдаст
+            # повторно. Не вернувшиеся к сроку пачки записываются как unknown
+            batch_deadline = time.monotonic() + min(RCON_DELIVERY_BUDGET, PURCHASE_CLAIM_TIMEOUT / 2)
+            results = deliver_groups(groups, batch_deadline)
+            
+            save_delivery_results(cur, results)
+            finalized = finalize_purchases(cur, claimed)
+            
+            # Покупки без строк в purchase_deliveries (созданные до её появления)
+            orphaned = list(set(claimed) - {row[0] for row in finalized})
+            if orphaned:
+                cur.execute("""
+                    UPDATE t_p79689265_minecraft_donation_s.purchases 
+                    SET status = 'failed', error_message = 'Нет серверов для выдачи' 
+                    WHERE id = ANY(%s)
+                """, (orphaned,))
+                totals['failed'] += len(orphaned)
+            
+            enqueue_webhooks(cur, finalized)
+            conn.commit()
+            
+            for row in finalized:
+                totals[row[1]] += 1
+            
+            if len(claimed) < PURCHASE_QUEUE_BATCH:
+                break
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': True, **totals})
+        }
+        
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': str(e), **totals})
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
+
+def handle_dispatch_webhooks(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Разбирает webhook_outbox пачками: отправляет уведомления параллельно,
+    неудачные откладывает с экспоненциальной задержкой, после
+    WEBHOOK_MAX_ATTEMPTS попыток переводит в dead
+    """
+    started = time.monotonic()
+    totals = {'sent': 0, 'retried': 0, 'dead': 0, 'skipped': 0}
+    
+    try:
+        conn = db_pool.getconn()
+        cur = conn.cursor()
+        
+        while time.monotonic() - started < WEBHOOK_DISPATCH_BUDGET:
+            webhook_url, is_enabled = get_webhook_settings(cur)
+            
+            if not webhook_url or not is_enabled:
+                cur.execute("""
+                    UPDATE t_p79689265_minecraft_donation_s.webhook_outbox 
+                    SET status = 'skipped' 
+                    WHERE status = 'pending'
+                """)
+                totals['skipped'] += cur.rowcount
+                conn.commit()
+                break
+            
+            # Аренда: сдвигаем next_attempt_at, чтобы параллельный диспетчер не взял те же строки
+            lease = webhook_lease(WEBHOOK_BATCH)
+            cur.execute("""
+                UPDATE t_p79689265_minecraft_donation_s.webhook_outbox 
+                SET attempts = attempts + 1, 
+                    next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' 
+                WHERE id IN (
+                    SELECT id FROM t_p79689265_minecraft_donation_s.webhook_outbox 
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP 
+                    ORDER BY next_attempt_at 
+                    LIMIT %s 
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, payload, attempts
+            """, (lease, WEBHOOK_BATCH))
+            claimed = cur.fetchall()
+            conn.commit()
+            
+            if not claimed:
+                break
+            
+            futures = {
+                _webhook_executor.submit(post_webhook, webhook_url, json.dumps(payload).encode('utf-8')): (outbox_id, attempts)
+                for outbox_id, payload, attempts in claimed
+            }
+            
+            in_flight = set(futures)
+            while in_flight:
+                _, in_flight = wait(in_flight, timeout=lease / 2)
+                if in_flight:
+                    # Пачка идёт дольше половины аренды (получатель отвечает
+                    # по байту) - продлеваем аренду строкам, которые ещё в пути
+                    cur.execute("""
+                        UPDATE t_p79689265_minecraft_donation_s.webhook_outbox 
+                        SET next_attempt_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' 
+                        WHERE id = ANY(%s) AND status = 'pending'
+                    """, (lease, [futures[future][0] for future in in_flight]))
+                    conn.commit()
+            
+            updates = []
+            for future, (outbox_id, attempts) in futures.items():
+                try:
+                    future.result()
+                    updates.append((outbox_id, 'sent', 0, None))
+                    totals['sent'] += 1
+                except Exception as e:
+                    error = str(e) or type(e).__name__
+                    if attempts >= WEBHOOK_MAX_ATTEMPTS:
+                        updates.append((outbox_id, 'dead', 0, error))
+                        totals['dead'] += 1
+                        print(f"Webhook {outbox_id} dead after {attempts} attempts: {error}")
+                    else:
+                        delay = min(WEBHOOK_RETRY_BASE * 2 ** (attempts - 1), WEBHOOK_RETRY_MAX)
+                        updates.append((outbox_id, 'pending', delay, error))
+                        totals['retried'] += 1
+            
+            execute_values(cur, """
+                UPDATE t_p79689265_minecraft_donation_s.webhook_outbox AS o 
+                SET status = v.status, 
+                    last_error = v.last_error, 
+                    next_attempt_at = CURRENT_TIMESTAMP + v.delay * INTERVAL '1 second', 
+                    sent_at = CASE WHEN v.status = 'sent' THEN CURRENT_TIMESTAMP END 
+                FROM (VALUES %s) AS v(id, status, delay, last_error) 
+                WHERE o.id = v.id
+            """, updates, template='(%s::bigint, %s, %s::float8, %s::text)')
+            conn.commit()
+            
+            if len(claimed) < WEBHOOK_BATCH:
+                break
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': True, **totals})
+        }
+        
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': str(e), **totals})
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
+
+def encode_cursor(created_at: Any, purchase_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at.isoformat(), purchase_id]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """
+    Курсор - непрозрачная строка с (created_at, id) последней покупки страницы
+    """
+    created_at, purchase_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    return str(created_at), str(purchase_id)
+
+def get_purchases_json(cur: Any, where: str, params: List[Any], limit: int) -> str:
+    cur.execute(f"""
+        SELECT p.id, p.product_id, p.player_nickname, p.server_id, 
+               p.price_paid, p.status, p.created_at, p.delivered_at,
+               pr.name as product_name
+        FROM t_p79689265_minecraft_donation_s.purchases p
+        LEFT JOIN t_p79689265_minecraft_donation_s.products pr ON p.product_id = pr.id
+        {where}
+        ORDER BY p.created_at DESC, p.id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    
+    rows = cur.fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][6], rows[limit - 1][0]) if len(rows) > limit else None
+    purchases = []
+    
+    for row in rows[:limit]:
+        purchases.append({
+            'id': row[0],
+            'productId': row[1],
+            'playerNickname': row[2],
+            'serverId': row[3],
+            'pricePaid': float(row[4]),
+            'status': row[5],
+            'createdAt': row[6].isoformat() if row[6] else None,
+            'deliveredAt': row[7].isoformat() if row[7] else None,
+            'productName': row[8]
+        })
+    
+    return json.dumps({'success': True, 'purchases': purchases, 'nextCursor': next_cursor})
+
+def get_purchases_json_sql(cur: Any, where: str, params: List[Any], limit: int) -> str:
+    """
+    Страница покупок, собранная в Postgres: json_agg по первым limit строкам
+    плюс ключ последней из них для курсора (если есть следующая страница)
+    """
+    cur.execute(f"""
+        WITH page AS (
+            SELECT p.id, p.product_id, p.player_nickname, p.server_id, 
+                   p.price_paid, p.status, p.created_at, p.delivered_at,
+                   pr.name AS product_name, 
+                   row_number() OVER (ORDER BY p.created_at DESC, p.id DESC) AS rn
+            FROM t_p79689265_minecraft_donation_s.purchases p
+            LEFT JOIN t_p79689265_minecraft_donation_s.products pr ON p.product_id = pr.id
+            {where}
+            ORDER BY p.created_at DESC, p.id DESC
+            LIMIT %s
+        )
+        SELECT COALESCE(json_agg(json_build_object(
+                   'id', id, 
+                   'productId', product_id, 
+                   'playerNickname', player_nickname, 
+                   'serverId', server_id, 
+                   'pricePaid', price_paid, 
+                   'status', status, 
+                   'createdAt', created_at, 
+                   'deliveredAt', delivered_at, 
+                   'productName', product_name
+               ) ORDER BY rn) FILTER (WHERE rn <= %s), '[]'::json)::text, 
+               count(*), 
+               max(created_at) FILTER (WHERE rn = %s), 
+               max(id) FILTER (WHERE rn = %s)
+        FROM page
+    """, params + [limit + 1, limit, limit, limit])
+    
+    purchases, total, last_created_at, last_id = cur.fetchone()
+    next_cursor = encode_cursor(last_created_at, last_id) if total > limit else None
+    return f'{{"success": true, "purchases": {purchases}, "nextCursor": {json.dumps(next_cursor)}}}'
+
+def handle_get_purchases(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Покупки от новых к старым постранично по ключу (created_at, id):
+    следующая страница начинается сразу после курсора, поэтому её цена
+    не зависит от того, как далеко пролистан список. Фильтры: player,
+    status (через запятую), server, from/to
+    """
+    query_params = event.get('queryStringParameters', {}) or {}
+    player_nickname = normalize_nickname(query_params.get('player'))
+    
+    try:
+        limit = int(query_params.get('limit') or (50 if player_nickname else 100))
+        limit = max(1, min(limit, PURCHASES_PAGE_MAX))
+        cursor = decode_cursor(query_params['cursor']) if query_params.get('cursor') else None
+    except (ValueError, TypeError):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': 'Неверный limit или cursor'})
+        }
+    
+    conditions = []
+    params: List[Any] = []
+    
+    if player_nickname:
+        conditions.append("p.player_key = lower(%s)")
+        params.append(player_nickname)
+    if query_params.get('status'):
+        conditions.append("p.status = ANY(%s)")
+        params.append(query_params['status'].split(','))
+    if query_params.get('server'):
+        # Покупка могла выдаваться на несколько серверов - смотрим и доставки
+        conditions.append(
+            "(p.server_id = %s OR EXISTS (SELECT 1 FROM t_p79689265_minecraft_donation_s.purchase_deliveries d "
+            "WHERE d.purchase_id = p.id AND d.server_id = %s))"
+        )
+        params.extend([query_params['server'], query_params['server']])
+    if query_params.get('from'):
+        conditions.append("p.created_at >= %s::timestamp")
+        params.append(query_params['from'])
+    if query_params.get('to'):
+        conditions.append("p.created_at < %s::timestamp")
+        params.append(query_params['to'])
+    if cursor:
+        conditions.append("(p.created_at, p.id) < (%s::timestamp, %s)")
+        params.extend(cursor)
+    
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    
+    try:
+        conn = db_pool.getconn()
+        cur = conn.cursor()
+        
+        if RESPONSE_JSON_MODE == 'sql':
+            body = get_purchases_json_sql(cur, where, params, limit)
         else:
+            body = get_purchases_json(cur, where, params, limit)
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': body
+        }
+        
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': str(e)})
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
+
+IMPORT_STAGING_COLUMNS = (
+    'line, id, name, price, description, image_url, popular, discount, '
+    'category, command_template, delivery_servers, in_stock'
+)
+
+def parse_import_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ('true', 't', '1', 'yes', 'y'):
+        return True
+    if text in ('false', 'f', '0', 'no', 'n'):
+        return False
+    raise ValueError(f'ожидалось true/false, получено "{value}"')
+
+def import_text(key: str, value: Any) -> str:
+    """
+    Текстовое поле импорта: строка или число. Объекты, массивы и true/false
+    из NDJSON - ошибка строки, а не данные для COPY
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f'{key} должно быть строкой')
+
+def normalize_import_row(raw: Dict[str, Any], seen_ids: set) -> Tuple:
+    """
+    Проверяет строку импорта и приводит её к колонкам staging-таблицы.
+    Пустое или отсутствующее поле - NULL: у существующего товара оно
+    не меняется, новому достаётся значение по умолчанию
+    """
+    values = {key: (value.strip() if isinstance(value, str) else value) for key, value in raw.items()}
+    values = {key: value for key, value in values.items() if value is not None and value != ''}
+    
+    for key in ('id', 'name', 'description', 'imageUrl', 'category', 'commandTemplate'):
+        if key in values:
+            values[key] = import_text(key, values[key])
+    
+    product_id = values.get('id') or str(id_generator.next_id())
+    if len(product_id) > 255:
+        raise ValueError('id длиннее 255 символов')
+    if product_id in seen_ids:
+        raise ValueError(f'товар {product_id} уже встречался в файле')
+    
+    name = values.get('name')
+    if name is not None and len(name) > 255:
+        raise ValueError('name длиннее 255 символов')
+    category = values.get('category')
+    if category is not None and len(category) > 100:
+        raise ValueError('category длиннее 100 символов')
+    
+    price = None
+    if 'price' in values:
+        try:
+            price = round(float(values['price']), 2)
+        except (TypeError, ValueError):
+            raise ValueError(f'price не число: "{values["price"]}"')
+        if not 0 <= price < 10 ** 8:
+            raise ValueError('price вне диапазона 0..99999999.99')
+    
+    discount = None
+    if 'discount' in values:
+        try:
+            discount = int(values['discount'])
+        except (TypeError, ValueError):
+            raise ValueError(f'discount не целое: "{values["discount"]}"')
+        if not 0 <= discount <= 100:
+            raise ValueError('discount вне диапазона 0..100')
+    
+    servers = values.get('servers')
+    if isinstance(servers, str):
+        servers = json.loads(servers) if servers.startswith('[') else servers.split(';')
+    if servers is not None:
+        if not isinstance(servers, list) or not all(isinstance(s, str) for s in servers):
+            raise ValueError('servers - список id серверов')
+        # Литерал массива Postgres для колонки text[] в COPY
+        servers = '{' + ','.join(
+            '"' + s.strip().replace('\\', '\\\\').replace('"', '\\"') + '"' for s in servers if s.strip()
+        ) + '}'
+    
+    popular = parse_import_bool(values['popular']) if 'popular' in values else None
+    in_stock = parse_import_bool(values['inStock']) if 'inStock' in values else None
+    
+    seen_ids.add(product_id)
+    return (product_id, name, price, values.get('description'), values.get('imageUrl'),
+            popular, discount, category, values.get('commandTemplate'), servers, in_stock)
+
+def copy_csv_field(value: Any) -> str:
+    """
+    Поле для COPY ... (FORMAT csv): всё, кроме bool, в кавычках, чтобы пустая
+    строка осталась строкой, а None - пустое поле без кавычек, то есть NULL
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return '"' + str(value).replace('"', '""') + '"'
+
+def read_import_rows(text: str, fmt: str) -> Iterator[Tuple[int, Any]]:
+    """
+    Отдаёт (номер строки, dict полей) по мере чтения файла. Строка NDJSON,
+    которая не разбирается, отдаётся как исключение - оно попадёт в отчёт
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        for record in reader:
+            yield reader.line_num, record
+        return
+    
+    for line_number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, ValueError(f'некорректный JSON: {e.msg}')
+            continue
+        yield line_number, record if isinstance(record, dict) else ValueError('строка должна быть JSON-объектом')
+
+# Слияние staging-таблицы с каталогом одним запросом. Существующие товары
+# обновляются только по заполненным полям и только если что-то поменялось;
+# новые вставляются, если есть name, price и category. Все CTE видят один
+# снимок products, поэтому строка не может попасть и в update, и в insert
+MERGE_IMPORT_SQL = """
+    WITH updated AS (
+        UPDATE t_p79689265_minecraft_donation_s.products p SET
+            name = COALESCE(s.name, p.name),
+            price = COALESCE(s.price, p.price),
+            description = COALESCE(s.description, p.description),
+            image_url = COALESCE(s.image_url, p.image_url),
+            popular = COALESCE(s.popular, p.popular),
+            discount = COALESCE(s.discount, p.discount),
+            category = COALESCE(s.category, p.category),
+            command_template = COALESCE(s.command_template, p.command_template),
+            delivery_servers = COALESCE(s.delivery_servers, p.delivery_servers),
+            in_stock = COALESCE(s.in_stock, p.in_stock),
+            updated_at = CURRENT_TIMESTAMP
+        FROM products_import s
+        WHERE p.id = s.id
+          AND (COALESCE(s.name, p.name), COALESCE(s.price, p.price), 
+               COALESCE(s.description, p.description), COALESCE(s.image_url, p.image_url), 
+               COALESCE(s.popular, p.popular), COALESCE(s.discount, p.discount), 
+               COALESCE(s.category, p.category), COALESCE(s.command_template, p.command_template), 
+               COALESCE(s.delivery_servers, p.delivery_servers), COALESCE(s.in_stock, p.in_stock))
+              IS DISTINCT FROM 
+              (p.name, p.price, p.description, p.image_url, p.popular, p.discount, 
+               p.category, p.command_template, p.delivery_servers, p.in_stock)
+        RETURNING p.id
+    ), new_rows AS (
+        SELECT s.* FROM products_import s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM t_p79689265_minecraft_donation_s.products p WHERE p.id = s.id
+        )
+    ), inserted AS (
+        INSERT INTO t_p79689265_minecraft_donation_s.products 
+        (id, name, price, description, image_url, popular, discount, 
+         category, command_template, delivery_servers, in_stock)
+        SELECT id, name, price, COALESCE(description, ''), COALESCE(image_url, ''), 
+               COALESCE(popular, false), COALESCE(discount, 0), category, 
+               COALESCE(command_template, ''), COALESCE(delivery_servers, '{}'), 
+               COALESCE(in_stock, true)
+        FROM new_rows
+        WHERE name IS NOT NULL AND price IS NOT NULL AND category IS NOT NULL
+        ON CONFLICT (id) DO NOTHING
+        RETURNING id
+    )
+    SELECT (SELECT count(*) FROM updated), 
+           (SELECT count(*) FROM inserted), 
+           (SELECT count(*) FROM products_import) - (SELECT count(*) FROM new_rows), 
+           COALESCE((SELECT array_agg(line ORDER BY line) FROM new_rows 
+                     WHERE name IS NULL OR price IS NULL OR category IS NULL), '{}')
+"""
+
+def handle_import_products(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Массовый импорт каталога: POST ?action=import&format=csv|ndjson, тело -
+    сам файл. Строки проверяются по одной, годные уходят через COPY во
+    временную таблицу и сливаются с products одним запросом; версия каталога
+    растёт один раз на весь импорт. mode=atomic - при любой ошибке в файле
+    ничего не записывается
+    """
+    query_params = event.get('queryStringParameters') or {}
+    content_type = (get_header(event, 'Content-Type') or '').lower()
+    fmt = query_params.get('format') or ('csv' if 'csv' in content_type else 'ndjson')
+    atomic = query_params.get('mode') == 'atomic'
+    
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        body = base64.b64decode(body).decode('utf-8-sig')
+    
+    if fmt not in ('csv', 'ndjson'):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': 'format должен быть csv или ndjson'})
+        }
+    
+    rows = []
+    errors = []
+    seen_ids: set = set()
+    
+    try:
+        for line_number, record in read_import_rows(body.lstrip('\ufeff'), fmt):
+            if len(rows) + len(errors) >= IMPORT_MAX_ROWS:
+                return {
+                    'statusCode': 413,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': False, 'error': f'Не больше {IMPORT_MAX_ROWS} строк за один импорт'})
+                }
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                rows.append((line_number,) + normalize_import_row(record, seen_ids))
+            except ValueError as e:
+                errors.append({'line': line_number, 'error': str(e)})
+    except csv.Error as e:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': f'Некорректный CSV: {e}'})
+        }
+    
+    if atomic and errors:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': 'Файл содержит ошибки, ничего не импортировано', 
+                                'errors': errors})
+        }
+    
+    inserted = updated = unchanged = 0
+    
+    try:
+        conn = db_pool.getconn()
+        cur = conn.cursor()
+        
+        if rows:
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write(','.join(copy_csv_field(value) for value in row))
+                buffer.write('\n')
+            buffer.seek(0)
+            
             cur.execute("""
-                SELECT p.id, p.product_id, p.player_nickname, p.server_id, 
-                       p.price_paid, p.status, p.created_at, p.delivered_at,
-                       pr.name as product_name
-                FROM t_p79689265_minecraft_donation_s.purchases p
-                LEFT JOIN t_p79689265_minecraft_donation_s.products pr ON p.product_id = pr.id
-                ORDER BY p.created_at DESC
-                LIMIT 100
+                CREATE TEMP TABLE products_import (
+                    line INTEGER NOT NULL,
+                    id VARCHAR(255) NOT NULL,
+                    name VARCHAR(255),
+                    price DECIMAL(10, 2),
+                    description TEXT,
+                    image_url TEXT,
+                    popular BOOLEAN,
+                    discount INTEGER,
+                    category VARCHAR(100),
+                    command_template TEXT,
+                    delivery_servers TEXT[],
+                    in_stock BOOLEAN
+                ) ON COMMIT DROP
             """)
+            cur.copy_expert(f"COPY products_import ({IMPORT_STAGING_COLUMNS}) FROM STDIN WITH (FORMAT csv)", buffer)
+            
+            cur.execute(MERGE_IMPORT_SQL)
+            updated, inserted, matched, incomplete_lines = cur.fetchone()
+            unchanged = matched - updated
+            
+            for line_number in incomplete_lines:
+                errors.append({'line': line_number, 'error': 'для нового товара нужны name, price и category'})
+            
+            if atomic and incomplete_lines:
+                conn.rollback()
+                errors.sort(key=lambda e: e['line'])
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'body': json.dumps({'success': False, 'error': 'Файл содержит ошибки, ничего не импортировано', 
+                                        'errors': errors})
+                }
+            
+            if updated or inserted:
+                bump_catalog_version(cur)
+            conn.commit()
+        
+        errors.sort(key=lambda e: e['line'])
         
-        rows = cur.fetchall()
-        purchases = []
-        
-        for row in rows:
-            purchases.append({
-                'id': row[0],
-                'productId': row[1],
-                'playerNickname': row[2],
-                'serverId': row[3],
-                'pricePaid': float(row[4]),
-                'status': row[5],
-                'createdAt': row[6].isoformat() if row[6] else None,
-                'deliveredAt': row[7].isoformat() if row[7] else None,
-                'productName': row[8]
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({
+                'success': True,
+                'inserted': inserted,
+                'updated': updated,
+                'unchanged': unchanged,
+                'failed': len(errors),
+                'errors': errors
             })
+        }
+        
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': str(e)})
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
+
+def handle_export_products(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выгрузка всего каталога (включая товары не в наличии) в формате,
+    который принимает импорт. CSV отдаёт сам Postgres через COPY TO STDOUT,
+    NDJSON читается серверным курсором порциями по EXPORT_FETCH_SIZE -
+    весь каталог не поднимается в память строками Python
+    """
+    query_params = event.get('queryStringParameters') or {}
+    fmt = query_params.get('format', 'csv')
+    
+    if fmt not in ('csv', 'ndjson'):
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': 'format должен быть csv или ndjson'})
+        }
+    
+    try:
+        conn = db_pool.getconn()
+        buffer = io.StringIO()
         
-        cur.close()
-        conn.close()
+        if fmt == 'csv':
+            cur = conn.cursor()
+            cur.copy_expert("""
+                COPY (
+                    SELECT id, name, price, description, image_url AS "imageUrl", popular, 
+                           discount, category, command_template AS "commandTemplate", 
+                           array_to_string(delivery_servers, ';') AS servers, in_stock AS "inStock"
+                    FROM t_p79689265_minecraft_donation_s.products
+                    ORDER BY id
+                ) TO STDOUT WITH (FORMAT csv, HEADER)
+            """, buffer)
+            content_type = 'text/csv; charset=utf-8'
+        else:
+            cur = conn.cursor(name='products_export')
+            cur.itersize = EXPORT_FETCH_SIZE
+            cur.execute("""
+                SELECT json_build_object(
+                    'id', id, 
+                    'name', name, 
+                    'price', price, 
+                    'description', description, 
+                    'imageUrl', image_url, 
+                    'popular', popular, 
+                    'discount', discount, 
+                    'category', category, 
+                    'commandTemplate', command_template, 
+                    'servers', COALESCE(delivery_servers, '{}'), 
+                    'inStock', in_stock
+                )::text
+                FROM t_p79689265_minecraft_donation_s.products
+                ORDER BY id
+            """)
+            for (line,) in cur:
+                buffer.write(line)
+                buffer.write('\n')
+            content_type = 'application/x-ndjson; charset=utf-8'
         
         return {
             'statusCode': 200,
+            'headers': {
+                'Content-Type': content_type,
+                'Content-Disposition': f'attachment; filename="products.{fmt}"',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': buffer.getvalue()
+        }
+        
+    except Exception as e:
+        return {
+            'statusCode': 500,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({'success': True, 'purchases': purchases})
+            'body': json.dumps({'success': False, 'error': str(e)})
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
+
+def handle_suggest_players(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Подсказки ников для админки: игроки с покупками, чей ник начинается
+    с prefix (без учёта регистра), с числом покупок. Читается только
+    индекс idx_purchases_player_key_prefix
+    """
+    query_params = event.get('queryStringParameters') or {}
+    prefix = (normalize_nickname(query_params.get('prefix')) or '').lower()
+    
+    try:
+        limit = max(1, min(int(query_params.get('limit') or 10), PLAYER_SUGGEST_MAX))
+    except (ValueError, TypeError):
+        limit = 10
+    
+    if not prefix:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': False, 'error': 'Укажите prefix'})
+        }
+    
+    pattern = prefix[:100].replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    
+    try:
+        conn = db_pool.getconn()
+        cur = conn.cursor()
+        
+        cur.execute("""
+            SELECT player_key COLLATE "C", max(player_nickname), count(*)
+            FROM t_p79689265_minecraft_donation_s.purchases
+            WHERE player_key COLLATE "C" LIKE %s
+            GROUP BY 1
+            ORDER BY 1
+            LIMIT %s
+        """, (pattern, limit))
+        
+        players = [
+            {'playerKey': row[0], 'playerNickname': row[1], 'purchases': row[2]}
+            for row in cur.fetchall()
+        ]
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'body': json.dumps({'success': True, 'players': players})
         }
         
     except Exception as e:
@@ -460,4 +2460,9 @@ def handle_get_purchases(event: Dict[str, Any]) -> Dict[str, Any]:
                 'Access-Control-Allow-Origin': '*'
             },
             'body': json.dumps({'success': False, 'error': str(e)})
-        }
\ No newline at end of file
+        }
+    finally:
+        if 'cur' in locals():
+            cur.close()
+        if 'conn' in locals():
+            db_pool.putconn(conn)
\ No newline at end of file
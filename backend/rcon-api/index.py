@@ -1,8 +1,14 @@
 import json
 import os
-import psycopg2
+from pg_pool import ConnectionPool
 from typing import Dict, Any
 
+DSN = os.environ.get('DATABASE_URL')
+
+db_pool = ConnectionPool(DSN)
+
+
+@db_pool.report_stats
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API для управления RCON серверами (выдача донатов)
@@ -38,7 +44,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'DATABASE_URL не настроен'})
             }
         
-        conn = psycopg2.connect(db_url)
+        conn = db_pool.getconn()
         cur = conn.cursor()
         
         if method == 'GET':
@@ -209,4 +215,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         if 'cur' in locals():
             cur.close()
         if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+            db_pool.putconn(conn)
\ No newline at end of file
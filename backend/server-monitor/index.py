@@ -4,55 +4,99 @@ Args: event - CloudFunction event dict, context - execution context object
 Returns: HTTP response with updated server stats
 '''
 
+import base64
+import hashlib
 import json
+import os
+import random
+import selectors
 import socket
 import struct
+import threading
 import time
+import uuid
+import psycopg2
+from psycopg2.extras import execute_values
+from pg_pool import ConnectionPool
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Dict, Any, List, Optional, Tuple
 
-def ping_minecraft_server(host: str, port: int, timeout: int = 5) -> Optional[Dict[str, Any]]:
+try:
+    import dns.exception
+    import dns.resolver
+    HAS_DNSPYTHON = True
+except ImportError:
+    HAS_DNSPYTHON = False
+
+DSN = os.environ.get('DATABASE_URL')
+
+MONITOR_CONCURRENCY = int(os.environ.get('MONITOR_CONCURRENCY', '16'))
+MONITOR_PING_TIMEOUT = float(os.environ.get('MONITOR_PING_TIMEOUT', '5'))
+MONITOR_DEADLINE = float(os.environ.get('MONITOR_DEADLINE', '8'))
+DNS_DEFAULT_TTL = float(os.environ.get('DNS_DEFAULT_TTL', '60'))
+DNS_NEGATIVE_TTL = float(os.environ.get('DNS_NEGATIVE_TTL', '60'))
+DNS_MIN_TTL = float(os.environ.get('DNS_MIN_TTL', '5'))
+DNS_MAX_TTL = float(os.environ.get('DNS_MAX_TTL', '3600'))
+DNS_CACHE_MAX_ENTRIES = int(os.environ.get('DNS_CACHE_MAX_ENTRIES', '4096'))
+HAPPY_EYEBALLS_DELAY = float(os.environ.get('HAPPY_EYEBALLS_DELAY', '0.25'))
+FAVICON_PENDING_MAX = int(os.environ.get('FAVICON_PENDING_MAX', '512'))
+FAVICON_DATA_URL_PREFIX = 'data:image/png;base64,'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+QUERY_TIMEOUT = float(os.environ.get('QUERY_TIMEOUT', '3'))
+QUERY_TOKEN_TTL = float(os.environ.get('QUERY_TOKEN_TTL', '25'))
+QUERY_MAX_ATTEMPTS = int(os.environ.get('QUERY_MAX_ATTEMPTS', '2'))
+MONITOR_CACHE_TTL = float(os.environ.get('MONITOR_CACHE_TTL', '15'))
+MONITOR_CACHE_MAX_ENTRIES = int(os.environ.get('MONITOR_CACHE_MAX_ENTRIES', '1024'))
+MONITOR_PING_CHANGE_MS = int(os.environ.get('MONITOR_PING_CHANGE_MS', '20'))
+MONITOR_STATS_HEARTBEAT = int(os.environ.get('MONITOR_STATS_HEARTBEAT', '60'))
+HISTORY_RAW_RETENTION_DAYS = int(os.environ.get('HISTORY_RAW_RETENTION_DAYS', '2'))
+HISTORY_HOURLY_RETENTION_DAYS = int(os.environ.get('HISTORY_HOURLY_RETENTION_DAYS', '90'))
+HISTORY_DAILY_RETENTION_DAYS = int(os.environ.get('HISTORY_DAILY_RETENTION_DAYS', '730'))
+PRESENCE_RETENTION_DAYS = int(os.environ.get('PRESENCE_RETENTION_DAYS', '30'))
+HISTORY_CLEANUP_INTERVAL = float(os.environ.get('HISTORY_CLEANUP_INTERVAL', '3600'))
+SCHEDULE_BASE_INTERVAL = int(os.environ.get('SCHEDULE_BASE_INTERVAL', '60'))
+SCHEDULE_MIN_INTERVAL = int(os.environ.get('SCHEDULE_MIN_INTERVAL', '30'))
+SCHEDULE_IDLE_MAX_INTERVAL = int(os.environ.get('SCHEDULE_IDLE_MAX_INTERVAL', '300'))
+SCHEDULE_OFFLINE_MAX_INTERVAL = int(os.environ.get('SCHEDULE_OFFLINE_MAX_INTERVAL', '1800'))
+SCHEDULE_ACTIVITY_DELTA = int(os.environ.get('SCHEDULE_ACTIVITY_DELTA', '5'))
+SCHEDULE_JITTER = float(os.environ.get('SCHEDULE_JITTER', '0.15'))
+SCHEDULE_BATCH = int(os.environ.get('SCHEDULE_BATCH', '100'))
+SCHEDULE_CLAIM_TIMEOUT = int(os.environ.get('SCHEDULE_CLAIM_TIMEOUT', '60'))
+
+db_pool = ConnectionPool(DSN)
+
+
+SLP_PROTOCOL_VERSION = -1
+SLP_BUFFER_SIZE = 16384
+SLP_MAX_PACKET = 2 * 1024 * 1024
+
+def ping_minecraft_server(host: str, port: int, timeout: float = MONITOR_PING_TIMEOUT) -> Optional[Dict[str, Any]]:
     """
     Пингует Minecraft сервер и возвращает статистику
     """
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(timeout)
+        host, port, addresses = resolve_minecraft_address(host, port, timeout)
         
         start_time = time.time()
-        sock.connect((host, port))
-        
-        # Handshake packet
-        handshake = b'\x00\x00'
-        handshake += host.encode('utf-8')
-        handshake += struct.pack('>H', port)
-        handshake += b'\x01'
+        sock = connect_happy_eyeballs(addresses, timeout)
         
-        # Send handshake
-        sock.send(b'\x00' + handshake)
-        
-        # Request status
-        sock.send(b'\x01\x00')
-        
-        # Read response
-        length = _read_varint(sock)
-        packet_id = _read_varint(sock)
-        
-        if packet_id != 0:
+        try:
+            # Handshake (next state = 1, status) и Status Request одним send
+            sock.sendall(_handshake_packet(host, port) + _pack_packet(0x00, b''))
+            
+            packet_id, payload = _PacketReader(sock).read_packet()
+            if packet_id != 0:
+                return None
+            
+            data_length, offset = _decode_varint(payload, 0)
+            data = payload[offset:offset + data_length]
+            
+            ping_time = int((time.time() - start_time) * 1000)
+        finally:
             sock.close()
-            return None
-        
-        data_length = _read_varint(sock)
-        data = b''
-        while len(data) < data_length:
-            chunk = sock.recv(data_length - len(data))
-            if not chunk:
-                break
-            data += chunk
-        
-        ping_time = int((time.time() - start_time) * 1000)
-        sock.close()
         
-        response = json.loads(data.decode('utf-8'))
+        response = json.loads(str(data, 'utf-8'))
+        favicon = response.pop('favicon', None) if isinstance(response, dict) else None
         
         return {
             'isOnline': True,
@@ -61,7 +105,8 @@ def ping_minecraft_server(host: str, port: int, timeout: int = 5) -> Optional[Di
             'maxPlayers': response.get('players', {}).get('max', 0),
             'onlinePlayers': response.get('players', {}).get('online', 0),
             'motd': _clean_motd(response.get('description', '')),
-            'playerList': [p.get('name', '') for p in response.get('players', {}).get('sample', [])]
+            'playerList': [p.get('name', '') for p in response.get('players', {}).get('sample', [])],
+            'faviconHash': remember_favicon(favicon)
         }
         
     except (socket.timeout, socket.error, ConnectionRefusedError, json.JSONDecodeError):
@@ -72,28 +117,312 @@ def ping_minecraft_server(host: str, port: int, timeout: int = 5) -> Optional[Di
             'maxPlayers': 0,
             'onlinePlayers': 0,
             'motd': 'Сервер недоступен',
-            'playerList': []
+            'playerList': [],
+            'faviconHash': None
         }
     except Exception:
         return None
 
-def _read_varint(sock: socket.socket) -> int:
+_dns_cache: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+_dns_lock = threading.Lock()
+_dns_resolver: Any = None
+
+def _dns_cache_get(kind: str, name: str) -> Tuple[bool, Any]:
+    with _dns_lock:
+        entry = _dns_cache.get((kind, name))
+        if entry and entry[0] > time.monotonic():
+            return True, entry[1]
+    return False, None
+
+def _dns_cache_put(kind: str, name: str, value: Any, ttl: float) -> None:
+    ttl = min(max(ttl, DNS_MIN_TTL), DNS_MAX_TTL)
+    now = time.monotonic()
+    with _dns_lock:
+        if len(_dns_cache) >= DNS_CACHE_MAX_ENTRIES:
+            for key in [k for k, (expires, _) in _dns_cache.items() if expires <= now]:
+                del _dns_cache[key]
+        _dns_cache[(kind, name)] = (now + ttl, value)
+
+def _get_resolver(timeout: float) -> Any:
+    global _dns_resolver
+    if _dns_resolver is None:
+        _dns_resolver = dns.resolver.Resolver()
+    _dns_resolver.lifetime = timeout
+    return _dns_resolver
+
+def resolve_srv(host: str, timeout: float) -> Optional[Tuple[str, int]]:
     """
-    Читает VarInt из сокета
+    Ищет SRV-запись _minecraft._tcp.<host>. Отсутствие записи тоже кэшируется
+    """
+    if not HAS_DNSPYTHON or _is_ip_address(host):
+        return None
+    
+    name = f'_minecraft._tcp.{host}'
+    found, value = _dns_cache_get('SRV', name)
+    if found:
+        return value
+    
+    try:
+        answer = _get_resolver(timeout).resolve(name, 'SRV')
+    except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+        _dns_cache_put('SRV', name, None, DNS_NEGATIVE_TTL)
+        return None
+    except dns.exception.DNSException:
+        return None
+    
+    record = sorted(answer, key=lambda r: (r.priority, -r.weight))[0]
+    value = (str(record.target).rstrip('.'), int(record.port))
+    _dns_cache_put('SRV', name, value, answer.rrset.ttl)
+    return value
+
+def resolve_addresses(host: str, port: int, timeout: float) -> List[Tuple[int, Tuple[Any, ...]]]:
+    """
+    A/AAAA адреса хоста как (family, sockaddr) с кэшем по TTL ответа.
+    Несуществующее имя кэшируется на DNS_NEGATIVE_TTL
+    """
+    if _is_ip_address(host):
+        family = socket.AF_INET6 if ':' in host else socket.AF_INET
+        return [(family, (host, port))]
+    
+    found, value = _dns_cache_get('ADDR', host)
+    if found:
+        if value is None:
+            raise socket.gaierror(socket.EAI_NONAME, f'{host}: NXDOMAIN (cached)')
+        return [(family, (address, port)) for family, address in value]
+    
+    addresses: List[Tuple[int, str]] = []
+    ttl = DNS_DEFAULT_TTL
+    
+    if HAS_DNSPYTHON:
+        resolver = _get_resolver(timeout)
+        ttls = []
+        for rdtype, family in (('AAAA', socket.AF_INET6), ('A', socket.AF_INET)):
+            try:
+                answer = resolver.resolve(host, rdtype)
+            except dns.resolver.NXDOMAIN:
+                break
+            except dns.exception.DNSException:
+                continue
+            ttls.append(answer.rrset.ttl)
+            addresses.extend((family, record.address) for record in answer)
+        
+        if ttls:
+            ttl = min(ttls)
+    
+    if not addresses:
+        # Без dnspython (или если он не ответил) - системный резолвер с TTL по умолчанию.
+        # Он же учитывает /etc/hosts, поэтому отрицательный ответ кэшируется только здесь
+        try:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            if e.errno == socket.EAI_NONAME:
+                _dns_cache_put('ADDR', host, None, DNS_NEGATIVE_TTL)
+            raise
+        seen = set()
+        for family, _, _, _, sockaddr in infos:
+            if (family, sockaddr[0]) not in seen:
+                seen.add((family, sockaddr[0]))
+                addresses.append((family, sockaddr[0]))
+    
+    _dns_cache_put('ADDR', host, addresses, ttl)
+    return [(family, (address, port)) for family, address in addresses]
+
+def _is_ip_address(host: str) -> bool:
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except OSError:
+            continue
+    return False
+
+def _interleave_families(addresses: List[Tuple[int, Tuple[Any, ...]]]) -> List[Tuple[int, Tuple[Any, ...]]]:
+    """
+    Чередует IPv6 и IPv4 адреса, начиная с IPv6 (RFC 8305)
+    """
+    v6 = [a for a in addresses if a[0] == socket.AF_INET6]
+    v4 = [a for a in addresses if a[0] != socket.AF_INET6]
+    result = []
+    for i in range(max(len(v6), len(v4))):
+        result.extend(group[i] for group in (v6, v4) if i < len(group))
+    return result
+
+def connect_happy_eyeballs(addresses: List[Tuple[int, Tuple[Any, ...]]], timeout: float,
+                           delay: float = HAPPY_EYEBALLS_DELAY) -> socket.socket:
+    """
+    Подключается к первому ответившему адресу: следующая попытка стартует,
+    если предыдущие не соединились за delay секунд
+    """
+    pending = _interleave_families(addresses)
+    if not pending:
+        raise socket.gaierror(socket.EAI_NONAME, 'No addresses to connect')
+    
+    deadline = time.monotonic() + timeout
+    selector = selectors.DefaultSelector()
+    attempts: List[socket.socket] = []
+    last_error: Optional[Exception] = None
+    winner: Optional[socket.socket] = None
+    
+    try:
+        while winner is None:
+            if pending:
+                family, sockaddr = pending.pop(0)
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.setblocking(False)
+                try:
+                    sock.connect(sockaddr)
+                    winner = sock
+                    attempts.append(sock)
+                    break
+                except BlockingIOError:
+                    selector.register(sock, selectors.EVENT_WRITE)
+                    attempts.append(sock)
+                except OSError as e:
+                    sock.close()
+                    last_error = e
+                    continue
+            
+            if not selector.get_map():
+                raise last_error or socket.timeout('connect timed out')
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout('connect timed out')
+            
+            wait_for = min(delay, remaining) if pending else remaining
+            for key, _ in selector.select(wait_for):
+                sock = key.fileobj
+                selector.unregister(sock)
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error == 0:
+                    winner = sock
+                    break
+                last_error = OSError(error, os.strerror(error))
+    finally:
+        selector.close()
+        for sock in attempts:
+            if sock is not winner:
+                sock.close()
+    
+    winner.setblocking(True)
+    winner.settimeout(max(deadline - time.monotonic(), 0.1))
+    return winner
+
+def resolve_minecraft_address(host: str, port: int, timeout: float) -> Tuple[str, int, List[Tuple[int, Tuple[Any, ...]]]]:
+    """
+    Разрешает адрес сервера (SRV - только для порта по умолчанию, как в клиенте игры).
+    Возвращает фактические хост, порт и список адресов для подключения
+    """
+    if port == 25565:
+        srv = resolve_srv(host, timeout)
+        if srv:
+            host, port = srv
+    
+    return host, port, resolve_addresses(host, port, timeout)
+
+def _encode_varint(value: int) -> bytes:
+    """
+    Кодирует VarInt (отрицательные числа как 32-битные без знака)
+    """
+    value &= 0xFFFFFFFF
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def _decode_varint(buf: Any, offset: int) -> Tuple[int, int]:
+    """
+    Читает VarInt из буфера, возвращает значение и смещение после него
     """
     result = 0
     for i in range(5):
-        byte = sock.recv(1)
-        if not byte:
-            raise EOFError('Unexpected end of stream')
-        
-        byte_val = ord(byte)
+        if offset >= len(buf):
+            raise EOFError('Unexpected end of packet')
+        byte_val = buf[offset]
+        offset += 1
         result |= (byte_val & 0x7F) << (7 * i)
-        
         if not byte_val & 0x80:
-            break
-    
-    return result
+            return result, offset
+    raise ValueError('VarInt is too big')
+
+def _pack_packet(packet_id: int, data: bytes) -> bytes:
+    body = _encode_varint(packet_id) + data
+    return _encode_varint(len(body)) + body
+
+def _handshake_packet(host: str, port: int) -> bytes:
+    host_bytes = host.encode('utf-8')
+    data = (
+        _encode_varint(SLP_PROTOCOL_VERSION)
+        + _encode_varint(len(host_bytes)) + host_bytes
+        + struct.pack('>H', port)
+        + _encode_varint(1)
+    )
+    return _pack_packet(0x00, data)
+
+
+class _PacketReader:
+    """
+    Читает пакеты протокола через recv_into в заранее выделенный буфер.
+    Полезная нагрузка отдаётся как memoryview, без промежуточных копий
+    """
+
+    def __init__(self, sock: socket.socket, size: int = SLP_BUFFER_SIZE):
+        self.sock = sock
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def read_packet(self) -> Tuple[int, memoryview]:
+        length = self._read_varint()
+        if length <= 0 or length > SLP_MAX_PACKET:
+            raise ValueError(f'Bad packet length {length}')
+        
+        self._fill(length)
+        payload = self.view[self.start:self.start + length]
+        self.start += length
+        
+        packet_id, offset = _decode_varint(payload, 0)
+        return packet_id, payload[offset:]
+
+    def _read_varint(self) -> int:
+        while True:
+            try:
+                value, offset = _decode_varint(self.view[:self.end], self.start)
+            except EOFError:
+                self._fill(self.end - self.start + 1)
+                continue
+            self.start = offset
+            return value
+
+    def _fill(self, need: int) -> None:
+        """
+        Дочитывает из сокета, пока в буфере не окажется need байт
+        """
+        available = self.end - self.start
+        if available >= need:
+            return
+        
+        if self.start + need > len(self.buf):
+            if need > len(self.buf):
+                # Пакет больше буфера: один раз выделяем буфер нужного размера
+                buf = bytearray(need)
+                buf[:available] = self.view[self.start:self.end]
+                self.buf, self.view = buf, memoryview(buf)
+            else:
+                self.buf[:available] = self.buf[self.start:self.end]
+            self.start, self.end = 0, available
+        
+        while self.end - self.start < need:
+            received = self.sock.recv_into(self.view[self.end:])
+            if not received:
+                raise EOFError('Unexpected end of stream')
+            self.end += received
 
 def _clean_motd(motd: Any) -> str:
     """
@@ -109,6 +438,703 @@ def _clean_motd(motd: Any) -> str:
         return motd
     return str(motd)
 
+QUERY_MAGIC = b'\xfe\xfd'
+QUERY_TYPE_HANDSHAKE = 9
+QUERY_TYPE_STAT = 0
+QUERY_SESSION_MASK = 0x0F0F0F0F
+QUERY_PLAYERS_MARKER = b'\x00\x00\x01player_\x00\x00'
+
+_query_tokens: Dict[Tuple[str, int], Tuple[float, int]] = {}
+_query_lock = threading.Lock()
+
+def _query_token(sockaddr: Tuple[Any, ...]) -> Optional[int]:
+    with _query_lock:
+        entry = _query_tokens.get(sockaddr[:2])
+        if entry and time.monotonic() - entry[0] < QUERY_TOKEN_TTL:
+            return entry[1]
+    return None
+
+def _store_query_token(sockaddr: Tuple[Any, ...], token: Optional[int]) -> None:
+    with _query_lock:
+        if token is None:
+            _query_tokens.pop(sockaddr[:2], None)
+        else:
+            _query_tokens[sockaddr[:2]] = (time.monotonic(), token)
+
+def _query_packet(packet_type: int, session_id: int, token: Optional[int] = None) -> bytes:
+    packet = QUERY_MAGIC + struct.pack('>Bi', packet_type, session_id)
+    if token is not None:
+        # Лишние 4 байта после токена превращают basic stat в full stat
+        packet += struct.pack('>i', token) + b'\x00\x00\x00\x00'
+    return packet
+
+def _parse_full_stat(payload: bytes) -> Dict[str, Any]:
+    """
+    Ответ full stat: 11 байт заголовка, пары key\\0value\\0, затем
+    маркер player_ и ники через \\0
+    """
+    kv_part, _, players_part = payload[11:].partition(QUERY_PLAYERS_MARKER)
+    fields = kv_part.split(b'\x00')
+    info = {
+        str(fields[i], 'utf-8', 'replace'): str(fields[i + 1], 'utf-8', 'replace')
+        for i in range(0, len(fields) - 1, 2)
+    }
+    players = [str(name, 'utf-8', 'replace') for name in players_part.split(b'\x00') if name]
+    
+    return {
+        'isOnline': True,
+        'version': info.get('version', ''),
+        'maxPlayers': int(info.get('maxplayers') or 0),
+        'onlinePlayers': int(info.get('numplayers') or len(players)),
+        'motd': _clean_motd(info.get('hostname', '')),
+        'playerList': players,
+        'faviconHash': None
+    }
+
+def query_servers(targets: List[Tuple[str, int]], timeout: float = QUERY_TIMEOUT) -> Dict[Tuple[str, int], Optional[Dict[str, Any]]]:
+    """
+    Query-протокол (UDP, GameSpy4) для нескольких серверов через один сокет
+    на семейство адресов. Challenge-токен кэшируется на QUERY_TOKEN_TTL, так
+    что обычно это один обмен датаграммами на сервер; просроченный токен
+    сервер молча игнорирует - тогда повторяем с handshake. Возвращает
+    полный список игроков; None - сервер не ответил
+    """
+    results: Dict[Tuple[str, int], Optional[Dict[str, Any]]] = {target: None for target in targets}
+    deadline = time.monotonic() + timeout
+    step_timeout = max(timeout / 3, 0.2)
+    
+    sessions: Dict[int, Dict[str, Any]] = {}
+    for target in dict.fromkeys(targets):
+        try:
+            addresses = resolve_addresses(target[0], target[1], timeout)
+        except (OSError, UnicodeError):
+            continue
+        if not addresses:
+            continue
+        family, sockaddr = addresses[0]
+        session_id = random.getrandbits(31) & QUERY_SESSION_MASK
+        while session_id in sessions:
+            session_id = random.getrandbits(31) & QUERY_SESSION_MASK
+        sessions[session_id] = {'target': target, 'family': family, 'sockaddr': sockaddr, 'attempts': 0}
+    
+    if not sessions:
+        return results
+    
+    sockets: Dict[int, socket.socket] = {}
+    selector = selectors.DefaultSelector()
+    
+    def send(session_id: int, session: Dict[str, Any], handshake: bool) -> None:
+        token = None if handshake else _query_token(session['sockaddr'])
+        if token is None:
+            packet = _query_packet(QUERY_TYPE_HANDSHAKE, session_id)
+        else:
+            packet = _query_packet(QUERY_TYPE_STAT, session_id, token)
+        session['attempts'] += 1
+        session['sent_at'] = time.monotonic()
+        try:
+            sockets[session['family']].sendto(packet, session['sockaddr'])
+        except OSError:
+            session['failed'] = True
+    
+    try:
+        for session in sessions.values():
+            if session['family'] not in sockets:
+                sock = socket.socket(session['family'], socket.SOCK_DGRAM)
+                sock.setblocking(False)
+                sockets[session['family']] = sock
+                selector.register(sock, selectors.EVENT_READ)
+        
+        for session_id, session in sessions.items():
+            send(session_id, session, handshake=False)
+        
+        pending = {sid for sid, session in sessions.items() if not session.get('failed')}
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            
+            for session_id in list(pending):
+                session = sessions[session_id]
+                if now - session['sent_at'] < step_timeout:
+                    continue
+                # Нет ответа: токен мог устареть или датаграмма потерялась
+                _store_query_token(session['sockaddr'], None)
+                if session['attempts'] >= QUERY_MAX_ATTEMPTS:
+                    pending.discard(session_id)
+                else:
+                    send(session_id, session, handshake=True)
+            
+            if not pending:
+                break
+            wait_for = min(deadline, min(sessions[sid]['sent_at'] for sid in pending) + step_timeout) - now
+            for key, _ in selector.select(max(wait_for, 0)):
+                while True:
+                    try:
+                        data, sender = key.fileobj.recvfrom(65535)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        break
+                    if len(data) < 5:
+                        continue
+                    packet_type, session_id = struct.unpack_from('>Bi', data)
+                    session = sessions.get(session_id)
+                    if session_id not in pending or sender[:2] != session['sockaddr'][:2]:
+                        continue
+                    
+                    if packet_type == QUERY_TYPE_HANDSHAKE:
+                        try:
+                            token = int(data[5:].split(b'\x00', 1)[0])
+                        except ValueError:
+                            continue
+                        _store_query_token(session['sockaddr'], token)
+                        session['attempts'] -= 1
+                        send(session_id, session, handshake=False)
+                    elif packet_type == QUERY_TYPE_STAT:
+                        try:
+                            stats = _parse_full_stat(data[5:])
+                        except ValueError:
+                            continue
+                        stats['ping'] = int((time.monotonic() - session['sent_at']) * 1000)
+                        results[session['target']] = stats
+                        pending.discard(session_id)
+    finally:
+        selector.close()
+        for sock in sockets.values():
+            sock.close()
+    
+    return results
+
+_favicon_pending: Dict[str, bytes] = {}
+_favicon_stored: Dict[str, float] = {}
+_favicon_lock = threading.Lock()
+
+def remember_favicon(data_url: Any) -> Optional[str]:
+    """
+    Хэш иконки по содержимому data URL (sha256). None - если иконка не PNG
+    или её некуда отложить: хэш без строки в server_favicons отдавал бы 404.
+    Сама иконка держится в памяти только до записи в server_favicons
+    """
+    if not isinstance(data_url, str):
+        return None
+    favicon_hash = hashlib.sha256(data_url.encode('ascii', 'replace')).hexdigest()
+    with _favicon_lock:
+        if favicon_hash in _favicon_stored or favicon_hash in _favicon_pending:
+            return favicon_hash
+    
+    data = _decode_favicon(data_url)
+    if data is None:
+        return None
+    with _favicon_lock:
+        if favicon_hash not in _favicon_pending and len(_favicon_pending) >= FAVICON_PENDING_MAX:
+            return None
+        _favicon_pending.setdefault(favicon_hash, data)
+    return favicon_hash
+
+def _decode_favicon(data_url: str) -> Optional[bytes]:
+    """
+    data:image/png;base64,... -> байты картинки. Принимается только PNG
+    с настоящей сигнатурой: тип из data URL не доверяем, иначе SVG со
+    скриптом отдавался бы с нашего домена как есть
+    """
+    if not data_url.startswith(FAVICON_DATA_URL_PREFIX):
+        return None
+    try:
+        data = base64.b64decode(data_url[len(FAVICON_DATA_URL_PREFIX):])
+    except ValueError:
+        return None
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    return data
+
+def save_favicons(cur: Any, updated_stats: Dict[str, Dict[str, Any]]) -> List[str]:
+    """
+    Дописывает в server_favicons иконки, которых там ещё нет. Возвращает
+    их хэши, чтобы после commit больше не писать их повторно
+    """
+    hashes = {stats.get('faviconHash') for stats in updated_stats.values()} - {None}
+    with _favicon_lock:
+        pending = [(h, _favicon_pending[h]) for h in hashes if h in _favicon_pending and h not in _favicon_stored]
+    
+    if pending:
+        execute_values(cur, """
+            INSERT INTO server_favicons (hash, content_type, data) VALUES %s 
+            ON CONFLICT (hash) DO NOTHING
+        """, [(favicon_hash, 'image/png', psycopg2.Binary(data)) for favicon_hash, data in pending],
+            page_size=len(pending))
+    
+    return [favicon_hash for favicon_hash, _ in pending]
+
+def mark_favicons_stored(hashes: List[str]) -> None:
+    with _favicon_lock:
+        if len(_favicon_stored) >= FAVICON_PENDING_MAX:
+            _favicon_stored.clear()
+        for favicon_hash in hashes:
+            _favicon_pending.pop(favicon_hash, None)
+            _favicon_stored[favicon_hash] = time.time()
+
+_ping_cache: Dict[Tuple[str, int], Tuple[float, float, Optional[Dict[str, Any]]]] = {}
+_ping_inflight: Dict[Tuple[str, int], Future] = {}
+_ping_lock = threading.Lock()
+
+def cached_ping(host: str, port: int, ttl: float = MONITOR_CACHE_TTL) -> Tuple[Optional[Dict[str, Any]], float, float]:
+    """
+    Пинг с кэшем на ttl секунд. Параллельные запросы к одному серверу
+    ждут один общий пинг. Возвращает (результат, возраст в секундах, время замера)
+    """
+    key = (host.lower(), port)
+    now = time.monotonic()
+    
+    with _ping_lock:
+        entry = _ping_cache.get(key)
+        if entry and now - entry[0] < ttl:
+            return entry[2], now - entry[0], entry[1]
+        
+        future = _ping_inflight.get(key)
+        owner = future is None
+        if owner:
+            future = Future()
+            _ping_inflight[key] = future
+    
+    if not owner:
+        result, fetched_at = future.result()
+        return result, 0.0, fetched_at
+    
+    try:
+        result = ping_minecraft_server(host, port)
+    except Exception:
+        result = None
+    fetched_at = time.time()
+    
+    with _ping_lock:
+        _store_ping(key, result, fetched_at, ttl)
+        del _ping_inflight[key]
+    
+    future.set_result((result, fetched_at))
+    return result, 0.0, fetched_at
+
+def _store_ping(key: Tuple[str, int], result: Optional[Dict[str, Any]], fetched_at: float, ttl: float) -> None:
+    """
+    Кладёт результат в кэш пинга; вызывается под _ping_lock
+    """
+    if len(_ping_cache) >= MONITOR_CACHE_MAX_ENTRIES:
+        expired = [k for k, (at, _, _) in _ping_cache.items() if time.monotonic() - at >= ttl]
+        for k in expired:
+            del _ping_cache[k]
+    _ping_cache[key] = (time.monotonic(), fetched_at, result)
+
+def prefetch_query(servers: List[Dict[str, Any]], ttl: float = MONITOR_CACHE_TTL, timeout: float = QUERY_TIMEOUT) -> None:
+    """
+    Для серверов с queryPort, которых нет в кэше, одним пакетным
+    Query-запросом получает полную статистику и кладёт её в кэш пинга.
+    Кто не ответил по UDP, дальше пингуется обычным Server List Ping
+    """
+    now = time.monotonic()
+    targets = {}
+    with _ping_lock:
+        for server in servers:
+            if not server.get('queryPort'):
+                continue
+            key = (server['address'].lower(), server.get('port', 25565))
+            entry = _ping_cache.get(key)
+            if not (entry and now - entry[0] < ttl) and key not in _ping_inflight:
+                targets[(server['address'], int(server['queryPort']))] = key
+    
+    if not targets:
+        return
+    
+    results = query_servers(list(targets), timeout)
+    fetched_at = time.time()
+    with _ping_lock:
+        for target, result in results.items():
+            if result:
+                _store_ping(targets[target], result, fetched_at, ttl)
+
+def _build_stats(server: Dict[str, Any], stats: Optional[Dict[str, Any]], error_motd: str,
+                 cache_age: float = 0.0, fetched_at: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Собирает запись статистики сервера в формате фронтенда
+    """
+    server_id = server['id']
+    max_players = server.get('maxPlayers', 100)
+    last_update = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(fetched_at))
+    
+    if stats:
+        return {
+            'id': f'stats_{server_id}',
+            'serverId': server_id,
+            'onlinePlayers': stats['onlinePlayers'],
+            'maxPlayers': stats['maxPlayers'] if stats['maxPlayers'] > 0 else max_players,
+            'ping': stats['ping'],
+            'isOnline': stats['isOnline'],
+            'version': stats['version'] or server.get('version', ''),
+            'motd': stats['motd'],
+            'playerList': stats['playerList'],
+            'faviconHash': stats.get('faviconHash'),
+            'lastUpdate': last_update,
+            'cacheAge': round(cache_age, 1)
+        }
+    
+    return {
+        'id': f'stats_{server_id}',
+        'serverId': server_id,
+        'onlinePlayers': 0,
+        'maxPlayers': max_players,
+        'ping': 0,
+        'isOnline': False,
+        'version': server.get('version', ''),
+        'motd': error_motd,
+        'playerList': [],
+        'faviconHash': None,
+        'lastUpdate': last_update,
+        'cacheAge': round(cache_age, 1)
+    }
+
+def ping_servers(servers: List[Dict[str, Any]], concurrency: int = MONITOR_CONCURRENCY,
+                 deadline: float = MONITOR_DEADLINE) -> Dict[str, Dict[str, Any]]:
+    """
+    Пингует активные сервера параллельно, не больше concurrency за раз.
+    Сервера с queryPort сначала опрашиваются пакетным Query (полный список игроков).
+    Оба прохода укладываются в общие deadline секунд: время Query
+    вычитается из ожидания пинга. Не ответившие вовремя считаются недоступными
+    """
+    deadline_at = time.monotonic() + deadline
+    targets = [
+        server for server in servers
+        if server.get('isActive', False) and server.get('id') and server.get('address')
+    ]
+    
+    updated_stats: Dict[str, Dict[str, Any]] = {}
+    if not targets:
+        return updated_stats
+    
+    try:
+        prefetch_query(targets, timeout=min(QUERY_TIMEOUT, deadline / 2))
+    except Exception as e:
+        print(f"Query prefetch error: {str(e)}")
+    
+    executor = ThreadPoolExecutor(max_workers=max(1, min(len(targets), concurrency)))
+    futures = {
+        executor.submit(cached_ping, server['address'], server.get('port', 25565)): server
+        for server in targets
+    }
+    done, not_done = wait(futures, timeout=max(deadline_at - time.monotonic(), 0))
+    executor.shutdown(wait=False, cancel_futures=True)
+    
+    for future, server in futures.items():
+        if future in done:
+            result, cache_age, fetched_at = future.result()
+            updated_stats[server['id']] = _build_stats(server, result, 'Ошибка при проверке сервера',
+                                                       cache_age, fetched_at)
+        else:
+            updated_stats[server['id']] = _build_stats(server, None, 'Сервер не ответил вовремя')
+    
+    return updated_stats
+
+def load_active_servers(server_ids: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Список активных серверов из monitoring_servers (для вызова без тела, по таймеру).
+    С server_ids - только перечисленные: адреса из тела запроса не используются,
+    иначе любой посетитель мог бы записать статистику чужого адреса под реальным id
+    """
+    query = (
+        "SELECT id, address, port, version, max_players, query_port "
+        "FROM monitoring_servers WHERE is_active = true"
+    )
+    params: Tuple[Any, ...] = ()
+    if server_ids is not None:
+        query += " AND id = ANY(%s)"
+        params = ([str(server_id) for server_id in server_ids],)
+    
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+    
+    return [
+        {'id': row[0], 'address': row[1], 'port': row[2], 'version': row[3] or '',
+         'maxPlayers': row[4], 'queryPort': row[5], 'isActive': True}
+        for row in rows
+    ]
+
+def save_stats(updated_stats: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Пишет результаты пинга в server_stats одним INSERT ... ON CONFLICT.
+    Если иконку в этот раз получить не удалось, остаётся прежний хэш.
+    Строки, где ничего не поменялось (пинг - в пределах MONITOR_PING_CHANGE_MS),
+    перезаписываются не чаще раза в MONITOR_STATS_HEARTBEAT секунд - только
+    ради last_update, поэтому он отстаёт от последней проверки не больше
+    чем на этот интервал. В историю замер пишется всегда. Возвращает число
+    изменённых строк server_stats
+    """
+    if not updated_stats:
+        return 0
+    
+    rows = [
+        (str(uuid.uuid4()), stats['serverId'], stats['onlinePlayers'], stats['maxPlayers'],
+         stats['ping'], stats['isOnline'], (stats['version'] or '')[:50], stats['motd'],
+         json.dumps(stats['playerList'], ensure_ascii=False), stats.get('faviconHash'))
+        for stats in updated_stats.values()
+    ]
+    
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            # JOIN отсекает сервера, удалённые из monitoring_servers, пока шла проверка
+            execute_values(cur, f"""
+                INSERT INTO server_stats 
+                (id, server_id, online_players, max_players, ping, is_online, version, motd, player_list, favicon_hash, last_update) 
+                SELECT v.id, v.server_id, v.online_players, v.max_players, v.ping, v.is_online, 
+                       v.version, v.motd, v.player_list, v.favicon_hash, CURRENT_TIMESTAMP 
+                FROM (VALUES %s) AS v(id, server_id, online_players, max_players, ping, is_online, version, motd, player_list, favicon_hash) 
+                JOIN monitoring_servers m ON m.id = v.server_id 
+                ON CONFLICT (server_id) DO UPDATE SET 
+                    online_players = EXCLUDED.online_players, 
+                    max_players = EXCLUDED.max_players, 
+                    ping = EXCLUDED.ping, 
+                    is_online = EXCLUDED.is_online, 
+                    version = EXCLUDED.version, 
+                    motd = EXCLUDED.motd, 
+                    player_list = EXCLUDED.player_list, 
+                    favicon_hash = COALESCE(EXCLUDED.favicon_hash, server_stats.favicon_hash), 
+                    last_update = EXCLUDED.last_update 
+                WHERE (server_stats.online_players, server_stats.max_players, server_stats.is_online, 
+                       server_stats.version, server_stats.motd, server_stats.player_list, server_stats.favicon_hash) 
+                      IS DISTINCT FROM 
+                      (EXCLUDED.online_players, EXCLUDED.max_players, EXCLUDED.is_online, 
+                       EXCLUDED.version, EXCLUDED.motd, EXCLUDED.player_list, 
+                       COALESCE(EXCLUDED.favicon_hash, server_stats.favicon_hash)) 
+                   OR abs(server_stats.ping - EXCLUDED.ping) > {MONITOR_PING_CHANGE_MS} 
+                   OR server_stats.last_update < EXCLUDED.last_update - INTERVAL '{MONITOR_STATS_HEARTBEAT} seconds'
+            """, rows,
+                template='(%s, %s, %s::int, %s::int, %s::int, %s::boolean, %s, %s, %s, %s)', page_size=len(rows))
+            written = cur.rowcount
+            stored_favicons = save_favicons(cur, updated_stats)
+            update_presence(cur, updated_stats)
+            record_history(cur, updated_stats)
+        conn.commit()
+    mark_favicons_stored(stored_favicons)
+    
+    return written
+
+def update_presence(cur: Any, updated_stats: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Обновляет player_presence по разнице с прошлым списком онлайна:
+    новые игроки помечаются online, пропавшие - offline с last_seen_at.
+    Неполный список (выборка SLP до 12 ников) только добавляет игроков,
+    потому что по нему нельзя понять, кто вышел
+    """
+    if not updated_stats:
+        return
+    
+    cur.execute(
+        "SELECT server_id, player_key FROM player_presence WHERE online AND server_id = ANY(%s)",
+        (list(updated_stats),)
+    )
+    previous: Dict[str, set] = {}
+    for server_id, player_key in cur.fetchall():
+        previous.setdefault(server_id, set()).add(player_key)
+    
+    joined = []
+    left = []
+    for server_id, stats in updated_stats.items():
+        players = {name.lower(): name for name in stats['playerList'] if name}
+        online_before = previous.get(server_id, set())
+        joined.extend(
+            (player_key, server_id, name[:64]) for player_key, name in players.items()
+            if player_key not in online_before
+        )
+        if not stats['isOnline'] or len(players) >= stats['onlinePlayers']:
+            left.extend((server_id, player_key) for player_key in online_before - players.keys())
+    
+    if joined:
+        execute_values(cur, """
+            INSERT INTO player_presence (player_key, server_id, player_name, online, joined_at, last_seen_at) 
+            SELECT v.player_key, v.server_id, v.player_name, true, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP 
+            FROM (VALUES %s) AS v(player_key, server_id, player_name) 
+            JOIN monitoring_servers m ON m.id = v.server_id 
+            ON CONFLICT (player_key, server_id) DO UPDATE SET 
+                player_name = EXCLUDED.player_name, 
+                online = true, 
+                joined_at = EXCLUDED.joined_at, 
+                last_seen_at = EXCLUDED.last_seen_at
+        """, joined, page_size=len(joined))
+    
+    if left:
+        execute_values(cur, """
+            UPDATE player_presence AS p 
+            SET online = false, last_seen_at = CURRENT_TIMESTAMP 
+            FROM (VALUES %s) AS v(server_id, player_key) 
+            WHERE p.server_id = v.server_id AND p.player_key = v.player_key
+        """, left, page_size=len(left))
+
+_ROLLUP_UPSERT = """
+    INSERT INTO {table} AS r 
+    (server_id, bucket, samples, online_samples, min_players, max_players, sum_players, sum_ping) 
+    SELECT server_id, date_trunc('{unit}', sampled_at), 1, is_online::int, 
+           online_players, online_players, online_players, ping 
+    FROM inserted 
+    ON CONFLICT (server_id, bucket) DO UPDATE SET 
+        samples = r.samples + 1, 
+        online_samples = r.online_samples + EXCLUDED.online_samples, 
+        min_players = LEAST(r.min_players, EXCLUDED.min_players), 
+        max_players = GREATEST(r.max_players, EXCLUDED.max_players), 
+        sum_players = r.sum_players + EXCLUDED.sum_players, 
+        sum_ping = r.sum_ping + EXCLUDED.sum_ping
+"""
+
+_last_history_cleanup = {'at': 0.0}
+
+def record_history(cur: Any, updated_stats: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Добавляет поминутный замер в server_stats_samples и в том же запросе
+    пополняет часовые и дневные агрегаты. Повторный замер в ту же минуту
+    отбрасывается ON CONFLICT и в агрегаты не попадает
+    """
+    if not updated_stats:
+        return
+    
+    rows = [
+        (stats['serverId'], stats['onlinePlayers'], stats['ping'] if stats['isOnline'] else 0, stats['isOnline'])
+        for stats in updated_stats.values()
+    ]
+    
+    execute_values(cur, f"""
+        WITH inserted AS (
+            INSERT INTO server_stats_samples (server_id, sampled_at, online_players, ping, is_online) 
+            SELECT v.server_id, date_trunc('minute', CURRENT_TIMESTAMP), v.online_players, v.ping, v.is_online 
+            FROM (VALUES %s) AS v(server_id, online_players, ping, is_online) 
+            JOIN monitoring_servers m ON m.id = v.server_id 
+            ON CONFLICT (server_id, sampled_at) DO NOTHING 
+            RETURNING server_id, sampled_at, online_players, ping, is_online
+        ), hourly AS (
+            {_ROLLUP_UPSERT.format(table='server_stats_hourly', unit='hour')}
+        )
+        {_ROLLUP_UPSERT.format(table='server_stats_daily', unit='day')}
+    """, rows, template='(%s, %s::int, %s::int, %s::boolean)', page_size=len(rows))
+    
+    now = time.monotonic()
+    if now - _last_history_cleanup['at'] >= HISTORY_CLEANUP_INTERVAL:
+        _last_history_cleanup['at'] = now
+        for table, column, days in (
+            ('server_stats_samples', 'sampled_at', HISTORY_RAW_RETENTION_DAYS),
+            ('server_stats_hourly', 'bucket', HISTORY_HOURLY_RETENTION_DAYS),
+            ('server_stats_daily', 'bucket', HISTORY_DAILY_RETENTION_DAYS)
+        ):
+            cur.execute(
+                f"DELETE FROM {table} WHERE {column} < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'",
+                (days,)
+            )
+        cur.execute(
+            "DELETE FROM player_presence WHERE NOT online AND last_seen_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'",
+            (PRESENCE_RETENTION_DAYS,)
+        )
+
+def next_check_interval(stats: Dict[str, Any], failures: int, last_online: Optional[int],
+                        interval: Optional[int]) -> Tuple[int, int]:
+    """
+    Интервал до следующей проверки и новый счётчик неудач подряд.
+    Недоступный сервер - экспоненциальная задержка; активно меняющийся
+    онлайн - проверяем чаще; стабильный - постепенно реже
+    """
+    if not stats['isOnline']:
+        failures += 1
+        seconds = min(SCHEDULE_BASE_INTERVAL * 2 ** failures, SCHEDULE_OFFLINE_MAX_INTERVAL)
+    else:
+        failures = 0
+        delta = abs(stats['onlinePlayers'] - last_online) if last_online is not None else 0
+        if delta >= SCHEDULE_ACTIVITY_DELTA:
+            seconds = SCHEDULE_MIN_INTERVAL
+        elif delta == 0 and interval:
+            seconds = min(max(int(interval * 1.5), SCHEDULE_BASE_INTERVAL), SCHEDULE_IDLE_MAX_INTERVAL)
+        else:
+            seconds = SCHEDULE_BASE_INTERVAL
+    
+    # Разброс, чтобы проверки не собирались в один запуск
+    seconds = int(seconds * random.uniform(1 - SCHEDULE_JITTER, 1 + SCHEDULE_JITTER))
+    return max(seconds, 1), failures
+
+def run_scheduled_checks() -> Dict[str, Any]:
+    """
+    Пингует только те сервера, чьё время проверки наступило, и
+    назначает каждому время следующей проверки. Сервера забираются через
+    FOR UPDATE SKIP LOCKED со сдвигом next_check_at на SCHEDULE_CLAIM_TIMEOUT,
+    поэтому параллельный запуск их не пингует и историю не дублирует;
+    если запуск упал, сервер вернётся в очередь по истечении этого срока
+    """
+    with db_pool.connection() as conn:
+        with conn.cursor() as cur:
+            # Новым серверам - строка расписания, чтобы их можно было заблокировать
+            cur.execute("""
+                INSERT INTO monitor_schedule (server_id, next_check_at) 
+                SELECT m.id, '-infinity'::timestamp FROM monitoring_servers m 
+                WHERE m.is_active = true 
+                  AND NOT EXISTS (SELECT 1 FROM monitor_schedule s WHERE s.server_id = m.id) 
+                ON CONFLICT (server_id) DO NOTHING
+            """)
+            cur.execute("""
+                WITH due AS (
+                    SELECT s.server_id FROM monitor_schedule s 
+                    JOIN monitoring_servers m ON m.id = s.server_id 
+                    WHERE m.is_active = true AND s.next_check_at <= CURRENT_TIMESTAMP 
+                    ORDER BY s.next_check_at 
+                    LIMIT %s 
+                    FOR UPDATE OF s SKIP LOCKED
+                ), claimed AS (
+                    UPDATE monitor_schedule s 
+                    SET next_check_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second' 
+                    FROM due WHERE s.server_id = due.server_id 
+                    RETURNING s.server_id, s.consecutive_failures, s.last_online_players, s.interval_seconds
+                )
+                SELECT m.id, m.address, m.port, m.version, m.max_players, 
+                       c.consecutive_failures, c.last_online_players, c.interval_seconds, m.query_port 
+                FROM claimed c 
+                JOIN monitoring_servers m ON m.id = c.server_id
+            """, (SCHEDULE_BATCH, SCHEDULE_CLAIM_TIMEOUT))
+            due = cur.fetchall()
+        conn.commit()
+    
+    servers = [
+        {'id': row[0], 'address': row[1], 'port': row[2], 'version': row[3] or '',
+         'maxPlayers': row[4], 'queryPort': row[8], 'isActive': True}
+        for row in due
+    ]
+    updated_stats = ping_servers(servers)
+    saved_servers = save_stats(updated_stats)
+    
+    schedule = []
+    for server_id, _, _, _, _, failures, last_online, interval, _ in due:
+        stats = updated_stats.get(server_id)
+        if not stats:
+            continue
+        seconds, failures = next_check_interval(stats, failures or 0, last_online, interval)
+        schedule.append((server_id, seconds, failures, stats['onlinePlayers']))
+    
+    if schedule:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO monitor_schedule 
+                    (server_id, next_check_at, interval_seconds, consecutive_failures, last_online_players, last_checked_at) 
+                    SELECT v.server_id, CURRENT_TIMESTAMP + v.interval_seconds * INTERVAL '1 second', 
+                           v.interval_seconds, v.consecutive_failures, v.last_online_players, CURRENT_TIMESTAMP 
+                    FROM (VALUES %s) AS v(server_id, interval_seconds, consecutive_failures, last_online_players) 
+                    ON CONFLICT (server_id) DO UPDATE SET 
+                        next_check_at = EXCLUDED.next_check_at, 
+                        interval_seconds = EXCLUDED.interval_seconds, 
+                        consecutive_failures = EXCLUDED.consecutive_failures, 
+                        last_online_players = EXCLUDED.last_online_players, 
+                        last_checked_at = EXCLUDED.last_checked_at
+                """, schedule, template='(%s, %s::int, %s::int, %s::int)', page_size=len(schedule))
+            conn.commit()
+    
+    return {
+        'success': True,
+        'stats': updated_stats,
+        'checkedServers': len(updated_stats),
+        'savedServers': saved_servers
+    }
+
+@db_pool.report_stats
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Обновляет статистику всех серверов из мониторинга
@@ -129,51 +1155,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     if method == 'POST':
         try:
-            body_data = json.loads(event.get('body', '{}'))
+            body_data = json.loads(event.get('body') or '{}')
             servers: List[Dict[str, Any]] = body_data.get('servers', [])
             
-            updated_stats: Dict[str, Dict[str, Any]] = {}
+            if body_data.get('action') == 'scheduled' and DSN:
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json',
+                        'Access-Control-Allow-Origin': '*'
+                    },
+                    'isBase64Encoded': False,
+                    'body': json.dumps(run_scheduled_checks())
+                }
             
-            for server in servers:
-                if not server.get('isActive', False):
-                    continue
-                
-                server_id = server.get('id')
-                address = server.get('address')
-                port = server.get('port', 25565)
-                max_players = server.get('maxPlayers', 100)
-                
-                if not server_id or not address:
-                    continue
-                
-                stats = ping_minecraft_server(address, port)
-                
-                if stats:
-                    updated_stats[server_id] = {
-                        'id': f'stats_{server_id}',
-                        'serverId': server_id,
-                        'onlinePlayers': stats['onlinePlayers'],
-                        'maxPlayers': stats['maxPlayers'] if stats['maxPlayers'] > 0 else max_players,
-                        'ping': stats['ping'],
-                        'isOnline': stats['isOnline'],
-                        'version': stats['version'] or server.get('version', ''),
-                        'motd': stats['motd'],
-                        'playerList': stats['playerList'],
-                        'lastUpdate': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
-                    }
-                else:
-                    updated_stats[server_id] = {
-                        'id': f'stats_{server_id}',
-                        'serverId': server_id,
-                        'onlinePlayers': 0,
-                        'maxPlayers': max_players,
-                        'ping': 0,
-                        'isOnline': False,
-                        'version': server.get('version', ''),
-                        'motd': 'Ошибка при проверке сервера',
-                        'playerList': [],
-                        'lastUpdate': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
-                    }
+            if DSN:
+                requested_ids = [server.get('id') for server in servers if isinstance(server, dict) and server.get('id') is not None]
+                servers = load_active_servers(requested_ids if servers else None)
+            
+            updated_stats = ping_servers(servers)
+            
+            saved_servers = 0
+            if DSN:
+                try:
+                    saved_servers = save_stats(updated_stats)
+                except Exception as e:
+                    print(f"Server stats save error: {str(e)}")
             
             return {
                 'statusCode': 200,
@@ -185,7 +1192,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({
                     'success': True,
                     'stats': updated_stats,
-                    'checkedServers': len(updated_stats)
+                    'checkedServers': len(updated_stats),
+                    'savedServers': saved_servers
                 })
             }
             
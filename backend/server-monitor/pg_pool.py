@@ -0,0 +1 @@
+../shared/pg_pool.py
\ No newline at end of file
@@ -0,0 +1,173 @@
+"""
+Идемпотентность POST-запросов по заголовку Idempotency-Key, общая для
+функций с оплатой. Лежит рядом с pg_pool.py и так же подключается в
+каталог функции симлинком idempotency.py
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from pg_pool import ConnectionPool
+
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '20'))
+IDEMPOTENCY_POLL_INTERVAL = float(os.environ.get('IDEMPOTENCY_POLL_INTERVAL', '0.25'))
+IDEMPOTENCY_STALE_AFTER = int(os.environ.get('IDEMPOTENCY_STALE_AFTER', '120'))
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+
+
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    headers = event.get('headers') or {}
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+_last_idempotency_cleanup = {'at': 0.0}
+
+
+def run_idempotent(pool: ConnectionPool, event: Dict[str, Any], scope: str, key: Optional[str],
+                   handle: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Выполняет handle не больше одного раза на ключ. Повтор с тем же ключом
+    получает сохранённый ответ (один поиск по первичному ключу); если первый
+    запрос ещё выполняется, повтор ждёт его результата до IDEMPOTENCY_WAIT
+    секунд. Сохраняется любой ответ, кроме помеченных _releaseKey: с ними
+    ключ освобождается, и повтор выполнит запрос заново
+    """
+    if not key:
+        response = handle(event)
+        response.pop('_releaseKey', None)
+        return response
+    
+    key = str(key)[:255]
+    request_hash = hashlib.sha256((event.get('body') or '').encode('utf-8')).hexdigest()
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    
+    while True:
+        with pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT request_hash, status, status_code, response, 
+                           created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second' 
+                    FROM t_p79689265_minecraft_donation_s.idempotency_keys 
+                    WHERE scope = %s AND idempotency_key = %s
+                """, (IDEMPOTENCY_STALE_AFTER, scope, key))
+                row = cur.fetchone()
+                
+                if row is None:
+                    cur.execute("""
+                        INSERT INTO t_p79689265_minecraft_donation_s.idempotency_keys 
+                        (scope, idempotency_key, request_hash) VALUES (%s, %s, %s) 
+                        ON CONFLICT (scope, idempotency_key) DO NOTHING 
+                        RETURNING idempotency_key
+                    """, (scope, key, request_hash))
+                    owner = cur.fetchone() is not None
+                elif row[1] == 'processing' and row[4] and row[0] == request_hash:
+                    # Первый запрос упал, не дописав результат - берём ключ себе
+                    cur.execute("""
+                        UPDATE t_p79689265_minecraft_donation_s.idempotency_keys 
+                        SET created_at = CURRENT_TIMESTAMP 
+                        WHERE scope = %s AND idempotency_key = %s AND status = 'processing' 
+                          AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second' 
+                        RETURNING idempotency_key
+                    """, (scope, key, IDEMPOTENCY_STALE_AFTER))
+                    owner = cur.fetchone() is not None
+                else:
+                    owner = False
+                
+                cleanup_idempotency_keys(cur)
+            conn.commit()
+        
+        if owner:
+            break
+        
+        if row is not None and row[0] != request_hash:
+            return {
+                'statusCode': 422,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': False, 'error': 'Idempotency-Key уже использован для другого запроса'})
+            }
+        
+        if row is not None and row[1] == 'completed':
+            return {
+                'statusCode': row[2],
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*',
+                    'Idempotent-Replayed': 'true'
+                },
+                'body': row[3]
+            }
+        
+        if time.monotonic() >= deadline:
+            return {
+                'statusCode': 409,
+                'headers': {
+                    'Content-Type': 'application/json',
+                    'Access-Control-Allow-Origin': '*'
+                },
+                'body': json.dumps({'success': False, 'error': 'Запрос с этим ключом ещё выполняется'})
+            }
+        time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+    
+    response = None
+    release = False
+    try:
+        response = handle(event)
+        release = response.pop('_releaseKey', False)
+    finally:
+        try:
+            finish_idempotency_key(pool, scope, key, response, release)
+        except Exception as e:
+            print(f"Idempotency key save error: {str(e)}")
+    
+    return response
+
+
+def finish_idempotency_key(pool: ConnectionPool, scope: str, key: str,
+                           response: Optional[Dict[str, Any]], release: bool) -> None:
+    """
+    Сохраняет ответ под ключом, в том числе 5xx: обработчик мог успеть
+    изменить состояние до ошибки, и повтор сделал бы это второй раз. Ключ
+    освобождается, только если обработчик сам пометил ответ _releaseKey -
+    повтор безопасен. Если обработчик упал, ключ остаётся в processing
+    до IDEMPOTENCY_STALE_AFTER
+    """
+    if response is None:
+        return
+    
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            if not release:
+                cur.execute("""
+                    UPDATE t_p79689265_minecraft_donation_s.idempotency_keys 
+                    SET status = 'completed', status_code = %s, response = %s, completed_at = CURRENT_TIMESTAMP 
+                    WHERE scope = %s AND idempotency_key = %s
+                """, (response['statusCode'], response['body'], scope, key))
+            else:
+                cur.execute("""
+                    DELETE FROM t_p79689265_minecraft_donation_s.idempotency_keys 
+                    WHERE scope = %s AND idempotency_key = %s AND status = 'processing'
+                """, (scope, key))
+        conn.commit()
+
+
+def cleanup_idempotency_keys(cur: Any) -> None:
+    """
+    Раз в час удаляет ключи старше IDEMPOTENCY_TTL_HOURS
+    """
+    now = time.monotonic()
+    if now - _last_idempotency_cleanup['at'] < 3600:
+        return
+    _last_idempotency_cleanup['at'] = now
+    cur.execute("""
+        DELETE FROM t_p79689265_minecraft_donation_s.idempotency_keys 
+        WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+    """, (IDEMPOTENCY_TTL_HOURS,))
@@ -0,0 +1,177 @@
+"""
+Пул соединений Postgres, общий для всех функций. Каждая функция
+деплоится отдельно, поэтому в её каталоге лежит симлинк pg_pool.py
+на этот файл - правка здесь расходится во все функции сразу
+"""
+import functools
+import json
+import os
+import threading
+import time
+import psycopg2
+from psycopg2 import extensions
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_MAX_AGE = float(os.environ.get('DB_POOL_MAX_AGE', '1800'))
+DB_POOL_CHECK_IDLE = float(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    '''
+    Пул соединений Postgres, живущий между тёплыми вызовами функции.
+    Ограничен по размеру, проверяет соединения при выдаче и пересоздаёт
+    слишком старые; счётчики ожидания доступны через stats()
+    '''
+
+    def __init__(self, dsn: Optional[str], max_size: int = DB_POOL_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT, max_age: float = DB_POOL_MAX_AGE,
+                 check_idle: float = DB_POOL_CHECK_IDLE):
+        self.dsn = dsn
+        self.max_size = max(1, max_size)
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_idle = check_idle
+        self._idle: List[Tuple[Any, float]] = []
+        self._born: Dict[int, float] = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._metrics: Dict[str, float] = {
+            'checkouts': 0, 'waits': 0, 'waitMsTotal': 0.0, 'waitMsMax': 0.0,
+            'created': 0, 'recycled': 0, 'broken': 0, 'timeouts': 0
+        }
+
+    def getconn(self) -> Any:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn, returned_at = None, 0.0
+        
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(f'Нет свободных соединений с БД за {self.timeout} с')
+                self._cond.wait(remaining)
+            
+            waited_ms = (time.monotonic() - started) * 1000
+            self._metrics['checkouts'] += 1
+            if waited_ms >= 1:
+                self._metrics['waits'] += 1
+                self._metrics['waitMsTotal'] += waited_ms
+                self._metrics['waitMsMax'] = max(self._metrics['waitMsMax'], waited_ms)
+        
+        if waited_ms >= 50:
+            print(f"DB pool wait: {waited_ms:.0f} ms (size={self.max_size})")
+        
+        if conn is not None and not self._is_usable(conn, returned_at):
+            self._close(conn)
+            conn = None
+        
+        if conn is None:
+            try:
+                conn = psycopg2.connect(self.dsn)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            self._born[id(conn)] = time.monotonic()
+            self._bump('created')
+        
+        return conn
+
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        if not discard and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                discard = True
+        
+        if discard or conn.closed:
+            self._close(conn)
+            with self._cond:
+                self._metrics['broken'] += 1
+                self._size -= 1
+                self._cond.notify()
+            return
+        
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return dict(self._metrics, size=self._size, idle=len(self._idle), maxSize=self.max_size)
+
+    def report_stats(self, handler: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+        '''
+        Декоратор обработчика функции: после каждого вызова пишет в лог
+        одну строку со stats() - ожидание пула и размер видны по логам
+        '''
+        @functools.wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            try:
+                return handler(event, context)
+            finally:
+                print(f"DB pool stats: {json.dumps(self.stats())}")
+        return wrapper
+
+    def _is_usable(self, conn: Any, returned_at: float) -> bool:
+        if conn.closed:
+            self._bump('broken')
+            return False
+        
+        now = time.monotonic()
+        if now - self._born.get(id(conn), now) > self.max_age:
+            self._bump('recycled')
+            return False
+        
+        if now - returned_at > self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+                conn.rollback()
+            except Exception:
+                self._bump('broken')
+                return False
+        
+        return True
+
+    def _bump(self, name: str) -> None:
+        with self._cond:
+            self._metrics[name] += 1
+
+    def _close(self, conn: Any) -> None:
+        self._born.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
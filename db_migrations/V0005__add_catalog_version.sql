@@ -0,0 +1,11 @@
+-- Версия каталога товаров: увеличивается при каждом изменении products,
+-- по ней тёплые контейнеры понимают, что кэш каталога устарел
+CREATE TABLE IF NOT EXISTS t_p79689265_minecraft_donation_s.catalog_version (
+    id VARCHAR(255) PRIMARY KEY DEFAULT 'default',
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p79689265_minecraft_donation_s.catalog_version (id, version)
+VALUES ('default', 1)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,13 @@
+-- Статус выдачи покупки на каждом сервере из products.delivery_servers
+CREATE TABLE IF NOT EXISTS t_p79689265_minecraft_donation_s.purchase_deliveries (
+    purchase_id VARCHAR(255) NOT NULL REFERENCES t_p79689265_minecraft_donation_s.purchases(id),
+    server_id VARCHAR(255) NOT NULL,
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',
+    response TEXT,
+    error_message TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    delivered_at TIMESTAMP,
+    PRIMARY KEY (purchase_id, server_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_purchase_deliveries_status ON t_p79689265_minecraft_donation_s.purchase_deliveries(status);
@@ -0,0 +1,7 @@
+-- Очередь выдачи покупок: воркер забирает pending-строки через FOR UPDATE SKIP LOCKED
+ALTER TABLE t_p79689265_minecraft_donation_s.purchases ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP;
+ALTER TABLE t_p79689265_minecraft_donation_s.purchases ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_purchases_queue 
+ON t_p79689265_minecraft_donation_s.purchases(created_at) 
+WHERE status IN ('pending', 'processing');
@@ -0,0 +1,17 @@
+-- Исходящие уведомления вебхука: пишутся в одной транзакции со сменой
+-- статуса покупки, отправляются диспетчером с повторами
+CREATE TABLE IF NOT EXISTS t_p79689265_minecraft_donation_s.webhook_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    event VARCHAR(100) NOT NULL,
+    payload JSONB NOT NULL,
+    status VARCHAR(50) NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_webhook_outbox_due 
+ON t_p79689265_minecraft_donation_s.webhook_outbox(next_attempt_at) 
+WHERE status = 'pending';
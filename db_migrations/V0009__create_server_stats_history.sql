@@ -0,0 +1,39 @@
+-- История онлайна серверов: сырые поминутные замеры
+CREATE TABLE IF NOT EXISTS server_stats_samples (
+    server_id VARCHAR(36) NOT NULL,
+    sampled_at TIMESTAMP NOT NULL,
+    online_players INTEGER NOT NULL DEFAULT 0,
+    ping INTEGER NOT NULL DEFAULT 0,
+    is_online BOOLEAN NOT NULL DEFAULT false,
+    PRIMARY KEY (server_id, sampled_at)
+);
+
+-- Часовые и дневные агрегаты, пополняются инкрементально при каждом замере
+CREATE TABLE IF NOT EXISTS server_stats_hourly (
+    server_id VARCHAR(36) NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    online_samples INTEGER NOT NULL DEFAULT 0,
+    min_players INTEGER NOT NULL DEFAULT 0,
+    max_players INTEGER NOT NULL DEFAULT 0,
+    sum_players BIGINT NOT NULL DEFAULT 0,
+    sum_ping BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (server_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS server_stats_daily (
+    server_id VARCHAR(36) NOT NULL,
+    bucket TIMESTAMP NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    online_samples INTEGER NOT NULL DEFAULT 0,
+    min_players INTEGER NOT NULL DEFAULT 0,
+    max_players INTEGER NOT NULL DEFAULT 0,
+    sum_players BIGINT NOT NULL DEFAULT 0,
+    sum_ping BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (server_id, bucket)
+);
+
+-- Индексы для удаления устаревших данных по сроку хранения
+CREATE INDEX IF NOT EXISTS idx_server_stats_samples_sampled_at ON server_stats_samples(sampled_at);
+CREATE INDEX IF NOT EXISTS idx_server_stats_hourly_bucket ON server_stats_hourly(bucket);
+CREATE INDEX IF NOT EXISTS idx_server_stats_daily_bucket ON server_stats_daily(bucket);
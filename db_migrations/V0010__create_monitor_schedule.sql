@@ -0,0 +1,12 @@
+-- Расписание пинга серверов мониторинга: у каждого сервера своё время
+-- следующей проверки, интервал и счётчик неудачных проверок подряд
+CREATE TABLE IF NOT EXISTS monitor_schedule (
+    server_id VARCHAR(36) PRIMARY KEY,
+    next_check_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    interval_seconds INTEGER NOT NULL DEFAULT 60,
+    consecutive_failures INTEGER NOT NULL DEFAULT 0,
+    last_online_players INTEGER,
+    last_checked_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_monitor_schedule_next_check ON monitor_schedule(next_check_at);
@@ -0,0 +1,10 @@
+-- Иконки серверов (favicon из Server List Ping), хранятся один раз по хэшу содержимого
+CREATE TABLE IF NOT EXISTS server_favicons (
+    hash VARCHAR(64) PRIMARY KEY,
+    content_type VARCHAR(50) NOT NULL DEFAULT 'image/png',
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- В статистике сервера - только ссылка на текущую иконку
+ALTER TABLE server_stats ADD COLUMN IF NOT EXISTS favicon_hash VARCHAR(64);
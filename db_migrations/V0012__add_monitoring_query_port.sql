@@ -0,0 +1,3 @@
+-- Порт Query (UDP, enable-query в server.properties). Если задан, мониторинг
+-- получает через него полный список игроков вместо выборки из 12 ников
+ALTER TABLE monitoring_servers ADD COLUMN IF NOT EXISTS query_port INTEGER;
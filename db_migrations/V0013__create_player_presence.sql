@@ -0,0 +1,14 @@
+-- Где сейчас играет игрок: строка на пару (игрок, сервер мониторинга).
+-- player_key - ник в нижнем регистре, поиск по нему идёт по первичному ключу
+CREATE TABLE IF NOT EXISTS player_presence (
+    player_key VARCHAR(64) NOT NULL,
+    server_id VARCHAR(36) NOT NULL,
+    player_name VARCHAR(64) NOT NULL,
+    online BOOLEAN NOT NULL DEFAULT true,
+    joined_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_seen_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (player_key, server_id)
+);
+
+-- Текущий онлайн сервера - для сравнения со свежим списком игроков
+CREATE INDEX IF NOT EXISTS idx_player_presence_online ON player_presence(server_id) WHERE online;
@@ -0,0 +1,13 @@
+-- Постраничная выдача покупок по ключу (created_at, id): created_at
+-- становится обязательным, чтобы сравнение кортежей не спотыкалось о NULL
+UPDATE t_p79689265_minecraft_donation_s.purchases SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE t_p79689265_minecraft_donation_s.purchases ALTER COLUMN created_at SET NOT NULL;
+
+-- Лента покупок игрока и общая лента, обе от новых к старым
+CREATE INDEX IF NOT EXISTS idx_purchases_player_created 
+    ON t_p79689265_minecraft_donation_s.purchases(player_nickname, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_purchases_created 
+    ON t_p79689265_minecraft_donation_s.purchases(created_at DESC, id DESC);
+
+-- Старый индекс по нику целиком покрывается новым составным
+DROP INDEX IF EXISTS t_p79689265_minecraft_donation_s.idx_purchases_player;
@@ -0,0 +1,16 @@
+-- Ключи идемпотентности (заголовок Idempotency-Key или paymentId):
+-- повтор запроса с тем же ключом получает сохранённый ответ, а не
+-- создаёт вторую покупку и не шлёт RCON-команду ещё раз
+CREATE TABLE IF NOT EXISTS t_p79689265_minecraft_donation_s.idempotency_keys (
+    scope VARCHAR(50) NOT NULL,
+    idempotency_key VARCHAR(255) NOT NULL,
+    request_hash VARCHAR(64) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'processing',
+    status_code INTEGER,
+    response TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    completed_at TIMESTAMP,
+    PRIMARY KEY (scope, idempotency_key)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON t_p79689265_minecraft_donation_s.idempotency_keys(created_at);
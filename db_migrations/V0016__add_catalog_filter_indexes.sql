@@ -0,0 +1,34 @@
+-- Постраничный каталог по ключу (popular, created_at, id): оба поля
+-- становятся обязательными, чтобы сравнение кортежей не спотыкалось о NULL
+UPDATE t_p79689265_minecraft_donation_s.products SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+UPDATE t_p79689265_minecraft_donation_s.products SET popular = FALSE WHERE popular IS NULL;
+ALTER TABLE t_p79689265_minecraft_donation_s.products ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE t_p79689265_minecraft_donation_s.products ALTER COLUMN popular SET NOT NULL;
+
+-- Витрина всегда смотрит только на товары в наличии. Порядок индекса
+-- совпадает с ORDER BY, так что страница - Index Scan с LIMIT без Sort
+CREATE INDEX IF NOT EXISTS idx_products_catalog 
+    ON t_p79689265_minecraft_donation_s.products(popular DESC, created_at DESC, id DESC) 
+    WHERE in_stock;
+CREATE INDEX IF NOT EXISTS idx_products_category_catalog 
+    ON t_p79689265_minecraft_donation_s.products(category, popular DESC, created_at DESC, id DESC) 
+    WHERE in_stock;
+
+-- Старый индекс по категории целиком покрывается новым составным
+DROP INDEX IF EXISTS t_p79689265_minecraft_donation_s.idx_products_category;
+
+-- Полнотекстовый поиск: название весомее описания
+ALTER TABLE t_p79689265_minecraft_donation_s.products 
+    ADD COLUMN IF NOT EXISTS search_vector tsvector 
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', COALESCE(name, '')), 'A') || 
+        setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+    ) STORED;
+CREATE INDEX IF NOT EXISTS idx_products_search 
+    ON t_p79689265_minecraft_donation_s.products USING GIN (search_vector);
+
+-- Поиск по части слова ("алм" -> "Алмазный меч") через триграммы: условие
+-- search_vector @@ ... OR name ILIKE ... даёт BitmapOr по обоим GIN-индексам
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm 
+    ON t_p79689265_minecraft_donation_s.products USING GIN (name gin_trgm_ops);
@@ -0,0 +1,22 @@
+-- Ник игрока без учёта регистра: "Steve" и "steve" - один игрок. Сам ник
+-- хранится как его ввёл игрок (без пробелов по краям), а сравнение и поиск
+-- идут по player_key - нику в нижнем регистре, как в player_presence
+UPDATE t_p79689265_minecraft_donation_s.purchases 
+SET player_nickname = btrim(player_nickname) 
+WHERE player_nickname <> btrim(player_nickname);
+
+ALTER TABLE t_p79689265_minecraft_donation_s.purchases 
+    ADD COLUMN IF NOT EXISTS player_key VARCHAR(100) 
+    GENERATED ALWAYS AS (lower(player_nickname)) STORED;
+
+-- Лента покупок игрока от новых к старым - вместо индекса по точному нику
+CREATE INDEX IF NOT EXISTS idx_purchases_player_key_created 
+    ON t_p79689265_minecraft_donation_s.purchases(player_key, created_at DESC, id DESC);
+DROP INDEX IF EXISTS t_p79689265_minecraft_donation_s.idx_purchases_player_created;
+
+-- Автодополнение по началу ника. Collation "C" делает LIKE 'ste%' диапазоном
+-- по индексу и даёт нужный порядок для GROUP BY без сортировки; ник в
+-- INCLUDE - подсказки читаются index-only scan, без обращения к таблице
+CREATE INDEX IF NOT EXISTS idx_purchases_player_key_prefix 
+    ON t_p79689265_minecraft_donation_s.purchases(player_key COLLATE "C") 
+    INCLUDE (player_nickname);
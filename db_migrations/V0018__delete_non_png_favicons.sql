@@ -0,0 +1,11 @@
+-- Иконки отдаются только как image/png: удаляем всё, что не PNG по
+-- заголовку или сигнатуре (например, SVG со скриптом)
+DELETE FROM server_favicons 
+WHERE content_type <> 'image/png' 
+   OR substring(data FROM 1 FOR 8) <> '\x89504e470d0a1a0a'::bytea;
+
+-- Ссылки на удалённые иконки сами не пропадут: при обновлении статистики
+-- прежний хэш сохраняется, если новый не получен
+UPDATE server_stats SET favicon_hash = NULL 
+WHERE favicon_hash IS NOT NULL 
+  AND favicon_hash NOT IN (SELECT hash FROM server_favicons);
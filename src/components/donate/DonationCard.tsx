@@ -32,10 +32,12 @@ const DonationCard = ({ item }: DonationCardProps) => {
   const [servers, setServers] = useState<RconServer[]>([]);
   const [isLoading, setIsLoading] = useState(false);
   const [isPurchasing, setIsPurchasing] = useState(false);
+  const [idempotency, setIdempotency] = useState({ body: "", key: "" });
 
   const handleOpenDialog = async () => {
     setIsOpen(true);
     setIsLoading(true);
+    setIdempotency({ body: "", key: "" });
     
     try {
       const response = await fetch(RCON_API_URL);
@@ -94,18 +96,25 @@ const DonationCard = ({ item }: DonationCardProps) => {
     
     setIsPurchasing(true);
     
+    const body = JSON.stringify({
+      action: 'purchase',
+      productId: item.id,
+      playerNickname: playerNickname.trim(),
+      serverId: selectedServer
+    });
+    // Ключ привязан к телу запроса: другой ник или сервер - новая покупка
+    const idempotencyKey = idempotency.body === body ? idempotency.key : crypto.randomUUID();
+    setIdempotency({ body, key: idempotencyKey });
+    let response: Response | undefined;
+    
     try {
-      const response = await fetch(PRODUCTS_API_URL, {
+      response = await fetch(PRODUCTS_API_URL, {
         method: 'POST',
         headers: {
-          'Content-Type': 'application/json'
+          'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey
         },
-        body: JSON.stringify({
-          action: 'purchase',
-          productId: item.id,
-          playerNickname: playerNickname.trim(),
-          serverId: selectedServer
-        })
+        body
       });
       
       const data = await response.json();
@@ -115,12 +124,24 @@ const DonationCard = ({ item }: DonationCardProps) => {
           title: "Успешная покупка!",
           description: data.message || `Товар "${item.name}" успешно доставлен!`
         });
+        if (data.warning) {
+          toast({
+            title: "Обратите внимание",
+            description: data.warning
+          });
+        }
         setIsOpen(false);
         setPlayerNickname("");
+        setIdempotency({ body: "", key: "" });
       } else {
         throw new Error(data.error || "Ошибка покупки");
       }
     } catch (error) {
+      // Ответ с ошибкой сохранён под ключом, повтор с ним вернул бы ту же
+      // ошибку. Без ответа (сбой сети) ключ остаётся: покупка могла пройти
+      if (response) {
+        setIdempotency({ body: "", key: "" });
+      }
       toast({
         variant: "destructive",
         title: "Ошибка покупки",
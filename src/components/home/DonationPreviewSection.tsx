@@ -18,14 +18,11 @@ const DonationPreviewSection = () => {
   
   const loadProducts = async () => {
     try {
-      const response = await fetch(PRODUCTS_API_URL);
+      const response = await fetch(`${PRODUCTS_API_URL}?limit=3`);
       const data = await response.json();
       
       if (data.success && data.products) {
-        const featured = data.products
-          .filter((p: DonateItem) => p.popular || p.inStock)
-          .slice(0, 3);
-        setItems(featured);
+        setItems(data.products);
       }
     } catch (error) {
       console.error("Ошибка загрузки товаров:", error);
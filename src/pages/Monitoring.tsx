@@ -84,13 +84,7 @@ const Monitoring = () => {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          servers: serversToCheck.map(s => ({
-            id: s.id,
-            name: s.name,
-            address: s.address,
-            port: s.port,
-            maxPlayers: s.maxPlayers
-          }))
+          servers: serversToCheck.map(s => ({ id: s.id }))
         })
       });
 
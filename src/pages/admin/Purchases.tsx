@@ -9,6 +9,7 @@ import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from "@
 import { Badge } from "@/components/ui/badge";
 import Icon from "@/components/ui/icon";
 import { Input } from "@/components/ui/input";
+import { Button } from "@/components/ui/button";
 
 const PRODUCTS_API_URL = "https://functions.poehali.dev/6574f144-b26c-46e4-a4eb-76db7d5dca00";
 
@@ -24,29 +25,55 @@ interface Purchase {
   deliveredAt?: string;
 }
 
+interface PlayerSuggestion {
+  playerKey: string;
+  playerNickname: string;
+  purchases: number;
+}
+
 const AdminPurchases = () => {
   const navigate = useNavigate();
   const [user, setUser] = useState<AdminUser | null>(null);
   const [purchases, setPurchases] = useState<Purchase[]>([]);
   const [isLoading, setIsLoading] = useState(true);
   const [searchQuery, setSearchQuery] = useState("");
+  const [playerFilter, setPlayerFilter] = useState("");
+  const [playerSuggestions, setPlayerSuggestions] = useState<PlayerSuggestion[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
 
   useEffect(() => {
     const userData = getCurrentUser();
     if (userData) {
       setUser(userData);
     }
-    
-    loadPurchases();
   }, []);
 
-  const loadPurchases = async () => {
+  useEffect(() => {
+    const player = playerFilter.trim();
+    const timer = setTimeout(() => {
+      loadPurchases(undefined, player);
+      loadPlayerSuggestions(player);
+    }, player ? 300 : 0);
+
+    return () => clearTimeout(timer);
+  }, [playerFilter]);
+
+  const loadPurchases = async (cursor?: string, player = playerFilter.trim()) => {
     try {
-      const response = await fetch(`${PRODUCTS_API_URL}?action=purchases`);
+      const params = new URLSearchParams({ action: 'purchases' });
+      if (cursor) {
+        params.set('cursor', cursor);
+      }
+      if (player) {
+        params.set('player', player);
+      }
+      const response = await fetch(`${PRODUCTS_API_URL}?${params.toString()}`);
       const data = await response.json();
       
       if (data.success && data.purchases) {
-        setPurchases(data.purchases);
+        setPurchases(prev => cursor ? [...prev, ...data.purchases] : data.purchases);
+        setNextCursor(data.nextCursor || null);
       }
     } catch (error) {
       console.error("Ошибка загрузки покупок:", error);
@@ -55,24 +82,52 @@ const AdminPurchases = () => {
     }
   };
 
+  const loadPlayerSuggestions = async (prefix: string) => {
+    if (prefix.length < 2) {
+      setPlayerSuggestions([]);
+      return;
+    }
+    try {
+      const params = new URLSearchParams({ action: 'players', prefix });
+      const response = await fetch(`${PRODUCTS_API_URL}?${params.toString()}`);
+      const data = await response.json();
+      
+      if (data.success && data.players) {
+        setPlayerSuggestions(data.players);
+      }
+    } catch (error) {
+      console.error("Ошибка загрузки подсказок:", error);
+    }
+  };
+
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    setIsLoadingMore(true);
+    await loadPurchases(nextCursor);
+    setIsLoadingMore(false);
+  };
+
   const handleLogout = () => {
     logoutUser();
     navigate("/admin/login");
   };
 
   const filteredPurchases = purchases.filter(p => 
-    p.playerNickname.toLowerCase().includes(searchQuery.toLowerCase()) ||
-    p.productName?.toLowerCase().includes(searchQuery.toLowerCase())
+    !searchQuery || p.productName?.toLowerCase().includes(searchQuery.toLowerCase())
   );
 
   const getStatusBadge = (status: string) => {
     switch (status) {
       case 'delivered':
         return <Badge className="bg-green-500">Доставлено</Badge>;
+      case 'partial':
+        return <Badge className="bg-yellow-500">Частично</Badge>;
       case 'pending':
         return <Badge variant="secondary">Ожидание</Badge>;
       case 'failed':
         return <Badge variant="destructive">Ошибка</Badge>;
+      case 'unknown':
+        return <Badge className="bg-orange-500">Проверить</Badge>;
       default:
         return <Badge variant="outline">{status}</Badge>;
     }
@@ -99,11 +154,28 @@ const AdminPurchases = () => {
             <CardHeader>
               <div className="flex items-center justify-between">
                 <CardTitle>Покупки ({filteredPurchases.length})</CardTitle>
-                <div className="w-full max-w-sm">
-                  <div className="relative">
+                <div className="flex w-full max-w-xl gap-2">
+                  <div className="relative flex-1">
+                    <Icon name="User" className="absolute left-3 top-1/2 transform -translate-y-1/2 w-4 h-4 text-muted-foreground" />
+                    <Input
+                      placeholder="Ник игрока..."
+                      value={playerFilter}
+                      onChange={(e) => setPlayerFilter(e.target.value)}
+                      list="player-suggestions"
+                      className="pl-10"
+                    />
+                    <datalist id="player-suggestions">
+                      {playerSuggestions.map(player => (
+                        <option key={player.playerKey} value={player.playerNickname}>
+                          {player.purchases} покупок
+                        </option>
+                      ))}
+                    </datalist>
+                  </div>
+                  <div className="relative flex-1">
                     <Icon name="Search" className="absolute left-3 top-1/2 transform -translate-y-1/2 w-4 h-4 text-muted-foreground" />
                     <Input
-                      placeholder="Поиск по нику или товару..."
+                      placeholder="Поиск по товару..."
                       value={searchQuery}
                       onChange={(e) => setSearchQuery(e.target.value)}
                       className="pl-10"
@@ -123,7 +195,7 @@ const AdminPurchases = () => {
                   <Icon name="ShoppingBag" className="w-12 h-12 mx-auto mb-4 text-muted-foreground opacity-50" />
                   <h3 className="text-lg font-semibold mb-2">Нет покупок</h3>
                   <p className="text-muted-foreground">
-                    {searchQuery ? 'Ничего не найдено по вашему запросу' : 'Покупки появятся здесь после первой транзакции'}
+                    {searchQuery || playerFilter ? 'Ничего не найдено по вашему запросу' : 'Покупки появятся здесь после первой транзакции'}
                   </p>
                 </div>
               ) : (
@@ -180,6 +252,14 @@ const AdminPurchases = () => {
                       ))}
                     </TableBody>
                   </Table>
+                  {nextCursor && (
+                    <div className="flex justify-center pt-4">
+                      <Button variant="outline" onClick={loadMore} disabled={isLoadingMore}>
+                        {isLoadingMore && <Icon name="Loader2" className="w-4 h-4 mr-2 animate-spin" />}
+                        Загрузить ещё
+                      </Button>
+                    </div>
+                  )}
                 </div>
               )}
             </CardContent>
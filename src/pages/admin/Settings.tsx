@@ -111,7 +111,7 @@ const AdminSettings = () => {
                   <pre className="bg-muted p-4 rounded-lg text-xs overflow-x-auto">
 {`{
   "event": "purchase_delivered",
-  "purchaseId": "purchase_1234567890",
+  "purchaseId": "0MHG095GR0000M00",
   "productName": "VIP Статус",
   "playerNickname": "Steve",
   "serverId": "survival",
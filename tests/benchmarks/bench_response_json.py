@@ -0,0 +1,126 @@
+"""
+Бенчмарк ответа каталога и ленты покупок целиком - запрос, передача строк,
+приведение типов psycopg2 и сериализация: прежний путь (словари в Python +
+json.dumps) против json_agg в Postgres (RESPONSE_JSON_MODE=sql).
+
+Нужна пустая тестовая база: схема и таблицы создаются внутри транзакции,
+которая в конце откатывается. На базе, где таблицы магазина уже есть,
+скрипт не запускается. Запуск из корня репозитория:
+
+    BENCH_DATABASE_URL=postgresql://... python tests/benchmarks/bench_response_json.py
+"""
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+from loader import load_function
+
+products = load_function('products')
+
+SCHEMA = 't_p79689265_minecraft_donation_s'
+SIZES = (1000, 10000, 100000)
+
+SCHEMA_SQL = f"""
+    CREATE SCHEMA IF NOT EXISTS {SCHEMA};
+    CREATE TABLE {SCHEMA}.products (
+        id VARCHAR(255) PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        price DECIMAL(10, 2) NOT NULL,
+        description TEXT,
+        image_url TEXT,
+        popular BOOLEAN DEFAULT FALSE,
+        discount INTEGER DEFAULT 0,
+        category VARCHAR(100) NOT NULL,
+        command_template TEXT NOT NULL,
+        delivery_servers TEXT[] DEFAULT '{{}}',
+        in_stock BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE {SCHEMA}.purchases (
+        id VARCHAR(255) PRIMARY KEY,
+        product_id VARCHAR(255) NOT NULL REFERENCES {SCHEMA}.products(id),
+        player_nickname VARCHAR(100) NOT NULL,
+        server_id VARCHAR(255) NOT NULL,
+        price_paid DECIMAL(10, 2) NOT NULL,
+        status VARCHAR(50) DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        delivered_at TIMESTAMP
+    );
+    CREATE INDEX ON {SCHEMA}.purchases(created_at DESC, id DESC);
+"""
+
+def fill_sql(rows: int) -> str:
+    return f"""
+    TRUNCATE {SCHEMA}.purchases, {SCHEMA}.products;
+    INSERT INTO {SCHEMA}.products 
+    (id, name, price, description, image_url, popular, discount, category, command_template, 
+     delivery_servers, created_at, updated_at)
+    SELECT 'p' || g, 'Товар ' || g, 100 + g % 900, 'Описание товара номер ' || g, 
+           'https://cdn.example/items/' || g || '.png', g % 10 = 0, g % 5 * 10, 'category' || g % 8, 
+           'lp user {{player}} parent add vip', ARRAY['survival', 'skyblock'], 
+           now() - g * INTERVAL '1 minute', now() - g * INTERVAL '30 second'
+    FROM generate_series(1, {rows}) AS g;
+    INSERT INTO {SCHEMA}.purchases 
+    (id, product_id, player_nickname, server_id, price_paid, status, created_at, delivered_at)
+    SELECT 'b' || g, 'p' || (1 + g % {rows}), 'Player' || g % 5000, 'survival', 100 + g % 900, 
+           'delivered', now() - g * INTERVAL '1 second', now() - g * INTERVAL '1 second' + INTERVAL '2 second'
+    FROM generate_series(1, {rows}) AS g;
+    ANALYZE {SCHEMA}.products;
+    ANALYZE {SCHEMA}.purchases;
+"""
+
+
+def measure(run, rounds):
+    body = run()
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), len(body.encode('utf-8')), json.loads(body)
+
+
+def main() -> None:
+    dsn = os.environ.get('BENCH_DATABASE_URL')
+    if not dsn:
+        sys.exit('BENCH_DATABASE_URL не задан: нужна пустая тестовая база Postgres')
+    
+    conn = psycopg2.connect(dsn)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT to_regclass(%s)", (f'{SCHEMA}.products',))
+        if cur.fetchone()[0] is not None:
+            sys.exit(f'В базе уже есть {SCHEMA}.products - запустите на пустой тестовой базе')
+        
+        cur.execute(SCHEMA_SQL)
+        print(f"{'rows':>7} {'path':<9} {'python, ms':>11} {'sql, ms':>9} {'body, KB':>9}")
+        
+        for rows in SIZES:
+            cur.execute(fill_sql(rows))
+            rounds = 3 if rows >= 100000 else 7
+            
+            paths = (
+                ('catalog', lambda: products.get_catalog_json(cur), lambda: products.get_catalog_json_sql(cur)),
+                ('purchases', lambda: products.get_purchases_json(cur, '', [], rows),
+                 lambda: products.get_purchases_json_sql(cur, '', [], rows)),
+            )
+            for name, python_path, sql_path in paths:
+                python_ms, python_size, python_doc = measure(python_path, rounds)
+                sql_ms, _, sql_doc = measure(sql_path, rounds)
+                key = 'products' if name == 'catalog' else 'purchases'
+                assert len(python_doc[key]) == len(sql_doc[key]) == rows
+                print(f'{rows:>7} {name:<9} {python_ms:>11.1f} {sql_ms:>9.1f} {python_size / 1024:>9.0f}')
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Микробенчмарк чтения ответа Server List Ping: прежнее чтение (VarInt по
+recv(1), тело через data += chunk) против _PacketReader из server-monitor.
+
+Сокет - в памяти, отдаёт данные сегментами заданного размера, так что
+измеряется только разбор, без сети. Запуск из корня репозитория:
+
+    python tests/benchmarks/bench_slp_reader.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loader import load_function
+
+monitor = load_function('server-monitor')
+
+SIZES_KB = (2, 30, 100)
+SEGMENTS = (1400, 65536)
+ROUNDS = 2000
+
+
+class MemorySocket:
+    def __init__(self, data: bytes, segment: int):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.segment = segment
+
+    def recv(self, size: int) -> bytes:
+        size = min(size, self.segment)
+        chunk = bytes(self.data[self.pos:self.pos + size])
+        self.pos += len(chunk)
+        return chunk
+
+    def recv_into(self, buf: memoryview) -> int:
+        size = min(len(buf), self.segment, len(self.data) - self.pos)
+        buf[:size] = self.data[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+
+def status_json(size_kb: int) -> bytes:
+    """
+    Ответ статуса примерно заданного размера: 150 игроков и фавикон
+    """
+    response = {
+        'version': {'name': '1.20.4', 'protocol': 765},
+        'players': {
+            'max': 500, 'online': 150,
+            'sample': [{'name': f'Player{i}', 'id': f'00000000-0000-0000-0000-{i:012d}'} for i in range(12)]
+        },
+        'description': {'text': 'Benchmark server'}
+    }
+    base = len(json.dumps(response))
+    response['favicon'] = 'data:image/png;base64,' + 'A' * max(0, size_kb * 1024 - base - 40)
+    return json.dumps(response).encode('utf-8')
+
+
+def status_packet(payload: bytes) -> bytes:
+    data = monitor._encode_varint(len(payload)) + payload
+    return monitor._pack_packet(0x00, data)
+
+
+def legacy_read_varint(sock: MemorySocket) -> int:
+    result = 0
+    for i in range(5):
+        byte = sock.recv(1)
+        if not byte:
+            raise EOFError('Unexpected end of stream')
+        byte_val = ord(byte)
+        result |= (byte_val & 0x7F) << (7 * i)
+        if not byte_val & 0x80:
+            break
+    return result
+
+
+def legacy_read(sock: MemorySocket) -> bytes:
+    legacy_read_varint(sock)
+    legacy_read_varint(sock)
+    data_length = legacy_read_varint(sock)
+    data = b''
+    while len(data) < data_length:
+        chunk = sock.recv(data_length - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def buffered_read(sock: MemorySocket) -> memoryview:
+    _, payload = monitor._PacketReader(sock).read_packet()
+    data_length, offset = monitor._decode_varint(payload, 0)
+    return payload[offset:offset + data_length]
+
+
+def main() -> None:
+    for size_kb in SIZES_KB:
+        payload = status_json(size_kb)
+        packet = status_packet(payload)
+        for segment in SEGMENTS:
+            timings = {}
+            for name, read in (('legacy', legacy_read), ('buffered', buffered_read)):
+                assert bytes(read(MemorySocket(packet, segment))) == payload
+                started = time.perf_counter()
+                for _ in range(ROUNDS):
+                    read(MemorySocket(packet, segment))
+                timings[name] = (time.perf_counter() - started) / ROUNDS * 1e6
+            print(f"{size_kb:>4} KB, segment {segment:>5}: legacy {timings['legacy']:7.1f} us, "
+                  f"buffered {timings['buffered']:7.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""
+Загрузка index.py облачной функции для тестов и бенчмарков.
+
+У всех функций модуль называется index, поэтому каждая грузится под своим
+именем (server_monitor_index, products_index, ...), иначе в одном процессе
+они затирали бы друг друга. Каталог функции добавляется в sys.path ради
+pg_pool.py, который лежит рядом с index.py
+"""
+import importlib.util
+import os
+import sys
+from types import ModuleType
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+
+def load_function(name: str) -> ModuleType:
+    module_name = name.replace('-', '_') + '_index'
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    
+    function_dir = os.path.join(BACKEND_DIR, name)
+    if function_dir not in sys.path:
+        sys.path.insert(0, function_dir)
+    
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(function_dir, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,211 @@
+import socket
+from types import SimpleNamespace
+
+import pytest
+
+from loader import load_function
+
+dns_resolver = pytest.importorskip('dns.resolver')
+monitor = load_function('server-monitor')
+
+
+class StubResolver:
+    """
+    Резолвер с заранее заданными ответами: {(имя, тип): (записи, ttl)}.
+    Имя без записей любого типа - NXDOMAIN, без записей нужного типа - NoAnswer
+    """
+    
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+        self.lifetime = None
+    
+    def resolve(self, name, rdtype):
+        self.queries.append((name, rdtype))
+        if (name, rdtype) in self.records:
+            records, ttl = self.records[(name, rdtype)]
+            return StubAnswer(records, ttl)
+        if any(known == name for known, _ in self.records):
+            raise dns_resolver.NoAnswer()
+        raise dns_resolver.NXDOMAIN()
+
+
+class StubAnswer(list):
+    def __init__(self, records, ttl):
+        super().__init__(records)
+        self.rrset = SimpleNamespace(ttl=ttl)
+
+
+def srv(target, port, priority=0, weight=0):
+    return SimpleNamespace(target=target + '.', port=port, priority=priority, weight=weight)
+
+
+def address(value):
+    return SimpleNamespace(address=value)
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    def install(records):
+        stub = StubResolver(records)
+        monkeypatch.setattr(monitor, '_dns_resolver', stub)
+        return stub
+    
+    monitor._dns_cache.clear()
+    yield install
+    monitor._dns_cache.clear()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(monitor.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_srv_hit_redirects_host_and_port(resolver):
+    stub = resolver({
+        ('_minecraft._tcp.play.example', 'SRV'): ([srv('backup.example', 25590, priority=10),
+                                                   srv('mc.example', 25570, priority=0)], 300),
+        ('mc.example', 'A'): ([address('192.0.2.10')], 300),
+    })
+    
+    host, port, addresses = monitor.resolve_minecraft_address('play.example', 25565, 1.0)
+    
+    assert (host, port) == ('mc.example', 25570)
+    assert addresses == [(socket.AF_INET, ('192.0.2.10', 25570))]
+    
+    queries = len(stub.queries)
+    assert monitor.resolve_minecraft_address('play.example', 25565, 1.0) == (host, port, addresses)
+    assert len(stub.queries) == queries
+
+
+def test_srv_miss_keeps_host_and_is_cached(resolver):
+    stub = resolver({
+        ('play.example', 'A'): ([address('192.0.2.20')], 300),
+        ('_minecraft._tcp.play.example', 'TXT'): ([], 300),
+    })
+    
+    host, port, addresses = monitor.resolve_minecraft_address('play.example', 25565, 1.0)
+    
+    assert (host, port) == ('play.example', 25565)
+    assert addresses == [(socket.AF_INET, ('192.0.2.20', 25565))]
+    
+    monitor.resolve_minecraft_address('play.example', 25565, 1.0)
+    assert stub.queries.count(('_minecraft._tcp.play.example', 'SRV')) == 1
+
+
+def test_srv_is_skipped_for_explicit_port(resolver):
+    stub = resolver({('play.example', 'A'): ([address('192.0.2.30')], 300)})
+    
+    host, port, _ = monitor.resolve_minecraft_address('play.example', 25570, 1.0)
+    
+    assert (host, port) == ('play.example', 25570)
+    assert all(rdtype != 'SRV' for _, rdtype in stub.queries)
+
+
+def test_ip_literal_skips_dns(resolver):
+    stub = resolver({})
+    
+    assert monitor.resolve_minecraft_address('203.0.113.5', 25565, 1.0) == \
+        ('203.0.113.5', 25565, [(socket.AF_INET, ('203.0.113.5', 25565))])
+    assert stub.queries == []
+
+
+def test_nxdomain_is_cached_for_negative_ttl(resolver, clock, monkeypatch):
+    stub = resolver({})
+    system_lookups = []
+    
+    def getaddrinfo(host, port, **kwargs):
+        system_lookups.append(host)
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+    
+    monkeypatch.setattr(monitor.socket, 'getaddrinfo', getaddrinfo)
+    
+    with pytest.raises(socket.gaierror):
+        monitor.resolve_addresses('missing.example', 25565, 1.0)
+    assert stub.queries == [('missing.example', 'AAAA')]
+    assert system_lookups == ['missing.example']
+    
+    with pytest.raises(socket.gaierror):
+        monitor.resolve_addresses('missing.example', 25565, 1.0)
+    assert len(stub.queries) == 1
+    assert len(system_lookups) == 1
+    
+    clock[0] += monitor.DNS_NEGATIVE_TTL + 1
+    with pytest.raises(socket.gaierror):
+        monitor.resolve_addresses('missing.example', 25565, 1.0)
+    assert len(system_lookups) == 2
+
+
+def test_addresses_expire_with_clamped_ttl(resolver, clock):
+    stub = resolver({
+        ('mc.example', 'AAAA'): ([address('2001:db8::1')], 1),
+        ('mc.example', 'A'): ([address('192.0.2.40')], 600),
+    })
+    
+    addresses = monitor.resolve_addresses('mc.example', 25565, 1.0)
+    assert addresses == [(socket.AF_INET6, ('2001:db8::1', 25565)), (socket.AF_INET, ('192.0.2.40', 25565))]
+    
+    # TTL берётся минимальный из ответов, но не меньше DNS_MIN_TTL
+    clock[0] += monitor.DNS_MIN_TTL - 1
+    monitor.resolve_addresses('mc.example', 25565, 1.0)
+    assert len(stub.queries) == 2
+    
+    clock[0] += 2
+    monitor.resolve_addresses('mc.example', 25565, 1.0)
+    assert len(stub.queries) == 4
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(4)
+    yield server
+    server.close()
+
+
+def closed_port(family, host):
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.bind((host, 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_happy_eyeballs_falls_back_from_ipv6_to_ipv4(listener):
+    port = listener.getsockname()[1]
+    try:
+        v6_port = closed_port(socket.AF_INET6, '::1')
+    except OSError:
+        v6_port = port
+    
+    sock = monitor.connect_happy_eyeballs([
+        (socket.AF_INET, ('127.0.0.1', port)),
+        (socket.AF_INET6, ('::1', v6_port)),
+    ], timeout=2.0, delay=0.05)
+    try:
+        assert sock.family == socket.AF_INET
+        assert sock.getpeername() == ('127.0.0.1', port)
+    finally:
+        sock.close()
+
+
+def test_happy_eyeballs_tries_ipv6_first():
+    assert monitor._interleave_families([
+        (socket.AF_INET, ('192.0.2.1', 1)),
+        (socket.AF_INET, ('192.0.2.2', 1)),
+        (socket.AF_INET6, ('2001:db8::1', 1)),
+    ]) == [
+        (socket.AF_INET6, ('2001:db8::1', 1)),
+        (socket.AF_INET, ('192.0.2.1', 1)),
+        (socket.AF_INET, ('192.0.2.2', 1)),
+    ]
+
+
+def test_happy_eyeballs_reports_failure_when_nothing_answers():
+    port = closed_port(socket.AF_INET, '127.0.0.1')
+    
+    with pytest.raises(OSError):
+        monitor.connect_happy_eyeballs([(socket.AF_INET, ('127.0.0.1', port))], timeout=1.0, delay=0.05)
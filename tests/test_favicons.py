@@ -0,0 +1,53 @@
+import base64
+
+import pytest
+
+from loader import load_function
+
+monitor = load_function('server-monitor')
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+
+
+def data_url(data, mime='image/png'):
+    return f'data:{mime};base64,' + base64.b64encode(data).decode('ascii')
+
+
+@pytest.fixture(autouse=True)
+def clear_favicons():
+    monitor._favicon_pending.clear()
+    monitor._favicon_stored.clear()
+    yield
+    monitor._favicon_pending.clear()
+    monitor._favicon_stored.clear()
+
+
+def test_png_is_hashed_and_kept_until_stored():
+    favicon_hash = monitor.remember_favicon(data_url(PNG))
+    
+    assert favicon_hash is not None
+    assert monitor._favicon_pending[favicon_hash] == PNG
+    
+    monitor.mark_favicons_stored([favicon_hash])
+    assert favicon_hash not in monitor._favicon_pending
+    assert monitor.remember_favicon(data_url(PNG)) == favicon_hash
+    assert favicon_hash not in monitor._favicon_pending
+
+
+@pytest.mark.parametrize('value', [
+    data_url(b'<svg onload="alert(1)"/>', 'image/svg+xml'),
+    data_url(b'<svg onload="alert(1)"/>'),
+    'data:image/png;base64,not base64 at all',
+    {'url': 'x'},
+    None,
+])
+def test_invalid_favicon_gets_no_hash(value):
+    assert monitor.remember_favicon(value) is None
+    assert monitor._favicon_pending == {}
+
+
+def test_no_hash_when_pending_is_full(monkeypatch):
+    monkeypatch.setattr(monitor, 'FAVICON_PENDING_MAX', 1)
+    
+    assert monitor.remember_favicon(data_url(PNG)) is not None
+    assert monitor.remember_favicon(data_url(PNG + b'\x01')) is None
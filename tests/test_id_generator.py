@@ -0,0 +1,163 @@
+import json
+import secrets
+import threading
+import time
+
+import pytest
+
+from loader import load_function
+
+products = load_function('products')
+
+GENERATORS = 64
+IDS_PER_GENERATOR = 5000
+
+
+def test_ids_are_fixed_width_and_ordered():
+    generator = products.IdGenerator(1)
+    ids = [generator.next_id() for _ in range(10000)]
+    
+    assert all(len(value) == products.ID_LENGTH for value in ids)
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+
+
+def test_concurrent_generators_with_random_workers_do_not_collide():
+    generators = [products.IdGenerator(secrets.randbits(products.ID_WORKER_BITS)) for _ in range(GENERATORS)]
+    results = [[] for _ in generators]
+    barrier = threading.Barrier(GENERATORS)
+    
+    def run(index):
+        barrier.wait()
+        results[index] = [generators[index].next_id() for _ in range(IDS_PER_GENERATOR)]
+    
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(GENERATORS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    all_ids = [value for ids in results for value in ids]
+    assert len(all_ids) == GENERATORS * IDS_PER_GENERATOR
+    assert len(set(all_ids)) == len(all_ids)
+    assert all(ids == sorted(ids) for ids in results)
+
+
+def test_shared_generator_is_unique_across_threads():
+    generator = products.IdGenerator(7)
+    results = [[] for _ in range(32)]
+    
+    def run(index):
+        results[index] = [generator.next_id() for _ in range(IDS_PER_GENERATOR)]
+    
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(results))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    all_ids = [value for ids in results for value in ids]
+    assert len(set(all_ids)) == len(all_ids)
+    assert all(ids == sorted(ids) for ids in results)
+
+
+def test_clock_step_back_keeps_ids_monotonic(monkeypatch):
+    generator = products.IdGenerator(3)
+    now = [time.time()]
+    monkeypatch.setattr(products.time, 'time', lambda: now[0])
+    
+    before = [generator.next_id() for _ in range(100)]
+    now[0] -= 5
+    after = [generator.next_id() for _ in range(100)]
+    
+    assert before + after == sorted(before + after)
+    assert len(set(before + after)) == 200
+
+
+def test_single_thread_throughput():
+    generator = products.IdGenerator(5)
+    count = 100000
+    
+    started = time.perf_counter()
+    for _ in range(count):
+        generator.next_id()
+    elapsed = time.perf_counter() - started
+    
+    # Замер порядка 200k id/s; порог с большим запасом на медленные машины
+    assert count / elapsed > 20000
+
+
+class UniqueViolation(Exception):
+    pgcode = '23505'
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.row = None
+    
+    def execute(self, query, params=None):
+        self.conn.purchase_ids.append(params['purchase_id'])
+        if len(self.conn.purchase_ids) == 1:
+            raise UniqueViolation('duplicate key value violates unique constraint "purchases_pkey"')
+        self.row = ('Кит', 10, ['survival'], 'give Steve kit', params['purchase_id'],
+                    [['survival', '127.0.0.1', 25575, 'secret']], None)
+    
+    def fetchone(self):
+        return self.row
+    
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.purchase_ids = []
+        self.rollbacks = 0
+    
+    def cursor(self):
+        return FakeCursor(self)
+    
+    def commit(self):
+        pass
+    
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_purchase_retries_with_new_id_on_unique_violation(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(products.db_pool, 'getconn', lambda: conn)
+    monkeypatch.setattr(products.db_pool, 'putconn', lambda c: None)
+    monkeypatch.setattr(products, 'PURCHASE_DELIVERY_MODE', 'queue')
+    
+    response = products.handle_purchase({'body': json.dumps({
+        'productId': 'kit', 'playerNickname': 'Steve', 'serverId': 'survival'
+    })})
+    body = json.loads(response['body'])
+    
+    assert response['statusCode'] == 202
+    assert conn.rollbacks == 1
+    assert len(set(conn.purchase_ids)) == 2
+    assert body['purchaseId'] == conn.purchase_ids[-1]
+
+
+@pytest.mark.parametrize('error', [RuntimeError('connection lost'), UniqueViolation('dup')])
+def test_purchase_gives_up_on_other_errors_and_after_attempts(monkeypatch, error):
+    class FailingCursor(FakeCursor):
+        def execute(self, query, params=None):
+            self.conn.purchase_ids.append(params['purchase_id'])
+            raise error
+    
+    conn = FakeConnection()
+    conn.cursor = lambda: FailingCursor(conn)
+    monkeypatch.setattr(products.db_pool, 'getconn', lambda: conn)
+    monkeypatch.setattr(products.db_pool, 'putconn', lambda c: None)
+    
+    response = products.handle_purchase({'body': json.dumps({
+        'productId': 'kit', 'playerNickname': 'Steve', 'serverId': 'survival'
+    })})
+    
+    assert response['statusCode'] == 500
+    expected = products.ID_INSERT_ATTEMPTS if isinstance(error, UniqueViolation) else 1
+    assert len(conn.purchase_ids) == expected
@@ -0,0 +1,25 @@
+import pytest
+
+from loader import load_function
+
+products = load_function('products')
+
+
+def test_rejects_non_scalar_text_fields():
+    for key, value in (('name', {'ru': 'Меч'}), ('description', ['a']), ('id', {'x': 1}),
+                       ('commandTemplate', True), ('category', [1])):
+        with pytest.raises(ValueError):
+            products.normalize_import_row({key: value}, set())
+
+
+def test_numeric_text_fields_become_strings():
+    row = products.normalize_import_row({'id': 42, 'name': 7, 'price': '10'}, set())
+    assert row[0] == '42' and row[1] == '7' and row[2] == 10.0
+
+
+def test_copy_csv_field_quotes_everything_but_bool_and_none():
+    assert products.copy_csv_field(None) == ''
+    assert products.copy_csv_field(True) == 't'
+    assert products.copy_csv_field('') == '""'
+    assert products.copy_csv_field(12.5) == '"12.5"'
+    assert products.copy_csv_field('{"a,b"}') == '"{""a,b""}"'
@@ -0,0 +1,177 @@
+import random
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from loader import load_function
+
+monitor = load_function('server-monitor')
+
+
+class FakeQueryServer:
+    """
+    UDP Query-сервер (GameSpy4) как у ванильного Minecraft: handshake выдаёт
+    challenge-токен, full stat с чужим токеном молча игнорируется
+    """
+    
+    def __init__(self, players, max_players=200, motd='§aTest MOTD'):
+        self.players = players
+        self.max_players = max_players
+        self.motd = motd
+        self.token = random.randint(1, 10 ** 7)
+        self.handshakes = 0
+        self.stats = 0
+        self.ignored = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.05)
+        self.port = self.sock.getsockname()[1]
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+    
+    def rotate_token(self):
+        self.token += 1
+    
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        self.sock.close()
+    
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            if data[:2] != b'\xfe\xfd' or len(data) < 7:
+                continue
+            packet_type, session_id = struct.unpack_from('>Bi', data, 2)
+            if packet_type == 9:
+                self.handshakes += 1
+                self.sock.sendto(struct.pack('>Bi', 9, session_id) + str(self.token).encode() + b'\x00', addr)
+            elif packet_type == 0:
+                token, = struct.unpack_from('>i', data, 7)
+                if token != self.token or len(data) != 15:
+                    self.ignored += 1
+                    continue
+                self.stats += 1
+                self.sock.sendto(struct.pack('>Bi', 0, session_id) + self._full_stat(), addr)
+    
+    def _full_stat(self):
+        fields = [
+            b'hostname', self.motd.encode('utf-8'), b'gametype', b'SMP', b'game_id', b'MINECRAFT',
+            b'version', b'1.20.4', b'plugins', b'', b'map', b'world',
+            b'numplayers', str(len(self.players)).encode(), b'maxplayers', str(self.max_players).encode(),
+            b'hostport', b'25565', b'hostip', b'127.0.0.1'
+        ]
+        return (b'splitnum\x00\x80\x00' + b'\x00'.join(fields) + b'\x00\x00\x01player_\x00\x00'
+                + b''.join(name.encode('utf-8') + b'\x00' for name in self.players) + b'\x00')
+
+
+@pytest.fixture(autouse=True)
+def clear_tokens():
+    monitor._query_tokens.clear()
+    yield
+    monitor._query_tokens.clear()
+
+
+@pytest.fixture
+def server_factory():
+    servers = []
+    
+    def create(players):
+        server = FakeQueryServer(players)
+        servers.append(server)
+        return server
+    
+    yield create
+    for server in servers:
+        server.close()
+
+
+def free_udp_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_full_player_list(server_factory):
+    players = [f'Player{i}' for i in range(150)] + ['Стив', 'Алекс']
+    server = server_factory(players)
+    target = ('127.0.0.1', server.port)
+    
+    result = monitor.query_servers([target], timeout=2.0)[target]
+    
+    assert result['isOnline'] is True
+    assert result['playerList'] == players
+    assert result['onlinePlayers'] == len(players)
+    assert result['maxPlayers'] == 200
+    assert result['version'] == '1.20.4'
+    assert result['motd'] == '§aTest MOTD'
+    assert server.handshakes == 1
+
+
+def test_cached_token_skips_handshake(server_factory):
+    server = server_factory(['Steve'])
+    target = ('127.0.0.1', server.port)
+    
+    monitor.query_servers([target], timeout=2.0)
+    result = monitor.query_servers([target], timeout=2.0)[target]
+    
+    assert result['playerList'] == ['Steve']
+    assert server.handshakes == 1
+    assert server.stats == 2
+
+
+def test_changed_token_is_refreshed_with_handshake(server_factory):
+    server = server_factory(['Steve'])
+    target = ('127.0.0.1', server.port)
+    monitor.query_servers([target], timeout=2.0)
+    
+    server.rotate_token()
+    result = monitor.query_servers([target], timeout=2.0)[target]
+    
+    assert result['playerList'] == ['Steve']
+    assert server.ignored == 1
+    assert server.handshakes == 2
+
+
+def test_expired_token_is_replaced_by_handshake(server_factory):
+    server = server_factory(['Steve'])
+    target = ('127.0.0.1', server.port)
+    monitor.query_servers([target], timeout=2.0)
+    
+    stored_at, token = monitor._query_tokens[target]
+    monitor._query_tokens[target] = (stored_at - monitor.QUERY_TOKEN_TTL - 1, token)
+    result = monitor.query_servers([target], timeout=2.0)[target]
+    
+    assert result['playerList'] == ['Steve']
+    assert server.handshakes == 2
+    assert server.ignored == 0
+
+
+def test_dead_port_times_out_to_none():
+    target = ('127.0.0.1', free_udp_port())
+    
+    started = time.monotonic()
+    result = monitor.query_servers([target], timeout=0.6)
+    
+    assert result == {target: None}
+    assert time.monotonic() - started < 1.5
+
+
+def test_dead_port_does_not_block_live_server(server_factory):
+    server = server_factory(['Steve', 'Alex'])
+    live = ('127.0.0.1', server.port)
+    dead = ('127.0.0.1', free_udp_port())
+    
+    results = monitor.query_servers([live, dead], timeout=0.6)
+    
+    assert results[live]['playerList'] == ['Steve', 'Alex']
+    assert results[dead] is None
@@ -0,0 +1,152 @@
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from loader import load_function
+
+products = load_function('products')
+
+
+class FakeRconServer:
+    """
+    RCON-сервер в потоке. mode: ok - отвечает на всё; stall - авторизует,
+    но не отвечает на команды; silent - принимает соединение и молчит
+    """
+    
+    def __init__(self, mode='ok'):
+        self.mode = mode
+        self.connections = 0
+        self.commands = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.sock.settimeout(0.05)
+        self.port = self.sock.getsockname()[1]
+        self._clients = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        for client in self._clients:
+            client.close()
+        self.sock.close()
+    
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            self.connections += 1
+            self._clients.append(client)
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+    
+    def _serve(self, client):
+        try:
+            while True:
+                header = self._read(client, 4)
+                data = self._read(client, struct.unpack('<i', header)[0])
+                request_id, packet_type = struct.unpack('<ii', data[:8])
+                payload = data[8:-2].decode('utf-8')
+                if self.mode == 'silent':
+                    continue
+                if packet_type == 3:
+                    self._send(client, request_id, 2, '')
+                    continue
+                self.commands.append(payload)
+                if self.mode == 'ok':
+                    self._send(client, request_id, 0, f'ok {payload}')
+        except OSError:
+            pass
+    
+    @staticmethod
+    def _read(client, size):
+        buf = b''
+        while len(buf) < size:
+            chunk = client.recv(size - len(buf))
+            if not chunk:
+                raise OSError('closed')
+            buf += chunk
+        return buf
+    
+    @staticmethod
+    def _send(client, request_id, packet_type, payload):
+        data = struct.pack('<ii', request_id, packet_type) + payload.encode('utf-8') + b'\x00\x00'
+        client.sendall(struct.pack('<i', len(data)) + data)
+
+
+@pytest.fixture
+def rcon_server():
+    servers = []
+    
+    def create(mode='ok'):
+        server = FakeRconServer(mode)
+        servers.append(server)
+        return server
+    
+    yield create
+    for server in servers:
+        server.close()
+
+
+def items(count):
+    return [(f'purchase{i}', f'give Steve diamond {i}') for i in range(count)]
+
+
+def test_batch_uses_one_session(rcon_server):
+    server = rcon_server('ok')
+    
+    results = products.deliver_batch('ok-server', ('127.0.0.1', server.port, 'secret'), items(20),
+                                     time.monotonic() + 5)
+    
+    assert [status for _, _, status, _, _ in results] == ['delivered'] * 20
+    assert server.connections == 1
+
+
+def test_stalled_server_is_bounded_by_deadline(rcon_server):
+    server = rcon_server('stall')
+    
+    started = time.monotonic()
+    results = products.deliver_batch('stall-server', ('127.0.0.1', server.port, 'secret'), items(10),
+                                     started + 0.5)
+    
+    assert time.monotonic() - started < 1.5
+    statuses = [status for _, _, status, _, _ in results]
+    # Первая команда ушла без ответа, остальные не отправлялись вовсе
+    assert statuses == ['unknown'] + ['failed'] * 9
+    assert server.commands == ['give Steve diamond 0']
+
+
+def test_groups_keep_healthy_server_when_another_is_silent(rcon_server):
+    healthy = rcon_server('ok')
+    silent = rcon_server('silent')
+    groups = {
+        'healthy': {'server': ('127.0.0.1', healthy.port, 'secret'), 'items': items(3)},
+        'silent': {'server': ('127.0.0.1', silent.port, 'secret'), 'items': items(3)},
+        'removed': {'server': None, 'items': items(1)},
+    }
+    
+    started = time.monotonic()
+    results = products.deliver_groups(groups, started + 0.5)
+    
+    assert time.monotonic() - started < 1.5
+    by_server = {}
+    for _, server_id, status, _, _ in results:
+        by_server.setdefault(server_id, []).append(status)
+    assert by_server == {'healthy': ['delivered'] * 3, 'silent': ['failed'] * 3, 'removed': ['failed']}
+
+
+def test_batch_past_deadline_sends_nothing(rcon_server):
+    server = rcon_server('ok')
+    
+    results = products.deliver_batch('late-server', ('127.0.0.1', server.port, 'secret'), items(2),
+                                     time.monotonic() - 1)
+    
+    assert [status for _, _, status, _, _ in results] == ['failed', 'failed']
+    assert server.connections == 0